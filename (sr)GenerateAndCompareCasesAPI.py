@@ -7,27 +7,44 @@ import urllib.parse
 from HandleUpload import  *
 import asyncio
 import aiohttp
-import requests
 import datetime
-import chardet
 from typing import Union, List, Dict, Any, Tuple, Optional
 from dataclasses import dataclass, field
-from collections import Counter
-import difflib
 import sys
 import glob
+import pathlib
 import argparse
-
-# --- 创建必要的目录结构 ---
-os.makedirs("goldenset", exist_ok=True)
-os.makedirs("testset", exist_ok=True)
-os.makedirs("log", exist_ok=True)
-os.makedirs("output_evaluation/evaluation_json", exist_ok=True)
-os.makedirs("output_evaluation/evaluation_markdown", exist_ok=True)
+import hashlib
+import itertools
+import weakref
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from metrics import span, traced, record_tokens
+from transport import (call_with_retries, parse_retry_after, RetryableError, TransportError,
+                       RETRY_STATUSES)
+from json_extract import extract_json, JSONExtractError
+from model_routing import stage_params, use_profile
+from json_stream import iter_cases, source_size
+from case_analysis import EvaluationInput, build_evaluation_input, format_cases, prepare_file
+from report_renderer import render_markdown_report, render_matrix_report, summarize_evaluation
+
+# --- 必要的目录结构，在开始评测时创建，导入模块时不做文件系统操作 ---
+OUTPUT_DIRS = (
+    "goldenset",
+    "testset",
+    "log",
+    "output_evaluation/evaluation_json",
+    "output_evaluation/evaluation_markdown",
+)
+
+
+def ensure_output_dirs():
+    for directory in OUTPUT_DIRS:
+        os.makedirs(directory, exist_ok=True)
 
 # --- 配置区 ---
-# API的URL，从curl命令中获取
-API_URL = "https://ark.cn-beijing.volces.com/api/v3/chat/completions"
+# API的URL，从curl命令中获取；可通过 ARK_BASE_URL 指向本地 mock_ark_server 做压测
+API_URL = f"{os.environ.get('ARK_BASE_URL') or 'https://ark.cn-beijing.volces.com/api/v3'}/chat/completions"
 
 MODEL_NAME = "deepseek-r1-250528"
 
@@ -39,19 +56,25 @@ AI_CASES_FILE = "testset/test_cases.json"  # 从testset文件夹读取
 GOLDEN_CASES_FILE = "goldenset/golden_cases.json"  # 从goldenset文件夹读取
 
 # 输出报告文件名
-current_time = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+# 时间戳后加上进程号，同一秒内启动的多个评测进程不会互相覆盖输出文件
+current_time = f"{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}-{os.getpid()}"
+MATRIX_REPORT_FILE = f"output_evaluation/evaluation_markdown/evaluation_matrix-{current_time}.md"  # 矩阵评测对比表
+MATRIX_JSON_FILE = f"output_evaluation/evaluation_json/evaluation_matrix-{current_time}.json"
 REPORT_FILE = f"output_evaluation/evaluation_markdown/evaluation_report-{current_time}.md"  # 输出到evaluation_markdown文件夹
 REPORT_JSON_FILE = f"output_evaluation/evaluation_json/evaluation_report-{current_time}.json"  # 输出到evaluation_json文件夹
+REPORT_NARRATIVE_FILE = f"output_evaluation/evaluation_markdown/evaluation_report-{current_time}-narrative.md"  # 模型叙述性分析（可选）
 FORMATTED_AI_CASES_FILE = f"testset/formatted_test_cases-{current_time}.json"  # 保存在testset文件夹
 FORMATTED_GOLDEN_CASES_FILE = f"goldenset/formatted_golden_cases-{current_time}.json"  # 保存在goldenset文件夹
 LOG_FILE = "log/evaluation_log.txt"  # 日志文件保存在log文件夹
 
 # --- 优化配置 ---
 # 并行处理配置
-MAX_CONCURRENT_REQUESTS = 5  # 最大并发LLM请求数
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("EVAL_LLM_CONCURRENCY", "5"))  # 最大并发LLM请求数（同一事件循环内共享）
 MAX_CASES_COUNT = None  # 不限制处理的测试用例数量
 FORMAT_CASES_LIMIT = None  # 格式化时不限制测试用例数量
 MAX_TOKEN_SIZE = 8000  # LLM处理的最大文本长度
+# 报告由本地模板生成；开启后另在后台调用模型撰写叙述性分析，保存到 REPORT_NARRATIVE_FILE
+REPORT_NARRATIVE = os.environ.get("REPORT_LLM_NARRATIVE", "0") == "1"
 
 # --- 日志记录功能 ---
 start_time = None
@@ -89,6 +112,7 @@ def start_logging():
     """开始日志记录"""
     global start_time
     start_time = time.time()
+    ensure_output_dirs()
     
     # 创建分隔符，使用追加模式
     with open(LOG_FILE, "a", encoding="utf-8") as f:
@@ -110,11 +134,24 @@ def end_logging():
         log("日志结束，但未找到开始时间记录")
 
 # --- LLM 通信模块 ---
+# 每个事件循环一个信号量，所有 LLM 请求共享 MAX_CONCURRENT_REQUESTS 的并发额度
+_llm_semaphores = weakref.WeakKeyDictionary()
+
+def _llm_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphore = _llm_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _llm_semaphores[loop] = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    return semaphore
+
 async def async_call_llm(
     session: aiohttp.ClientSession,
     prompt: str, 
     system_prompt: str = "You are a helpful assistant.",
-    retries: int = 3
+    retries: int = 3,
+    expect_json: bool = True,
+    stage: Optional[str] = None,
+    model_name: Optional[str] = None
 ) -> Optional[Dict]:
     """
     异步调用LLM API
@@ -123,6 +160,9 @@ async def async_call_llm(
     :param prompt: 用户输入的提示
     :param system_prompt: 系统角色提示
     :param retries: 重试次数
+    :param expect_json: 是否从回复中提取JSON，为False时直接返回 {"text": 回复内容}
+    :param stage: 评测阶段，按当前 profile 选择模型，未配置时使用 MODEL_NAME
+    :param model_name: 指定模型，优先于 profile 的配置（如矩阵评测中的各评审模型）
     :return: 解析后的JSON对象，失败则返回None
     """
     log(f"调用LLM: prompt长度={len(prompt)}")
@@ -137,91 +177,117 @@ async def async_call_llm(
     }
     
     payload = {
-        "model": MODEL_NAME,
+        **stage_params(stage, MODEL_NAME),
         "messages": [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": prompt}
         ]
     }
+    if model_name:
+        payload["model"] = model_name
+    model = payload["model"]
     
-    for attempt in range(retries):
-        try:
-            call_start = time.time()
-            async with session.post(
-                API_URL, 
-                headers=headers, 
-                json=payload, 
-                timeout=120
-            ) as response:
-                if response.status != 200:
-                    log(f"LLM API调用失败，状态码: {response.status}，重试中 ({attempt+1}/{retries})", important=True)
-                    await asyncio.sleep(1 * (attempt + 1))  # 指数退避
-                    continue
-                    
-                response_json = await response.json()
-                content = response_json['choices'][0]['message']['content']
-                
-                # 从Markdown代码块提取JSON
-                if "```json" in content:
-                    content = content.split("```json")[1].split("```")[0].strip()
-                elif "```" in content:
-                    content = content.split("```")[1].split("```")[0].strip()
-                
-                call_time = time.time() - call_start
-                log(f"LLM调用成功，耗时={call_time:.1f}秒")
-                
-                try:
-                    return json.loads(content)
-                except json.JSONDecodeError:
-                    # 如果不是有效的JSON，直接返回文本内容
-                    return {"text": content}
-                
-        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-            log(f"请求异常 (尝试 {attempt+1}/{retries}): {e}")
-            await asyncio.sleep(1 * (attempt + 1))
-        except (KeyError, IndexError) as e:
-            log(f"解析响应失败: {e}")
-            return None
+    async def attempt():
+        # 只在请求进行中占用并发额度，重试退避等待期间让出
+        async with _llm_semaphore():
+            return await send()
     
-    log(f"LLM API调用失败，已重试{retries}次", important=True)
-    return None
+    async def send():
+        with span("http", "ark.chat_completions", model=model) as current:
+            try:
+                async with session.post(
+                    API_URL, 
+                    headers=headers, 
+                    json=payload, 
+                    timeout=120
+                ) as response:
+                    if response.status != 200:
+                        current.status = "error"
+                        detail = f"HTTP {response.status}: {(await response.text())[:200]}"
+                        log(f"LLM API调用失败，状态码: {response.status}", important=True)
+                        if response.status in RETRY_STATUSES:
+                            raise RetryableError("ark", detail, response.status,
+                                                 parse_retry_after(response.headers.get("Retry-After")))
+                        raise TransportError("ark", detail, response.status)
+                    return await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                current.status = "error"
+                log(f"请求异常: {e}")
+                raise RetryableError("ark", f"{type(e).__name__}: {e}") from e
+
+    call_start = time.time()
+    try:
+        # 指数退避 + 抖动、Retry-After、重试预算和熔断由 transport 统一处理
+        response_json = await call_with_retries("ark", attempt, max_attempts=retries)
+        record_tokens(model, response_json.get("usage"))
+        content = response_json['choices'][0]['message']['content']
+    except TransportError as e:
+        log(f"LLM API调用失败: {e}", important=True)
+        return None
+    except (KeyError, IndexError) as e:
+        log(f"解析响应失败: {e}")
+        return None
+    
+    call_time = time.time() - call_start
+    log(f"LLM调用成功，耗时={call_time:.1f}秒")
+    
+    if not expect_json:
+        return {"text": content}
+    
+    # 从代码块或前后说明文字中提取JSON，兼容尾随逗号和截断
+    try:
+        return extract_json(content, expect=dict)
+    except JSONExtractError:
+        # 如果不是有效的JSON，直接返回文本内容
+        return {"text": content}
+
+def _read_text(path: str) -> str:
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def _read_head(path, size: int) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read(size)
+
+
+def _write_json(path: str, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def _write_text(path: str, text: str):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+async def read_text_file(path: str) -> str:
+    """在线程中读取文件，避免阻塞事件循环"""
+    return await asyncio.to_thread(_read_text, path)
+
+
+async def write_json_file(path: str, data):
+    """在线程中序列化并写入 JSON 文件，避免阻塞事件循环"""
+    await asyncio.to_thread(_write_json, path, data)
+
+
+async def write_text_file(path: str, text: str):
+    await asyncio.to_thread(_write_text, path, text)
+
 
 def extract_sample_cases(json_data, max_cases=None):
     """
     从JSON数据中提取样本测试用例
     
-    :param json_data: 原始JSON数据
+    :param json_data: 原始JSON数据（字符串或文件路径）
     :param max_cases: 最大提取的测试用例数量，None表示不限制
     :return: 样本测试用例
     """
     try:
-        data = json.loads(json_data)
-        
-        # 提取所有测试用例
-        all_cases = []
-        
-        # 处理test_cases.json格式
-        if isinstance(data, dict) and "testcases" in data:
-            testcases = data["testcases"]
-            if isinstance(testcases, dict) and "test_cases" in testcases:
-                all_cases = testcases["test_cases"] if max_cases is None else testcases["test_cases"][:max_cases]
-            elif isinstance(testcases, list):
-                all_cases = testcases if max_cases is None else testcases[:max_cases]
-        
-        # 处理golden_cases.json格式
-        elif isinstance(data, dict) and "test_cases" in data:
-            test_cases = data["test_cases"]
-            if isinstance(test_cases, dict):
-                # 将各类别的测试用例合并
-                for category, cases in test_cases.items():
-                    all_cases.extend(cases if max_cases is None else cases[:max_cases // len(test_cases.keys())])
-                    if max_cases is not None and len(all_cases) >= max_cases:
-                        all_cases = all_cases[:max_cases]
-                        break
-        
-        # 如果找不到测试用例，尝试从顶层提取
-        if not all_cases and isinstance(data, list):
-            all_cases = data if max_cases is None else data[:max_cases]
+        # 按流读取（兼容 test_cases.json、golden_cases.json 和顶层数组等结构），取够数量即停止
+        all_cases = [case for case, _category in itertools.islice(iter_cases(json_data), max_cases)]
         
         # 构建样本数据
         sample_data = {
@@ -232,98 +298,34 @@ def extract_sample_cases(json_data, max_cases=None):
         return json.dumps(sample_data, ensure_ascii=False)
     except Exception as e:
         log(f"提取样本测试用例失败: {e}")
+        if isinstance(json_data, os.PathLike):
+            return _read_head(json_data, MAX_TOKEN_SIZE).decode('utf-8', errors='ignore')
         return json_data[:MAX_TOKEN_SIZE]  # 返回原始数据的一部分
 
 # --- 格式化测试用例 ---
+@traced("stage", "format_test_cases")
 async def format_test_cases(session: aiohttp.ClientSession, file_content, file_type="AI"):
     """
     调用LLM格式化测试用例
     
     :param session: aiohttp会话
-    :param file_content: 文件内容
+    :param file_content: 文件内容（JSON字符串），或文件路径（pathlib.Path，按流读取，不整体载入内存）
     :param file_type: 文件类型，"AI"或"Golden"
     :return: 格式化后的测试用例
     """
     log(f"开始格式化{file_type}测试用例", important=True)
     
     try:
-        # 先尝试解析原始JSON数据
-        data = json.loads(file_content)
-        log(f"{file_type}测试用例JSON解析成功")
+        # 由于LLM可能处理不了大量测试用例，先自行处理所有测试用例；解析和格式化逐条进行，在线程中执行
+        data, count = await asyncio.to_thread(format_cases, file_content, file_type)
+        log(f"从原始数据中提取到{count}个测试用例", important=True)
         
-        # 如果是Golden测试用例，直接返回原始数据
+        # Golden测试用例不改写用例内容，只统一为按分类分组的结构
         if file_type == "Golden":
-            log(f"{file_type}测试用例无需格式化，保持原格式", important=True)
-            return data
-        
-        # 提取所有测试用例，不限制数量
-        all_test_cases = []
-        
-        # 从原始数据中提取测试用例
-        if isinstance(data, dict):
-            if "testcases" in data:
-                if isinstance(data["testcases"], dict) and "test_cases" in data["testcases"]:
-                    all_test_cases = data["testcases"]["test_cases"]
-                elif isinstance(data["testcases"], list):
-                    all_test_cases = data["testcases"]
-                elif isinstance(data["testcases"], dict) and "test_suite" in data["testcases"]:
-                    # 特殊情况，可能有嵌套结构
-                    if "test_cases" in data["testcases"]:
-                        all_test_cases = data["testcases"]["test_cases"]
-            elif "test_cases" in data:
-                if isinstance(data["test_cases"], list):
-                    all_test_cases = data["test_cases"]
-                elif isinstance(data["test_cases"], dict):
-                    # 合并所有分类下的测试用例
-                    for category, cases in data["test_cases"].items():
-                        all_test_cases.extend(cases)
-        elif isinstance(data, list):
-            all_test_cases = data
-            
-        log(f"从原始数据中提取到{len(all_test_cases)}个测试用例", important=True)
-        
-        # 由于LLM可能处理不了大量测试用例，先自行处理所有测试用例
-        formatted_test_cases = []
-        for i, case in enumerate(all_test_cases):
-            # 确保case_id字段
-            case_id = case.get("case_id", f"TC-FUNC-{i+1:03d}")
-            if not case_id.startswith("TC-"):
-                case_id = f"TC-FUNC-{case_id}"
-            
-            # 转换步骤和预期结果为字符串
-            steps = case.get("steps", [])
-            if isinstance(steps, list):
-                steps = "\n".join(steps)
-            
-            expected_results = case.get("expected_results", [])
-            if isinstance(expected_results, list):
-                expected_results = "\n".join(expected_results)
-            
-            # 转换前置条件为字符串
-            preconditions = case.get("preconditions", "") or case.get("前置条件", "")
-            if isinstance(preconditions, list):
-                preconditions = "\n".join(preconditions)
-            
-            # 构建格式化后的测试用例
-            formatted_case = {
-                "case_id": case_id,
-                "title": case.get("title", "") or case.get("标题", f"测试用例{i+1}"),
-                "preconditions": preconditions,
-                "steps": steps,
-                "expected_results": expected_results
-            }
-            formatted_test_cases.append(formatted_case)
-        
-        # 构建最终格式
-        final_data = {
-            "test_suite": "B端产品登录功能模块",
-            "test_cases": {
-                "functional_test_cases": formatted_test_cases
-            }
-        }
-        
-        log(f"成功格式化{len(formatted_test_cases)}个{file_type}测试用例", important=True)
-        return final_data
+            log(f"{file_type}测试用例读取成功，保持原分类", important=True)
+        else:
+            log(f"成功格式化{len(data['test_cases']['functional_test_cases'])}个{file_type}测试用例", important=True)
+        return data
         
     except json.JSONDecodeError as e:
         log(f"解析{file_type}原始JSON数据失败: {e}", important=True)
@@ -334,122 +336,40 @@ async def format_test_cases(session: aiohttp.ClientSession, file_content, file_t
         log(f"错误详情: {traceback.format_exc()}")
         return None
 
-def find_duplicate_test_cases(test_cases):
+async def prepare_evaluation_input(formatted, name: str = "") -> EvaluationInput:
     """
-    查找重复的测试用例
+    规范化用例并统计重复情况
     
-    :param test_cases: 测试用例列表
-    :return: 重复的测试用例信息和重复率
+    :param formatted: format_test_cases 的输出
+    :param name: 输入的标识，如文件路径
     """
-    # 存储标题、步骤和预期结果的哈希值
-    title_hash = {}
-    steps_hash = {}
-    expected_results_hash = {}
-    duplicate_info = {
-        "duplicate_count": 0,
-        "duplicate_rate": 0.0,
-        "title_duplicates": [],
-        "steps_duplicates": [],
-        "mixed_duplicates": []  # 步骤和预期结果高度相似但标题不同的测试用例
-    }
-    
-    total_cases = len(test_cases)
-    if total_cases <= 1:
-        return duplicate_info
-    
-    # 查找标题重复的测试用例
-    title_counter = Counter([case.get("title", "") for case in test_cases])
-    for title, count in title_counter.items():
-        if count > 1 and title:
-            duplicate_info["title_duplicates"].append({"title": title, "count": count})
-    
-    # 查找步骤或预期结果高度相似的测试用例
-    for i, case in enumerate(test_cases):
-        case_id = case.get("case_id", str(i))
-        title = case.get("title", "")
-        
-        # 处理步骤
-        steps = case.get("steps", "")
-        if steps:
-            # 如果是列表，转换为字符串
-            if isinstance(steps, list):
-                steps = "\n".join(steps)
-            
-            # 计算步骤的哈希值
-            for existing_steps, existing_ids in steps_hash.items():
-                # 使用序列匹配算法比较相似度
-                similarity = difflib.SequenceMatcher(None, steps, existing_steps).ratio()
-                if similarity > 0.8:  # 相似度阈值
-                    existing_ids.append((case_id, title))
-                    break
-            else:
-                steps_hash[steps] = [(case_id, title)]
-        
-        # 处理预期结果
-        expected_results = case.get("expected_results", "")
-        if expected_results:
-            # 如果是列表，转换为字符串
-            if isinstance(expected_results, list):
-                expected_results = "\n".join(expected_results)
-            
-            # 计算预期结果的哈希值
-            for existing_results, existing_ids in expected_results_hash.items():
-                # 使用序列匹配算法比较相似度
-                similarity = difflib.SequenceMatcher(None, expected_results, existing_results).ratio()
-                if similarity > 0.8:  # 相似度阈值
-                    existing_ids.append((case_id, title))
-                    break
-            else:
-                expected_results_hash[expected_results] = [(case_id, title)]
-    
-    # 统计步骤重复的测试用例
-    for steps, ids in steps_hash.items():
-        if len(ids) > 1:
-            duplicate_info["steps_duplicates"].append({
-                "count": len(ids),
-                "case_ids": [id[0] for id in ids],
-                "titles": [id[1] for id in ids]
-            })
-    
-    # 计算重复测试用例数量和比率
-    duplicate_count = len(duplicate_info["title_duplicates"]) + len(duplicate_info["steps_duplicates"])
-    duplicate_info["duplicate_count"] = duplicate_count
-    duplicate_info["duplicate_rate"] = round(duplicate_count / total_cases * 100, 2) if total_cases > 0 else 0
-    
-    return duplicate_info
+    # 两两相似度计算较耗 CPU，放到线程中执行，避免阻塞事件循环
+    return await asyncio.to_thread(build_evaluation_input, formatted, name)
+
+async def _as_evaluation_input(cases) -> EvaluationInput:
+    if isinstance(cases, EvaluationInput):
+        return cases
+    return await prepare_evaluation_input(cases)
 
-async def evaluate_test_cases(session: aiohttp.ClientSession, ai_cases, golden_cases):
+@traced("stage", "evaluate_test_cases")
+async def evaluate_test_cases(session: aiohttp.ClientSession, ai_cases, golden_cases, model_name: Optional[str] = None):
     """
     评测测试用例质量
     
     :param session: aiohttp会话
-    :param ai_cases: AI生成的测试用例
-    :param golden_cases: 黄金标准测试用例
+    :param ai_cases: AI生成的测试用例（format_test_cases 的输出，或 EvaluationInput）
+    :param golden_cases: 黄金标准测试用例（同上）
+    :param model_name: 评审模型（可选），默认按 profile 的 eval_judge 配置
     :return: 评测结果
     """
-    log("开始测试用例评测", important=True)
-    
-    # 获取所有测试用例
-    ai_testcases = []
-    golden_testcases = []
-    
-    # 提取AI测试用例
-    if "test_cases" in ai_cases and isinstance(ai_cases["test_cases"], dict):
-        # 新格式
-        for category, cases in ai_cases["test_cases"].items():
-            ai_testcases.extend(cases)
-    
-    # 提取黄金标准测试用例
-    if "test_cases" in golden_cases and isinstance(golden_cases["test_cases"], dict):
-        # 新格式
-        for category, cases in golden_cases["test_cases"].items():
-            golden_testcases.extend(cases)
+    log(f"开始测试用例评测{f'（评审模型: {model_name}）' if model_name else ''}", important=True)
     
-    log(f"AI测试用例数量: {len(ai_testcases)}, 黄金标准测试用例数量: {len(golden_testcases)}", important=True)
+    # 获取所有测试用例（规范化一次，供查重和评测提示共用）
+    ai_input, golden_input = await asyncio.gather(_as_evaluation_input(ai_cases),
+                                                  _as_evaluation_input(golden_cases))
+    ai_duplicate_info, golden_duplicate_info = ai_input.duplicates, golden_input.duplicates
     
-    # 检查重复的测试用例
-    ai_duplicate_info = find_duplicate_test_cases(ai_testcases)
-    golden_duplicate_info = find_duplicate_test_cases(golden_testcases)
+    log(f"AI测试用例数量: {len(ai_input.cases)}, 黄金标准测试用例数量: {len(golden_input.cases)}", important=True)
     
     log(f"AI测试用例重复率: {ai_duplicate_info['duplicate_rate']}% ({ai_duplicate_info['duplicate_count']}个)", important=True)
     log(f"黄金标准测试用例重复率: {golden_duplicate_info['duplicate_rate']}% ({golden_duplicate_info['duplicate_count']}个)", important=True)
@@ -491,12 +411,12 @@ async def evaluate_test_cases(session: aiohttp.ClientSession, ai_cases, golden_c
 
 # AI生成的测试用例
 ```json
-{json.dumps(ai_testcases, ensure_ascii=False, indent=2)}
+{ai_input.cases_json}
 ```
 
 # 黄金标准测试用例
 ```json
-{json.dumps(golden_testcases, ensure_ascii=False, indent=2)}
+{golden_input.cases_json}
 ```
 
 # 输出要求
@@ -560,120 +480,101 @@ async def evaluate_test_cases(session: aiohttp.ClientSession, ai_cases, golden_c
 """
     
     system_prompt = "你是一位专业的软件测试专家，擅长评估测试用例的质量和有效性。请基于给定的标准进行客观评价，并特别注意测试用例的重复情况。"
-    result = await async_call_llm(session, prompt, system_prompt)
+    result = await async_call_llm(session, prompt, system_prompt, stage="eval_judge", model_name=model_name)
     
     if not result:
         log("测试用例评测失败", important=True)
         return None
     
+    # 重复情况是本地统计的，附在结果中供报告使用
+    if isinstance(result, dict):
+        result["duplicate_analysis"] = {"ai": ai_duplicate_info, "golden": golden_duplicate_info}
+    
     log("测试用例评测完成", important=True)
     return result
 
 # --- 生成Markdown报告 ---
-async def generate_markdown_report(session: aiohttp.ClientSession, evaluation_result):
+@traced("stage", "generate_markdown_report")
+def generate_markdown_report(evaluation_result):
     """
-    生成Markdown格式的评测报告
+    根据评测结果在本地生成Markdown格式的评测报告，不调用模型
     
-    :param session: aiohttp会话
     :param evaluation_result: 评测结果
     :return: Markdown格式的报告
     """
     log("开始生成Markdown报告", important=True)
+    report = render_markdown_report(evaluation_result)
+    log("Markdown报告生成完成", important=True)
+    return report
+
+@traced("stage", "generate_report_narrative")
+async def generate_report_narrative(session: aiohttp.ClientSession, evaluation_result):
+    """
+    调用LLM撰写叙述性的评估分析，作为本地报告的补充（可选）
+    
+    :param session: aiohttp会话
+    :param evaluation_result: 评测结果
+    :return: Markdown文本，失败时返回None
+    """
+    log("开始生成模型叙述性分析", important=True)
     
     prompt = f"""
 # 任务
-基于提供的测试用例评估结果，生成一份详细的Markdown格式评估报告。
+基于提供的测试用例评估结果，撰写一份叙述性的评估分析，作为已有评分报告的补充。
 
 # 评估结果
 ```json
-{json.dumps(evaluation_result, ensure_ascii=False, indent=2)}
+{json.dumps(evaluation_result, ensure_ascii=False, separators=(",", ":"))}
 ```
 
-# 报告要求
-请生成一份专业、详细的Markdown格式评估报告，包含以下内容：
-
-1. **报告标题与摘要**：简要总结评估结果
-2. **评估指标与方法**：说明使用的评估标准和方法
-3. **综合评分**：根据评分标准给出1-5分的总体评分及每个维度的评分
-4. **详细分析**：
-   - 功能覆盖度分析
-   - 缺陷发现能力分析
-   - 工程效率分析
-   - 语义质量分析
-   - 安全与经济性分析
-5. **优缺点对比**：列出AI生成测试用例相对于人工标准的优势和劣势
-6. **改进建议**：给出3-5条具体可行的改进AI生成测试用例的建议
-7. **综合结论**：总结AI测试用例的整体表现和适用场景
+# 要求
+评分表格、维度得分等已在报告中列出，请不要重复，重点写：
+1. **优缺点对比**：AI生成测试用例相对于人工标准的优势和劣势，结合具体用例说明
+2. **改进建议**：3-5条具体可行的改进AI生成测试用例的建议
+3. **适用场景**：AI测试用例适合和不适合使用的场景
 
 请直接输出Markdown内容，不要包含其他解释。
 """
     
-    system_prompt = "你是一位精通软件测试和技术文档写作的专家。请根据评估结果生成一份专业、清晰的Markdown格式报告。"
-    result = await async_call_llm(session, prompt, system_prompt)
+    system_prompt = "你是一位精通软件测试和技术文档写作的专家。请根据评估结果撰写专业、清晰的分析。"
+    result = await async_call_llm(session, prompt, system_prompt, expect_json=False, stage="eval_report")
     
-    if not result:
-        log("生成Markdown报告失败", important=True)
-        return "# 评测报告生成失败\n\n无法生成详细报告，请检查评测结果或重试。"
+    if not result or not result.get("text"):
+        log("生成模型叙述性分析失败", important=True)
+        return None
     
-    # 检查是否返回的是文本还是已解析的JSON
-    if isinstance(result, dict) and "text" in result:
-        return result["text"]
+    log("模型叙述性分析生成完成", important=True)
+    return result["text"]
+
+async def write_report_narrative(evaluation_result, path=None):
+    """
+    后台任务：生成模型叙述性分析并保存到单独的文件，不影响主报告的生成
     
-    # 如果返回的是JSON对象，将其转换为Markdown
+    :return: 叙述性分析文本，失败时返回None
+    """
+    path = path or REPORT_NARRATIVE_FILE
     try:
-        if isinstance(result, dict):
-            md_content = "# AI测试用例评估报告\n\n"
-            
-            if "evaluation_summary" in result:
-                summary = result["evaluation_summary"]
-                md_content += f"## 摘要\n\n"
-                md_content += f"**总体评分**: {summary.get('overall_score', 'N/A')}\n\n"
-                md_content += f"**改进建议**: {summary.get('final_suggestion', 'N/A')}\n\n"
-            
-            if "detailed_report" in result:
-                md_content += f"## 详细评估\n\n"
-                detailed = result["detailed_report"]
-                
-                for key, value in detailed.items():
-                    if isinstance(value, dict) and "score" in value:
-                        md_content += f"### {key.replace('_', ' ').title()}\n\n"
-                        md_content += f"**评分**: {value.get('score', 'N/A')}\n\n"
-                        md_content += f"**理由**: {value.get('reason', 'N/A')}\n\n"
-                        
-                        if "analysis" in value and isinstance(value["analysis"], dict):
-                            analysis = value["analysis"]
-                            if "covered_features" in analysis:
-                                md_content += "**覆盖的功能**:\n\n"
-                                for feature in analysis["covered_features"]:
-                                    md_content += f"- {feature}\n"
-                                md_content += "\n"
-                            
-                            if "missed_features_or_scenarios" in analysis:
-                                md_content += "**未覆盖的功能或场景**:\n\n"
-                                for feature in analysis["missed_features_or_scenarios"]:
-                                    md_content += f"- {feature}\n"
-                                md_content += "\n"
-                            
-                            if "scenario_types_found" in analysis:
-                                md_content += "**发现的场景类型**:\n\n"
-                                for scenario in analysis["scenario_types_found"]:
-                                    md_content += f"- {scenario}\n"
-                                md_content += "\n"
-            
-            return md_content
+        async with aiohttp.ClientSession() as session:
+            narrative = await generate_report_narrative(session, evaluation_result)
+        if narrative:
+            await write_text_file(path, narrative)
+            log(f"模型叙述性分析已保存到 {path}", important=True)
+        return narrative
     except Exception as e:
-        log(f"处理JSON报告失败: {e}")
-    
-    log("Markdown报告生成完成", important=True)
-    return "# 评测报告生成失败\n\n无法解析评测结果，请检查数据格式。"
+        log(f"生成模型叙述性分析时发生错误: {e}", important=True)
+        return None
 
 # --- 主程序 ---
-async def async_main(ai_cases_data=None, golden_cases_data=None):
+async def async_main(ai_cases_data=None, golden_cases_data=None, narrative=None):
     """
     主程序的异步版本
     
-    :param ai_cases_data: AI生成的测试用例数据（可选），JSON字符串
-    :param golden_cases_data: 黄金标准测试用例数据（可选），JSON字符串
+    :param ai_cases_data: AI生成的测试用例数据（可选），JSON字符串或文件路径（pathlib.Path）
+    :param golden_cases_data: 黄金标准测试用例数据（可选），JSON字符串或文件路径（pathlib.Path）
+    :param narrative: 是否在后台生成模型叙述性分析，None 时按 REPORT_LLM_NARRATIVE 环境变量
+    :return: 评测结果；开启叙述性分析时带 narrative_task（后台任务，调用方需在事件循环结束前等待）
+    
+    文件只记录路径，格式化时按流读取，不整体载入内存
     """
     start_logging()
     log("启动测试用例评测流程", important=True)
@@ -684,20 +585,20 @@ async def async_main(ai_cases_data=None, golden_cases_data=None):
         if ai_cases_data is None:
             log("从文件加载AI测试用例", important=True)
             try:
-                with open(AI_CASES_FILE, 'r', encoding='utf-8') as f:
-                    ai_cases_raw_text = f.read()
-                    log(f"AI测试用例文件大小: {len(ai_cases_raw_text)} 字节")
-                    
-                    # 尝试检测文件编码
-                    encoding_result = chardet.detect(ai_cases_raw_text[:1000].encode())
-                    log(f"检测到的文件编码: {encoding_result}")
+                ai_cases_source = pathlib.Path(AI_CASES_FILE)
+                log(f"AI测试用例文件大小: {await asyncio.to_thread(source_size, ai_cases_source)} 字节")
+                
+                # 尝试检测文件编码
+                import chardet
+                encoding_result = chardet.detect(await asyncio.to_thread(_read_head, ai_cases_source, 1000))
+                log(f"检测到的文件编码: {encoding_result}")
             except FileNotFoundError:
                 log(f"错误：找不到AI测试用例文件 {AI_CASES_FILE}。请确保文件存在于正确的位置。", important=True)
                 end_logging()
                 return None
         else:
             log("使用传入的AI测试用例数据", important=True)
-            ai_cases_raw_text = ai_cases_data
+            ai_cases_source = ai_cases_data
         
         # 如果没有提供黄金标准测试用例数据，则从文件读取
         if golden_cases_data is None:
@@ -715,16 +616,15 @@ async def async_main(ai_cases_data=None, golden_cases_data=None):
             log(f"使用黄金标准测试用例文件: {golden_file}", important=True)
             
             try:
-                with open(golden_file, 'r', encoding='utf-8') as f:
-                    golden_cases_raw_text = f.read()
-                    log(f"黄金标准测试用例文件大小: {len(golden_cases_raw_text)} 字节")
+                golden_cases_source = pathlib.Path(golden_file)
+                log(f"黄金标准测试用例文件大小: {await asyncio.to_thread(source_size, golden_cases_source)} 字节")
             except FileNotFoundError:
                 log(f"错误：找不到黄金标准测试用例文件 {golden_file}。请确保文件存在于正确的位置。", important=True)
                 end_logging()
                 return None
         else:
             log("使用传入的黄金标准测试用例数据", important=True)
-            golden_cases_raw_text = golden_cases_data
+            golden_cases_source = golden_cases_data
         
         log(f"成功加载测试用例数据", important=True)
     except Exception as e:
@@ -744,29 +644,25 @@ async def async_main(ai_cases_data=None, golden_cases_data=None):
             log("开始格式化测试用例", important=True)
             
             # 格式化AI测试用例
-            formatted_ai_cases = await format_test_cases(session, ai_cases_raw_text, "AI")
+            formatted_ai_cases = await format_test_cases(session, ai_cases_source, "AI")
             if not formatted_ai_cases:
                 log("格式化AI测试用例失败，退出评测", important=True)
                 end_logging()
                 return None
             
             # 保存格式化后的AI测试用例
-            os.makedirs(os.path.dirname(FORMATTED_AI_CASES_FILE), exist_ok=True)
-            with open(FORMATTED_AI_CASES_FILE, 'w', encoding='utf-8') as f:
-                json.dump(formatted_ai_cases, f, ensure_ascii=False, indent=2)
+            await write_json_file(FORMATTED_AI_CASES_FILE, formatted_ai_cases)
             log(f"格式化后的AI测试用例已保存到 {FORMATTED_AI_CASES_FILE}", important=True)
             
             # 格式化黄金标准测试用例
-            formatted_golden_cases = await format_test_cases(session, golden_cases_raw_text, "Golden")
+            formatted_golden_cases = await format_test_cases(session, golden_cases_source, "Golden")
             if not formatted_golden_cases:
                 log("格式化黄金标准测试用例失败，退出评测", important=True)
                 end_logging()
                 return None
             
             # 保存格式化后的黄金标准测试用例
-            os.makedirs(os.path.dirname(FORMATTED_GOLDEN_CASES_FILE), exist_ok=True)
-            with open(FORMATTED_GOLDEN_CASES_FILE, 'w', encoding='utf-8') as f:
-                json.dump(formatted_golden_cases, f, ensure_ascii=False, indent=2)
+            await write_json_file(FORMATTED_GOLDEN_CASES_FILE, formatted_golden_cases)
             log(f"格式化后的黄金标准测试用例已保存到 {FORMATTED_GOLDEN_CASES_FILE}", important=True)
             
             # 3. 评测测试用例
@@ -777,30 +673,38 @@ async def async_main(ai_cases_data=None, golden_cases_data=None):
                 return None
             
             # 保存JSON格式的评测结果
-            with open(REPORT_JSON_FILE, 'w', encoding='utf-8') as f:
-                json.dump(evaluation_result, f, ensure_ascii=False, indent=2)
+            await write_json_file(REPORT_JSON_FILE, evaluation_result)
             log(f"JSON格式的评测结果已保存到 {REPORT_JSON_FILE}", important=True)
             
-            # 4. 生成Markdown格式的报告
-            markdown_report = await generate_markdown_report(session, evaluation_result)
+            # 4. 生成Markdown格式的报告（本地模板，不等待模型）
+            markdown_report = generate_markdown_report(evaluation_result)
             
             # 保存Markdown格式的报告
-            with open(REPORT_FILE, 'w', encoding='utf-8') as f:
-                f.write(markdown_report)
+            await write_text_file(REPORT_FILE, markdown_report)
             log(f"Markdown格式的评测报告已保存到 {REPORT_FILE}", important=True)
             
+            files = {
+                "report_md": REPORT_FILE,
+                "report_json": REPORT_JSON_FILE
+            }
+            # 5. 可选：后台生成模型叙述性分析，完成后另存文件
+            narrative_task = None
+            if narrative if narrative is not None else REPORT_NARRATIVE:
+                narrative_task = asyncio.create_task(write_report_narrative(evaluation_result))
+                files["report_narrative_md"] = REPORT_NARRATIVE_FILE
+            
             log("测试用例评测流程完成！", important=True)
             end_logging()
             
-            return {
+            result = {
                 "success": True,
                 "evaluation_result": evaluation_result,
                 "markdown_report": markdown_report,
-                "files": {
-                    "report_md": REPORT_FILE,
-                    "report_json": REPORT_JSON_FILE
-                }
+                "files": files
             }
+            if narrative_task is not None:
+                result["narrative_task"] = narrative_task
+            return result
         except Exception as e:
             log(f"执行过程中发生错误: {str(e)}", important=True)
             import traceback
@@ -811,12 +715,311 @@ async def async_main(ai_cases_data=None, golden_cases_data=None):
                 "error": str(e)
             }
 
-def main(ai_cases_file=None, golden_cases_file=None):
+# --- 矩阵评测 ---
+async def async_matrix_main(ai_sources, golden_sources, judge_models=None):
+    """
+    矩阵评测：N 组AI用例 × M 组黄金标准 × K 个评审模型，所有组合并发评测，
+    LLM 请求共享 MAX_CONCURRENT_REQUESTS 的并发额度；每组输入只格式化、查重一次
+    
+    :param ai_sources: AI测试用例列表，元素为文件路径（pathlib.Path）或JSON字符串
+    :param golden_sources: 黄金标准测试用例列表，同上
+    :param judge_models: 评审模型列表，为空时使用 MODEL_NAME
+    :return: {"success", "rows": 每个组合的分数, "markdown_report": 对比报告, "files"}
+    """
+    start_logging()
+    judge_models = list(dict.fromkeys(judge_models or [MODEL_NAME]))
+    log(f"启动矩阵评测：{len(ai_sources)} 组AI用例 × {len(golden_sources)} 组黄金标准 × "
+        f"{len(judge_models)} 个评审模型", important=True)
+    
+    async with aiohttp.ClientSession() as session:
+        async def prepare(source, file_type, index):
+            name = str(source) if isinstance(source, os.PathLike) else f"{file_type}#{index + 1}"
+            try:
+                formatted = await format_test_cases(session, source, file_type)
+                if formatted:
+                    return name, await prepare_evaluation_input(formatted, name)
+            except Exception as e:
+                log(f"准备{file_type}测试用例 {name} 失败: {e}", important=True)
+            return name, None
+        
+        async def evaluate_cell(ai, golden, judge):
+            (ai_name, ai_input), (golden_name, golden_input) = ai, golden
+            row = {"ai": ai_name, "golden": golden_name, "judge": judge}
+            if ai_input is None or golden_input is None:
+                return {**row, "success": False, "error": "测试用例格式化失败"}, None
+            try:
+                result = await evaluate_test_cases(session, ai_input, golden_input, model_name=judge)
+            except Exception as e:
+                log(f"评测 {ai_name} × {golden_name} × {judge} 时发生错误: {e}", important=True)
+                return {**row, "success": False, "error": str(e)}, None
+            if not result:
+                return {**row, "success": False, "error": "评测失败"}, None
+            return {**row, "success": True, **summarize_evaluation(result)}, result
+        
+        ai_inputs, golden_inputs = await asyncio.gather(
+            asyncio.gather(*(prepare(source, "AI", i) for i, source in enumerate(ai_sources))),
+            asyncio.gather(*(prepare(source, "Golden", i) for i, source in enumerate(golden_sources))))
+        cells = await asyncio.gather(*(evaluate_cell(ai, golden, judge)
+                                       for ai in ai_inputs for golden in golden_inputs for judge in judge_models))
+    
+    rows = [row for row, _result in cells]
+    markdown_report = render_matrix_report(rows)
+    await write_json_file(MATRIX_JSON_FILE, {
+        "rows": rows,
+        "results": [{"ai": row["ai"], "golden": row["golden"], "judge": row["judge"], "evaluation_result": result}
+                    for row, result in cells],
+    })
+    await write_text_file(MATRIX_REPORT_FILE, markdown_report)
+    log(f"矩阵评测完成，成功 {sum(1 for row in rows if row['success'])}/{len(rows)} 个组合，"
+        f"对比报告已保存到 {MATRIX_REPORT_FILE}", important=True)
+    end_logging()
+    
+    return {
+        "success": any(row["success"] for row in rows),
+        "rows": rows,
+        "markdown_report": markdown_report,
+        "files": {
+            "report_md": MATRIX_REPORT_FILE,
+            "report_json": MATRIX_JSON_FILE
+        }
+    }
+
+def _expand_paths(patterns) -> List[pathlib.Path]:
+    """展开通配符，保持参数顺序并去重"""
+    paths = []
+    for pattern in patterns:
+        paths.extend(sorted(glob.glob(pattern)) or [pattern])
+    return [pathlib.Path(path) for path in dict.fromkeys(paths)]
+
+def main_matrix(ai_cases_files=None, golden_cases_files=None, judge_models=None, profile=None):
+    """
+    矩阵评测的入口
+    
+    :param ai_cases_files: AI测试用例文件路径或通配符列表（可选），默认 AI_CASES_FILE
+    :param golden_cases_files: 黄金标准测试用例文件路径或通配符列表（可选），默认 goldenset/golden_cases*.json 全部文件
+    :param judge_models: 评审模型列表（可选），默认 MODEL_NAME
+    :param profile: 模型配置名称（可选）
+    """
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    
+    ai_sources = _expand_paths(ai_cases_files or [AI_CASES_FILE])
+    golden_sources = _expand_paths(golden_cases_files or ["goldenset/golden_cases*.json"])
+    missing = [str(path) for path in ai_sources + golden_sources if not path.is_file()]
+    if missing:
+        log(f"找不到测试用例文件: {', '.join(missing)}", important=True)
+        return {"success": False, "error": f"找不到测试用例文件: {', '.join(missing)}"}
+    
+    with use_profile(profile):
+        return asyncio.run(async_matrix_main(ai_sources, golden_sources, judge_models))
+
+# --- 批量评测 ---
+# 格式化和查重在进程池中执行，默认进程数为 CPU 核数（最多 8 个）
+BATCH_WORKERS = int(os.environ.get("EVAL_BATCH_WORKERS", str(min(os.cpu_count() or 1, 8))))
+# 同时进行的任务数：只有进行中的任务的输入和结果留在内存中，内存占用不随任务总数增长
+BATCH_CONCURRENCY = int(os.environ.get("EVAL_BATCH_CONCURRENCY", str(MAX_CONCURRENT_REQUESTS * 2)))
+BATCH_PROGRESS_FILE = "progress.jsonl"
+
+def _file_fingerprint(path: pathlib.Path) -> str:
+    stat = path.stat()
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+def _slug(text: str) -> str:
+    return "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in text)[:40].strip("_") or "job"
+
+def load_batch_jobs(target: str, golden_patterns=None, judge_models=None) -> List[dict]:
+    """
+    读取批量评测任务
+    
+    :param target: 清单文件（.json 数组或 .jsonl，每项 {"ai": 路径, "golden": 路径, "name": 可选, "judge": 可选}，
+        相对路径相对于清单所在目录），或目录（其中每个 *.json 作为一组AI用例，与每个黄金标准配对）
+    :param golden_patterns: 目录模式下的黄金标准文件或通配符，默认 goldenset/golden_cases*.json
+    :param judge_models: 评审模型列表，清单中未指定 judge 的任务对每个模型各评测一次；默认 MODEL_NAME
+    :return: 任务列表，每项带有由输入路径和评审模型决定的唯一 id，重复的任务只保留一个
+    """
+    judge_models = list(dict.fromkeys(judge_models or [MODEL_NAME]))
+    root = pathlib.Path(target)
+    entries = []
+    if root.is_dir():
+        goldens = _expand_paths(golden_patterns or ["goldenset/golden_cases*.json"])
+        for ai_path in sorted(root.glob("*.json")):
+            for golden_path in goldens:
+                entries.append({"ai": ai_path, "golden": golden_path, "name": ai_path.stem})
+    else:
+        with open(root, 'r', encoding='utf-8') as f:
+            if root.suffix == ".jsonl":
+                items = [json.loads(line) for line in f if line.strip()]
+            else:
+                items = json.load(f)
+        for item in items:
+            entries.append({
+                "ai": root.parent / item["ai"],
+                "golden": root.parent / item["golden"],
+                "name": item.get("name") or pathlib.Path(item["ai"]).stem,
+                "judge": item.get("judge"),
+            })
+    
+    jobs = {}
+    for entry in entries:
+        for judge in [entry["judge"]] if entry.get("judge") else judge_models:
+            key = f"{entry['ai'].resolve()}|{entry['golden'].resolve()}|{judge}"
+            job_id = f"{_slug(entry['name'])}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:10]}"
+            jobs.setdefault(job_id, {"id": job_id, "name": entry["name"], "ai": entry["ai"],
+                                     "golden": entry["golden"], "judge": judge})
+    return list(jobs.values())
+
+def _load_progress(path: pathlib.Path) -> Dict[str, dict]:
+    """读取已完成任务的记录；最后一行可能因进程中断而不完整，忽略解析失败的行"""
+    done = {}
+    if not path.exists():
+        return done
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            done[record["id"]] = record
+    return done
+
+async def async_batch_main(jobs: List[dict], out_dir: str, workers: int = BATCH_WORKERS, resume: bool = True,
+                           concurrency: int = BATCH_CONCURRENCY):
+    """
+    批量评测：格式化和查重在进程池中执行，最多 concurrency 个任务同时进行，其 LLM 评测
+    共享 MAX_CONCURRENT_REQUESTS 的并发额度。每个任务的结果写入 out_dir/<任务 id>/，
+    完成一个任务即向 progress.jsonl 追加一行；resume 时跳过已成功且输入文件未变化的任务。
+    同一文件的处理结果在用到它的最后一个任务结束后释放
+    
+    :return: {"success", "rows", "markdown_report", "files"}
+    """
+    start_logging()
+    out = pathlib.Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    progress_path = out / BATCH_PROGRESS_FILE
+    previous = _load_progress(progress_path) if resume else {}
+    
+    fingerprints = {}
+    def fingerprint(job) -> str:
+        return "|".join(fingerprints.setdefault(path, _file_fingerprint(path)) for path in (job["ai"], job["golden"]))
+    
+    pending, rows = [], {}
+    for job in jobs:
+        record = previous.get(job["id"])
+        if record and record.get("success") and record.get("fingerprint") == fingerprint(job):
+            rows[job["id"]] = record
+        else:
+            pending.append(job)
+    log(f"批量评测：共 {len(jobs)} 个任务，已完成 {len(rows)} 个，待评测 {len(pending)} 个，"
+        f"进程数 {workers}", important=True)
+    
+    loop = asyncio.get_running_loop()
+    progress_lock = asyncio.Lock()
+    prepared = {}
+    
+    def input_keys(job):
+        return [(job["ai"].resolve(), "AI"), (job["golden"].resolve(), "Golden")]
+    # 每个文件还有多少个待评测的任务要用
+    users = Counter(key for job in pending for key in input_keys(job))
+    
+    with ProcessPoolExecutor(max_workers=max(workers, 1)) as pool, open(progress_path, 'a', encoding='utf-8') as progress:
+        def prepare(path: pathlib.Path, file_type: str):
+            # 同一文件只在进程池中处理一次，多个任务共用结果
+            key = (path.resolve(), file_type)
+            if key not in prepared:
+                prepared[key] = loop.run_in_executor(pool, prepare_file, path, file_type, str(path))
+            return prepared[key]
+        
+        def release(job):
+            for key in input_keys(job):
+                users[key] -= 1
+                if users[key] <= 0:
+                    prepared.pop(key, None)
+        
+        async def run_job(job, session):
+            row = {"id": job["id"], "ai": job["name"], "golden": job["golden"].name, "judge": job["judge"],
+                   "fingerprint": fingerprint(job)}
+            job_dir = out / job["id"]
+            try:
+                ai_input, golden_input = await asyncio.gather(prepare(job["ai"], "AI"),
+                                                              prepare(job["golden"], "Golden"))
+                result = await evaluate_test_cases(session, ai_input, golden_input, model_name=job["judge"])
+                if not result:
+                    raise RuntimeError("评测失败")
+                await write_json_file(str(job_dir / "evaluation.json"), result)
+                await write_text_file(str(job_dir / "report.md"), render_markdown_report(result))
+                row.update(success=True, **summarize_evaluation(result))
+            except Exception as e:
+                log(f"批量任务 {job['id']} 失败: {e}", important=True)
+                row.update(success=False, error=str(e) or type(e).__name__)
+            finally:
+                release(job)
+            row["finished_at"] = datetime.datetime.now().isoformat(timespec="seconds")
+            async with progress_lock:
+                progress.write(json.dumps(row, ensure_ascii=False) + "\n")
+                progress.flush()
+            rows[job["id"]] = row
+        
+        # 固定数量的工作协程依次领取任务，同时只有 concurrency 个任务在进行
+        queue = iter(pending)
+        async def worker(session):
+            for job in queue:
+                await run_job(job, session)
+        
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*(worker(session) for _ in range(max(min(concurrency, len(pending)), 1))))
+    
+    ordered = [rows[job["id"]] for job in jobs if job["id"] in rows]
+    markdown_report = render_matrix_report(ordered, title="批量评测汇总")
+    await write_json_file(str(out / "summary.json"), ordered)
+    await write_text_file(str(out / "summary.md"), markdown_report)
+    succeeded = sum(1 for row in ordered if row.get("success"))
+    log(f"批量评测完成，成功 {succeeded}/{len(ordered)} 个任务，汇总已保存到 {out / 'summary.md'}", important=True)
+    end_logging()
+    
+    return {
+        "success": succeeded == len(ordered),
+        "rows": ordered,
+        "markdown_report": markdown_report,
+        "files": {
+            "report_md": str(out / "summary.md"),
+            "report_json": str(out / "summary.json"),
+            "progress": str(progress_path)
+        }
+    }
+
+def main_batch(target, out_dir=None, golden_patterns=None, judge_models=None, profile=None,
+               workers=BATCH_WORKERS, resume=True, concurrency=BATCH_CONCURRENCY):
+    """
+    批量评测的入口：一个进程内完成清单或目录中的全部任务
+    
+    :param target: 清单文件或AI用例目录，见 load_batch_jobs
+    :param out_dir: 输出目录，默认 output_evaluation/batch-<时间戳>；中断后用同一目录重新运行即可继续
+    """
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    
+    try:
+        jobs = load_batch_jobs(target, golden_patterns, judge_models)
+    except (OSError, ValueError, KeyError) as e:
+        log(f"读取批量评测任务 {target} 失败: {e}", important=True)
+        return {"success": False, "error": f"读取批量评测任务失败: {e}"}
+    missing = sorted({str(path) for job in jobs for path in (job["ai"], job["golden"]) if not path.is_file()})
+    if missing:
+        log(f"找不到测试用例文件: {', '.join(missing)}", important=True)
+        return {"success": False, "error": f"找不到测试用例文件: {', '.join(missing)}"}
+    
+    out_dir = out_dir or f"output_evaluation/batch-{current_time}"
+    with use_profile(profile):
+        return asyncio.run(async_batch_main(jobs, out_dir, workers, resume, concurrency))
+
+def main(ai_cases_file=None, golden_cases_file=None, profile=None, narrative=None):
     """
     兼容原有入口点的主函数
     
     :param ai_cases_file: AI测试用例文件路径（可选）
     :param golden_cases_file: 黄金标准测试用例文件路径（可选）
+    :param profile: 模型配置名称（可选），如 fast
+    :param narrative: 是否额外生成模型叙述性分析（可选），None 时按 REPORT_LLM_NARRATIVE 环境变量
     """
     # 如果是Windows平台，需要显式设置事件循环策略
     if os.name == 'nt':
@@ -826,11 +1029,11 @@ def main(ai_cases_file=None, golden_cases_file=None):
     ai_cases_data = None
     golden_cases_data = None
     
-    # 如果提供了文件路径，则从指定文件读取数据
+    # 如果提供了文件路径，则从指定文件读取数据（先检查文件可读，格式化时再按流读取）
     if ai_cases_file:
         try:
-            with open(ai_cases_file, 'r', encoding='utf-8') as f:
-                ai_cases_data = f.read()
+            ai_cases_data = pathlib.Path(ai_cases_file)
+            _read_head(ai_cases_data, 1)
             log(f"从文件 {ai_cases_file} 读取AI测试用例数据")
         except Exception as e:
             log(f"读取AI测试用例文件 {ai_cases_file} 失败: {e}", important=True)
@@ -838,25 +1041,38 @@ def main(ai_cases_file=None, golden_cases_file=None):
     
     if golden_cases_file:
         try:
-            with open(golden_cases_file, 'r', encoding='utf-8') as f:
-                golden_cases_data = f.read()
+            golden_cases_data = pathlib.Path(golden_cases_file)
+            _read_head(golden_cases_data, 1)
             log(f"从文件 {golden_cases_file} 读取黄金标准测试用例数据")
         except Exception as e:
             log(f"读取黄金标准测试用例文件 {golden_cases_file} 失败: {e}", important=True)
             return {"success": False, "error": f"读取黄金标准测试用例文件失败: {e}"}
     
+    async def run():
+        result = await async_main(ai_cases_data, golden_cases_data, narrative)
+        narrative_task = result.pop("narrative_task", None) if result else None
+        if narrative_task is not None:
+            # 报告已经保存，命令行进程退出前等待后台的叙述性分析完成
+            log("评测报告已生成，等待模型叙述性分析...", important=True)
+            await narrative_task
+        return result
+    
     # 运行异步主函数
-    return asyncio.run(async_main(ai_cases_data, golden_cases_data))
+    with use_profile(profile):
+        return asyncio.run(run())
 
 # --- API接口部分 ---
 try:
     from fastapi import FastAPI, HTTPException, BackgroundTasks, File, UploadFile, Form,Request
-    from fastapi.responses import JSONResponse,RedirectResponse
+    from fastapi.responses import JSONResponse,RedirectResponse,PlainTextResponse
     from pydantic import BaseModel
     from fastapi.middleware.cors import CORSMiddleware
-    from langgraph_use import graph
     from utils import clean_text, fetch_webpage_content
-    from feishu_api import get_feishu_doc_content
+    from feishu_api import get_feishu_doc_content, request_user_token
+    from identity_cache import IDENTITY_CACHE, TokenRefresher, prime_identity
+    from starlette.background import BackgroundTask
+    from metrics import render_latest, CONTENT_TYPE_LATEST
+    from loop_monitor import start_loop_monitor, stop_loop_monitor
     import traceback
     import uvicorn
     import os
@@ -870,6 +1086,7 @@ try:
         ai_test_cases: str  # AI生成的测试用例，JSON字符串
         golden_test_cases: Optional[str] = None  # 黄金标准测试用例，JSON字符串，可选
         model_name: str = MODEL_NAME  # 可选，使用的模型名称
+        profile: Optional[str] = None  # 可选，模型配置名称，如 fast
         save_results: bool = True  # 可选，是否保存结果文件
     
     # 定义API响应模型
@@ -936,8 +1153,8 @@ try:
                     return
                     
                 try:
-                    with open(golden_files[0], 'r', encoding='utf-8') as f:
-                        golden_test_cases = f.read()
+                    golden_test_cases = pathlib.Path(golden_files[0])
+                    _read_head(golden_test_cases, 1)
                     log(f"成功从文件 {golden_files[0]} 读取黄金标准测试用例", important=True)
                 except Exception as e:
                     error_msg = f"读取黄金标准测试用例文件失败: {str(e)}"
@@ -951,8 +1168,10 @@ try:
                     return
             
             # 执行评测任务
-            result = await async_main(request_data.ai_test_cases, golden_test_cases)
+            with use_profile(request_data.profile):
+                result = await async_main(request_data.ai_test_cases, golden_test_cases)
             
+            narrative_task = result.pop("narrative_task", None) if result else None
             if result and result["success"]:
                 evaluation_tasks[task_id] = {
                     "success": True,
@@ -961,6 +1180,9 @@ try:
                     "report": result["markdown_report"],
                     "files": result["files"]
                 }
+                # 报告先行返回，叙述性分析完成后再补充到任务状态中
+                if narrative_task is not None:
+                    evaluation_tasks[task_id]["narrative"] = await narrative_task
             else:
                 evaluation_tasks[task_id] = {
                     "success": False,
@@ -979,6 +1201,15 @@ try:
             }
             end_logging()
     
+    @app.on_event("startup")
+    async def on_startup():
+        # 监控事件循环阻塞
+        start_loop_monitor()
+
+    @app.on_event("shutdown")
+    async def on_shutdown():
+        await stop_loop_monitor()
+
     @app.get("/")
     async def root():
         """API根路径，返回基本信息"""
@@ -987,6 +1218,12 @@ try:
             "version": "1.0.0",
             "description": "比较AI生成的测试用例与黄金标准测试用例，评估测试用例质量"
         })
+
+    @app.get("/metrics")
+    async def metrics():
+        """Prometheus 指标"""
+        return PlainTextResponse(render_latest(), media_type=CONTENT_TYPE_LATEST)
+
     @app.post("/generate-from-feishu")
     async def generate_testcases_api(request: Request, data: dict):
         access_token = request.session.get("feishu_access_token")
@@ -1086,12 +1323,15 @@ try:
             status_code=302
         )
 
+    token_refresher = TokenRefresher(APP_ID, APP_SECRET)
+
     @app.get("/login")
     async def auth_callback(request: Request):
         redirect_uri = 'http://localhost:8000/call-back'
         encoded_redirect_uri = urllib.parse.quote(redirect_uri, safe="")
         auth_url = f'https://open.feishu.cn/open-apis/authen/v1/index?app_id={APP_ID}&redirect_uri={encoded_redirect_uri}'
-        auth_url = f'https://open.feishu.cn/open-apis/authen/v1/index?app_id={APP_ID}&redirect_uri={encoded_redirect_uri}'
+        # 申请 offline_access 以获得 refresh_token
+        auth_url = f'https://open.feishu.cn/open-apis/authen/v1/index?app_id={APP_ID}&redirect_uri={encoded_redirect_uri}&scope=offline_access'
         print("https://open.feishu.cn/open-apis/authen/v1/index?app_id=cli_a8ef8e2bca7bd01c&redirect_uri=http%3A%2F%2Flocalhost%3A8000%2Fcall-back")
         print(auth_url)
         session = request.session
@@ -1099,15 +1339,24 @@ try:
         if "feishu_access_token" in session:
             print("有access_token")
             access_token = session["feishu_access_token"]
-            user_resp = requests.get(
-                "https://open.feishu.cn/open-apis/authen/v1/user_info",
-                headers={"Authorization": f"Bearer {access_token}"}
-            )
             try:
-                user_data = user_resp.json()["data"]["open_id"]
+                user_data = (await IDENTITY_CACHE.get(access_token))["open_id"]
                 print(user_data)
             except Exception as e:
                 print("access_token 过期了")
+                # 有 refresh_token 时直接续期，不再走完整的 OAuth 跳转
+                refresh_token = session.get("feishu_refresh_token")
+                if refresh_token:
+                    try:
+                        tokens = await token_refresher.refresh(refresh_token)
+                        session["feishu_access_token"] = tokens["access_token"]
+                        if tokens.get("refresh_token"):
+                            session["feishu_refresh_token"] = tokens["refresh_token"]
+                        print("access_token 已刷新")
+                        return
+                    except Exception as refresh_error:
+                        print(f"刷新 access_token 失败: {refresh_error}")
+                        session.pop("feishu_refresh_token", None)
                 return RedirectResponse(
                     auth_url,
                     # "https://cvcat.site"
@@ -1134,7 +1383,6 @@ try:
         if not code:
             raise HTTPException(status_code=400, detail="缺少 code")
 
-        token_url = "https://open.feishu.cn/open-apis/authen/v2/oauth/token"
         payload = {
             "grant_type": "authorization_code",
             "code": code,
@@ -1143,37 +1391,22 @@ try:
             "redirect_uri": REDIRECT_URI
         }
 
-        async with httpx.AsyncClient() as client:
-            token_resp = await client.post(token_url, json=payload)
-            token_data = token_resp.json()
-
-            print(token_data)
-
-            if token_data.get("code", 0) != 0:
-                return JSONResponse(status_code=500, content={"error": token_data.get("msg", "token 获取失败")})
-
-            access_token = token_data["access_token"]
-
-            # 获取用户信息
-            user_resp = await client.get(
-                "https://open.feishu.cn/open-apis/authen/v1/user_info",
-                headers={"Authorization": f"Bearer {access_token}"}
-            )
-            user_data = user_resp.json()["data"]["open_id"]
-            print(user_data)
-
-            request.session["feishu_access_token"] = access_token
-            # 重定向回当前页面或者首页
-            redirect_url = request.query_params.get("state") or "http://localhost:5173"
-            # resp = await client.get('https://open.feishu.cn/open-apis/drive/explorer/v2/root_folder/meta',
-            #                     headers={"Authorization": f"Bearer {access_token}"})
-            # root_folder_token = resp.json()['data']['root_folder_token']
-            # resp = await client.get('https://open.feishu.cn/open-apis/drive/v1/files',
-            #                     headers={"Authorization": f"Bearer {access_token}"},params={"folder_token":root_folder_token})
-            # files = resp.json()["data"]["files"]
-            # print(files[0])
-
-            return RedirectResponse(redirect_url)
+        try:
+            token_data = await request_user_token(payload)
+        except Exception as e:
+            return JSONResponse(status_code=500, content={"error": str(e) or "token 获取失败"})
+        access_token = token_data["access_token"]
+
+        request.session["feishu_access_token"] = access_token
+        if token_data.get("refresh_token"):
+            request.session["feishu_refresh_token"] = token_data["refresh_token"]
+        # 重定向回当前页面或者首页
+        redirect_url = request.query_params.get("state") or "http://localhost:5173"
+        # 重定向后在后台预取用户信息，之后的鉴权请求直接命中缓存
+        return RedirectResponse(
+            redirect_url,
+            background=BackgroundTask(prime_identity, access_token, token_data.get("expires_in"))
+        )
 
 
 except ImportError as e:
@@ -1187,10 +1420,31 @@ if __name__ == "__main__":
         # 命令行模式
         log("以命令行模式运行...", important=True)
         parser = argparse.ArgumentParser(description="测试用例比较工具")
-        parser.add_argument("--ai", help="AI生成的测试用例文件路径")
-        parser.add_argument("--golden", help="黄金标准测试用例文件路径")
+        parser.add_argument("--ai", nargs="+", help="AI生成的测试用例文件路径（矩阵模式可传多个或通配符）")
+        parser.add_argument("--golden", nargs="+", help="黄金标准测试用例文件路径（矩阵模式可传多个或通配符）")
+        parser.add_argument("--profile", default=None, help="模型配置名称，如 fast")
+        parser.add_argument("--narrative", action="store_true", default=None,
+                            help="额外调用模型生成叙述性分析（默认按 REPORT_LLM_NARRATIVE 环境变量）")
+        parser.add_argument("--matrix", action="store_true",
+                            help="矩阵评测：所有AI用例 × 所有黄金标准 × 所有评审模型，输出对比表")
+        parser.add_argument("--judges", type=lambda v: [s.strip() for s in v.split(",") if s.strip()],
+                            default=None, help="矩阵/批量模式的评审模型，逗号分隔，默认 MODEL_NAME")
+        parser.add_argument("--batch", metavar="MANIFEST_OR_DIR",
+                            help="批量评测：清单文件（.json/.jsonl）或AI用例目录，可用 --golden 指定目录模式的黄金标准")
+        parser.add_argument("--out", default=None, help="批量评测的输出目录，重新运行同一目录会跳过已完成的任务")
+        parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="批量评测中格式化、查重的进程数")
+        parser.add_argument("--no-resume", action="store_true", help="批量评测时忽略已有进度，全部重新评测")
+        parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="批量评测中同时进行的任务数")
         args = parser.parse_args(sys.argv[2:])
-        main(args.ai, args.golden)
+        if args.batch:
+            result = main_batch(args.batch, args.out, args.golden, args.judges, args.profile,
+                                args.workers, not args.no_resume, args.concurrency)
+            sys.exit(0 if result.get("success") else 1)
+        elif args.matrix:
+            main_matrix(args.ai, args.golden, args.judges, args.profile)
+        else:
+            main(args.ai[0] if args.ai else None, args.golden[0] if args.golden else None,
+                 args.profile, args.narrative)
     else:
         # API模式（默认）
         if app:
@@ -1,7 +1,6 @@
 import urllib.parse
 from fastapi import Depends, HTTPException, Request, status
 import httpx
-import requests
 import sys
 import argparse
 from HandleUpload import  *
@@ -18,12 +17,26 @@ REDIRECT_URI = "http://localhost:8000/call_back"
 
 # --- API接口部分 ---
 try:
-    from fastapi import FastAPI, HTTPException, BackgroundTasks, File, UploadFile, Form,Request
-    from fastapi.responses import JSONResponse,RedirectResponse
+    from fastapi import FastAPI, HTTPException, BackgroundTasks, File, UploadFile, Form,Request, WebSocket, WebSocketDisconnect
+    from fastapi.responses import JSONResponse,RedirectResponse,PlainTextResponse,StreamingResponse
     from pydantic import BaseModel
     from fastapi.middleware.cors import CORSMiddleware
     from utils import clean_text, fetch_webpage_content
-    from feishu_api import get_feishu_doc_content
+    from feishu_api import get_feishu_doc_content, request_user_token
+    from identity_cache import IDENTITY_CACHE, TokenRefresher, prime_identity, REFRESH_MARGIN
+    from starlette.background import BackgroundTask
+    from loop_monitor import start_loop_monitor, stop_loop_monitor
+    from langgraph_use import run_graph, start_graph_run, get_run_state, retry_failed_cases, get_checkpointed_graph
+    from run_events import RunCancelledError, get_channel, cancel_run
+    from metrics import span, render_latest, CONTENT_TYPE_LATEST
+    from transport import CircuitOpenError, TransportError
+    from model_routing import PROFILES, DEFAULT_PROFILE, resolve_profile, use_profile, UnknownProfileError
+    from typing import List, Optional
+    from singleflight import SingleFlight, content_key
+    from result_cache import RESULT_CACHE, result_key
+    from incremental import regenerate
+    from testcase_model import TestSuite
+    from batch_pipeline import BatchPipeline, BatchItem, MAX_DOCUMENTS as BATCH_MAX_DOCUMENTS
     import traceback
     import uvicorn
     import os
@@ -31,6 +44,7 @@ try:
     import time
     import datetime
     from starlette.middleware.sessions import SessionMiddleware
+    from starlette.routing import Match
     
     # 创建FastAPI应用
     app = FastAPI(
@@ -49,6 +63,122 @@ try:
     )
 
 
+    # 启动后在后台预热流程（导入 langgraph、编译流程），不阻塞服务就绪；设为 0 则在首次请求时再初始化
+    GRAPH_WARMUP = os.environ.get("GRAPH_WARMUP", "1") != "0"
+
+
+    async def warm_up_graph():
+        try:
+            await get_checkpointed_graph()
+        except Exception as e:
+            print(f"预热流程失败，将在首次请求时重试: {e}")
+
+
+    @app.on_event("startup")
+    async def on_startup():
+        # 监控事件循环阻塞
+        start_loop_monitor()
+        if GRAPH_WARMUP:
+            app.state.graph_warmup = asyncio.create_task(warm_up_graph())
+
+
+    @app.on_event("shutdown")
+    async def on_shutdown():
+        await stop_loop_monitor()
+
+
+    def route_template(request: Request) -> str:
+        # 使用路由模板作为指标标签，避免路径参数导致标签数量膨胀
+        for route in request.app.router.routes:
+            match, _ = route.matches(request.scope)
+            if match == Match.FULL:
+                return route.path
+        return "unmatched"
+
+
+    # 记录每个接口的耗时和并发数
+    @app.middleware("http")
+    async def trace_requests(request: Request, call_next):
+        with span("endpoint", f"{request.method} {route_template(request)}") as current:
+            response = await call_next(request)
+            if response.status_code >= 500:
+                current.status = "error"
+            return response
+
+
+    def upstream_http_error(e: TransportError) -> HTTPException:
+        # 熔断中返回 503 并带上 Retry-After，其余上游失败返回 502
+        if isinstance(e, CircuitOpenError):
+            return HTTPException(status_code=503, detail=f"模型服务暂不可用: {str(e)}",
+                                 headers={"Retry-After": str(int(e.retry_after))})
+        return HTTPException(status_code=502, detail=f"模型调用失败: {str(e)}")
+
+
+    def request_profile(name: Optional[str]) -> str:
+        try:
+            return resolve_profile(name)
+        except UnknownProfileError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+
+    @app.get("/model_profiles")
+    async def model_profiles():
+        """可选的模型配置及各阶段使用的模型"""
+        return {
+            "default": DEFAULT_PROFILE,
+            "profiles": {name: {stage: params.get("model") for stage, params in stages.items()}
+                         for name, stages in PROFILES.items()}
+        }
+
+
+    token_refresher = TokenRefresher(APP_ID, APP_SECRET)
+
+
+    def set_token_cookies(response, tokens: dict):
+        # access_token 比飞书的有效期提前 REFRESH_MARGIN 过期，过期后由 refresh_token 自动续期
+        expires_in = int(tokens.get("expires_in") or 2 * 60 * 60)
+        response.set_cookie("access_token", tokens["access_token"], httponly=True, secure=True,
+                            expires=max(60, expires_in - int(REFRESH_MARGIN)))
+        if tokens.get("refresh_token"):
+            response.set_cookie("refresh_token", tokens["refresh_token"], httponly=True, secure=True,
+                                expires=int(tokens.get("refresh_token_expires_in") or 7 * 24 * 60 * 60))
+
+
+    def replace_request_cookie(request: Request, name: str, value: str):
+        # 改写请求头中的 Cookie，使后续处理拿到刷新后的 token
+        cookies = dict(request.cookies)
+        cookies[name] = value
+        cookie_header = "; ".join(f"{k}={v}" for k, v in cookies.items()).encode("latin-1")
+        headers = [(k, v) for k, v in request.scope["headers"] if k != b"cookie"]
+        headers.append((b"cookie", cookie_header))
+        request.scope["headers"] = headers
+
+
+    # access_token 过期但还有 refresh_token 时自动续期，免去完整的 OAuth 跳转
+    @app.middleware("http")
+    async def refresh_feishu_token(request: Request, call_next):
+        refresh_token = request.cookies.get("refresh_token")
+        if request.cookies.get("access_token") or not refresh_token:
+            return await call_next(request)
+        try:
+            tokens = await token_refresher.refresh(refresh_token)
+        except Exception as e:
+            print(f"刷新 access_token 失败: {e}")
+            response = await call_next(request)
+            response.delete_cookie("refresh_token")
+            return response
+        replace_request_cookie(request, "access_token", tokens["access_token"])
+        response = await call_next(request)
+        set_token_cookies(response, tokens)
+        return response
+
+
+    @app.get("/metrics")
+    async def metrics():
+        """Prometheus 指标"""
+        return PlainTextResponse(render_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
     @app.get("/")
     async def root():
         """API根路径，返回基本信息"""
@@ -74,43 +204,89 @@ try:
         print("test token:", token)
         return JSONResponse(status_code=200, content={"message": "Test successful", "token": token})
 
+    # 相同内容、相同模型配置的并发请求只计算一次
+    upload_doc_flight = SingleFlight("upload_doc")
+    upload_img_flight = SingleFlight("upload_img")
+    generate_text_flight = SingleFlight("generate_from_text")
+
+
+    async def generate_cases_cached(markdown: str, profile: str, *extra_keys: str) -> dict:
+        """
+        按规范化后的文档内容查询整次生成结果，未命中时生成并写入缓存；返回结果带 cached 标记。
+        extra_keys 为额外写入的键（如原始文件的哈希），下次可跳过文档解析直接命中
+        """
+        key = result_key("generate_cases", markdown, profile)
+        result = await RESULT_CACHE.get(key, "generate_cases")
+        cached = result is not None
+        if not cached:
+            result = await call_deepseek_llm(markdown)
+            try:
+                suite = TestSuite.from_json(result["json"])
+            except ValueError:
+                suite = None
+            if not suite:
+                # 未能提取出用例 JSON 或 JSON 中没有任何用例的结果不缓存，下次重新生成
+                return {**result, "cached": False}
+            await RESULT_CACHE.put(key, result, "generate_cases")
+        for extra_key in extra_keys:
+            await RESULT_CACHE.put(extra_key, result, "generate_cases")
+        return {**result, "cached": cached}
+
     # 上传接口
     @app.post("/upload_doc")
-    async def upload_doc(file: UploadFile = File(...)):
+    async def upload_doc(file: UploadFile = File(...), profile: Optional[str] = Form(None)):
         filename = file.filename.lower()
         if not (filename.endswith(".pdf") or filename.endswith(".docx")):
             raise HTTPException(status_code=400, detail="仅支持 .docx 和 .pdf 文件")
+        profile = request_profile(profile)
 
         file_bytes = await file.read()
 
-        try:
-            extracted_text = await extract_markdown(file_bytes, filename)
-            print(extracted_text)
-        except Exception as e:
-            print(f"文档解析失败: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"文档解析失败: {str(e)}")
+        async def process():
+            with use_profile(profile):
+                # 同一文件重复上传时不必重新解析（解析 docx/pdf 中的图片也需要调用模型）
+                file_key = result_key("upload_doc", file_bytes, profile)
+                cached = await RESULT_CACHE.get(file_key, "upload_doc")
+                if cached is not None:
+                    return {**cached, "cached": True}
+                try:
+                    extracted_text = await extract_markdown(file_bytes, filename)
+                    print(extracted_text)
+                except Exception as e:
+                    print(f"文档解析失败: {str(e)}")
+                    raise HTTPException(status_code=500, detail=f"文档解析失败: {str(e)}")
+                return await generate_cases_cached(extracted_text, profile, file_key)
 
         try:
-            llm_response = await call_deepseek_llm(extracted_text)
+            key = content_key(os.path.splitext(filename)[1], file_bytes, profile=profile)
+            llm_response = await upload_doc_flight.do(key, process)
             return {
                 "success": True,
-                "json": llm_response["json"]
+                "json": llm_response["json"],
+                "cached": llm_response["cached"]
             }
+        except HTTPException:
+            raise
+        except TransportError as e:
+            raise upstream_http_error(e)
         except Exception as e:
             raise HTTPException(status_code=502, detail=f"模型调用失败: {str(e)}")
 
 
     class TextRequest(BaseModel):
         text: str
+        profile: Optional[str] = None  # 模型配置名称，如 fast
 
 
     class ImageRequest(BaseModel):
         text: str  # 需求文本
         image_name: str
         image_base64: str  # Base64 编码的图片字符串
+        profile: Optional[str] = None  # 模型配置名称，如 fast
 
     @app.post("/upload_img")
     async def upload_img(request: ImageRequest):
+        profile = request_profile(request.profile)
         try:
             # 提取请求中的文本和图片数据
             text = request.text
@@ -118,7 +294,12 @@ try:
             image_base64 = request.image_base64
 
             # 将图片和文本传递给 call_doubao_llm 函数
-            response = await call_doubao_llm(text, image_name, image_base64)
+            async def process():
+                with use_profile(profile):
+                    return await call_doubao_llm(text, image_name, image_base64)
+
+            key = content_key(text, image_name, image_base64, profile=profile)
+            response = await upload_img_flight.do(key, process)
 
             # 返回生成的结果
             return {
@@ -127,6 +308,8 @@ try:
                 "json": response["json"]
             }
 
+        except TransportError as e:
+            raise upstream_http_error(e)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
 
@@ -135,29 +318,220 @@ try:
     async def generate_from_text(data: TextRequest):
         if not data.text or len(data.text.strip()) < 10:
             raise HTTPException(status_code=400, detail="输入文本不能为空或太短")
+        profile = request_profile(data.profile)
 
         try:
-            result = await call_deepseek_llm(data.text)
+            async def process():
+                with use_profile(profile):
+                    return await generate_cases_cached(data.text, profile)
+
+            result = await generate_text_flight.do(content_key(data.text, profile=profile), process)
             print(result)
             return {
                 "success": True,
-                "markdown": result["markdown"],
-                "json": result["json"]
+                "markdown": result.get("markdown", ""),
+                "json": result["json"],
+                "cached": result["cached"]
             }
+        except TransportError as e:
+            raise upstream_http_error(e)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"模型调用失败: {str(e)}")
+
+    # 修订后的 PRD 增量生成：按章节比对，只重新生成新增或修改的章节，其余章节复用上次的用例
+    @app.post("/regenerate_doc")
+    async def regenerate_doc(file: UploadFile = File(None), text: Optional[str] = Form(None),
+                             doc_id: Optional[str] = Form(None), profile: Optional[str] = Form(None)):
+        if file is None and not (text and text.strip()):
+            raise HTTPException(status_code=400, detail="请提供文件或文本")
+        profile = request_profile(profile)
+
+        with use_profile(profile):
+            if file is not None:
+                filename = (file.filename or "").lower()
+                if not (filename.endswith(".pdf") or filename.endswith(".docx")):
+                    raise HTTPException(status_code=400, detail="仅支持 .docx 和 .pdf 文件")
+                try:
+                    text = await extract_markdown(await file.read(), filename)
+                except Exception as e:
+                    print(f"文档解析失败: {str(e)}")
+                    raise HTTPException(status_code=500, detail=f"文档解析失败: {str(e)}")
+                doc_id = doc_id or file.filename
+            try:
+                result = await regenerate(text, profile, doc_id)
+            except TransportError as e:
+                raise upstream_http_error(e)
+            except Exception as e:
+                raise HTTPException(status_code=502, detail=f"模型调用失败: {str(e)}")
+        return {
+            "success": True,
+            **result,
+            "cached": result["sections"]["regenerated"] == 0 and not result["failed"]
+        }
+
+    # 批量生成：多个文档/文本经 解析 -> 提取测试点 -> 生成用例 三个阶段流水处理，
+    # 每完成一个文档就以 NDJSON 的一行返回，最后一行为汇总
+    @app.post("/batch_generate")
+    async def batch_generate(files: List[UploadFile] = File(None), texts: List[str] = Form(None),
+                             profile: Optional[str] = Form(None)):
+        files, texts = files or [], [text for text in (texts or []) if text and text.strip()]
+        if not files and not texts:
+            raise HTTPException(status_code=400, detail="请至少提供一个文件或一段文本")
+        if len(files) + len(texts) > BATCH_MAX_DOCUMENTS:
+            raise HTTPException(status_code=400, detail=f"单次最多处理 {BATCH_MAX_DOCUMENTS} 个文档")
+        profile = request_profile(profile)
+
+        items = []
+        for file in files:
+            filename = (file.filename or "").lower()
+            if not (filename.endswith(".pdf") or filename.endswith(".docx")):
+                raise HTTPException(status_code=400, detail=f"仅支持 .docx 和 .pdf 文件: {file.filename}")
+            # 响应开始流式返回后上传文件会被关闭，先读出内容
+            items.append(BatchItem(len(items), file.filename, await file.read(), filename=filename))
+        for i, text in enumerate(texts):
+            items.append(BatchItem(len(items), f"text-{i + 1}", text))
+
+        async def stream():
+            succeeded = 0
+            async for result in BatchPipeline(profile=profile).run(items):
+                succeeded += result["success"]
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+            yield json.dumps({"done": True, "total": len(items), "succeeded": succeeded,
+                              "failed": len(items) - succeeded}, ensure_ascii=False) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    # LangGraph 流程：返回 run_id，失败的测试点可按 run_id 单独重试
+    @app.post("/generate_by_graph")
+    async def generate_by_graph(data: TextRequest):
+        if not data.text or len(data.text.strip()) < 10:
+            raise HTTPException(status_code=400, detail="输入文本不能为空或太短")
+        profile = request_profile(data.profile)
+
+        try:
+            run_id, state = await run_graph(data.text, profile=profile)
+        except RunCancelledError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except TransportError as e:
+            raise upstream_http_error(e)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"模型调用失败: {str(e)}")
+        return {
+            "success": True,
+            "run_id": run_id,
+            "validated": state.get("validated"),
+            "testcases": state.get("testcases"),
+            "cached": state.get("cached", False)
+        }
+
+
+    @app.get("/graph_run/{run_id}")
+    async def get_graph_run(run_id: str):
+        state = await get_run_state(run_id)
+        if not state:
+            raise HTTPException(status_code=404, detail="未找到运行记录")
+        return {
+            "success": True,
+            "run_id": run_id,
+            "validated": state.get("validated"),
+            "testcases": state.get("testcases")
+        }
+
+
+    @app.post("/retry_failed_cases/{run_id}")
+    async def retry_failed(run_id: str):
+        try:
+            testcases = await retry_failed_cases(run_id)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="未找到运行记录")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"重试失败: {str(e)}")
+        return {
+            "success": True,
+            "run_id": run_id,
+            "testcases": testcases
+        }
+
+    # 后台启动 LangGraph 流程并立即返回 run_id，进度通过 SSE 或 WebSocket 订阅，
+    # 结束后通过 /graph_run/{run_id} 获取结果
+    @app.post("/start_graph_run")
+    async def start_graph(data: TextRequest):
+        if not data.text or len(data.text.strip()) < 10:
+            raise HTTPException(status_code=400, detail="输入文本不能为空或太短")
+        run_id = await start_graph_run(data.text, request_profile(data.profile))
+        return {"success": True, "run_id": run_id}
+
+
+    # SSE 心跳间隔（秒），避免代理因长时间无数据断开连接
+    EVENTS_HEARTBEAT = 15.0
+
+
+    @app.get("/graph_run/{run_id}/events")
+    async def graph_run_events(run_id: str, request: Request, after: int = 0):
+        channel = get_channel(run_id)
+        if channel is None:
+            raise HTTPException(status_code=404, detail="未找到运行中的流程或事件已过期")
+        # 断线重连时浏览器会带上最后收到的事件编号
+        last_event_id = request.headers.get("Last-Event-ID")
+        if last_event_id and last_event_id.isdigit():
+            after = max(after, int(last_event_id))
+
+        async def stream():
+            async for event in channel.events(after, heartbeat=EVENTS_HEARTBEAT):
+                if event is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield (f"id: {event['seq']}\nevent: {event['type']}\n"
+                       f"data: {json.dumps(event, ensure_ascii=False)}\n\n")
+
+        return StreamingResponse(stream(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+    @app.websocket("/graph_run/{run_id}/ws")
+    async def graph_run_ws(websocket: WebSocket, run_id: str, after: int = 0):
+        channel = get_channel(run_id)
+        if channel is None:
+            await websocket.close(code=4404)
+            return
+        await websocket.accept()
+
+        async def receive_commands():
+            # 客户端发送 {"action": "cancel"} 取消运行
+            while True:
+                message = await websocket.receive_json()
+                if isinstance(message, dict) and message.get("action") == "cancel":
+                    cancel_run(run_id)
+
+        receiver = asyncio.create_task(receive_commands())
+        try:
+            async for event in channel.events(after, heartbeat=EVENTS_HEARTBEAT):
+                if receiver.done():
+                    break
+                await websocket.send_json(event if event is not None else {"type": "heartbeat"})
+            else:
+                await websocket.close()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            receiver.cancel()
+
+
+    @app.post("/cancel_graph_run/{run_id}")
+    async def cancel_graph_run(run_id: str):
+        if get_channel(run_id) is None:
+            raise HTTPException(status_code=404, detail="未找到运行中的流程")
+        return {"success": cancel_run(run_id), "run_id": run_id}
 
     # token: str = Depends(require_header_token)
     # get_user_name
     @app.get("/get_user_name")
     async def get_user_name(request: Request, access_token: str = Depends(require_header_token)):
         # access_token = request.headers.get("Authorization")
-        url = "https://open.feishu.cn/open-apis/authen/v1/user_info"
-        headers = {"Authorization": f"Bearer {access_token}"}
         try:
-            user_resp = requests.get(url, headers=headers)
-            user_data = user_resp.json()["data"]["open_id"]
-            user_name = user_resp.json()["data"]["name"]
+            user_info = await IDENTITY_CACHE.get(access_token)
+            user_data = user_info["open_id"]
+            user_name = user_info["name"]
             print(user_data)
             print(user_data)
             return JSONResponse(
@@ -176,7 +550,7 @@ try:
     async def login():
         redirect_uri = 'http://localhost:8000/call_back'
         encoded_redirect_uri = urllib.parse.quote(redirect_uri, safe="")
-        auth_url = f'https://open.feishu.cn/open-apis/authen/v1/index?app_id={APP_ID}&redirect_uri={encoded_redirect_uri}&scope=docx:document drive:drive'
+        auth_url = f'https://open.feishu.cn/open-apis/authen/v1/index?app_id={APP_ID}&redirect_uri={encoded_redirect_uri}&scope=docx:document drive:drive offline_access'
         response = RedirectResponse(
             auth_url,
             status_code=302
@@ -189,7 +563,11 @@ try:
             "http://localhost:5173/LLMGenerate",
             status_code=302
         )
+        access_token = request.cookies.get("access_token")
+        if access_token:
+            IDENTITY_CACHE.invalidate(access_token)
         response.delete_cookie("access_token")
+        response.delete_cookie("refresh_token")
         return response
 
     @app.get("/call_back")
@@ -198,7 +576,6 @@ try:
         if not code:
             raise HTTPException(status_code=400, detail="缺少 code")
 
-        token_url = "https://open.feishu.cn/open-apis/authen/v2/oauth/token"
         payload = {
             "grant_type": "authorization_code",
             "code": code,
@@ -207,21 +584,21 @@ try:
             "redirect_uri": REDIRECT_URI
         }
 
-        async with httpx.AsyncClient() as client:
-            token_resp = await client.post(token_url, json=payload)
-            token_data = token_resp.json()
-
-            if token_data.get("code", 0) != 0:
-                return JSONResponse(status_code=500, content={"error": token_data.get("msg", "token 获取失败")})
-            access_token = token_data["access_token"]
-
+        try:
+            token_data = await request_user_token(payload)
+        except Exception as e:
+            return JSONResponse(status_code=500, content={"error": str(e) or "token 获取失败"})
+        access_token = token_data["access_token"]
 
-            redirect_url = request.query_params.get("state") or "http://localhost:5173"
+        redirect_url = request.query_params.get("state") or "http://localhost:5173"
 
-            response = RedirectResponse(redirect_url)
-            # 2小时
-            response.set_cookie("access_token", access_token, httponly=True, secure=True, expires=2 * 60 * 60)
-            return response
+        # 重定向后在后台预取用户信息，前端随后的 /get_user_name 直接命中缓存
+        response = RedirectResponse(
+            redirect_url,
+            background=BackgroundTask(prime_identity, access_token, token_data.get("expires_in"))
+        )
+        set_token_cookies(response, token_data)
+        return response
 
 
 except ImportError as e:
@@ -1,21 +1,23 @@
 import os
-import fitz
-from docx import Document
-from docx.image.image import Image
-from docx.parts.image import ImagePart
-from docx.oxml.shape import CT_Picture
-import httpx
+import json
+import asyncio
 from typing import Dict
 import base64
 from io import BytesIO
-from PIL import Image
+from metrics import traced, record_tokens
+from json_extract import extract_json, find_json, JSONExtractError
+from transport import post_json, TransportError
+from model_routing import stage_params
+from docx_stream import DocxStreamReader
 
 ARK_API_KEY = os.environ.get("ARK_API_KEY") or "f3fbd54b-1775-4250-be19-528cf14f1291"
 ARK_MODEL_ID = "doubao-1-5-pro-32k-250115"
-ARK_BASE_URL = "https://ark.cn-beijing.volces.com/api/v3"
+ARK_BASE_URL = os.environ.get("ARK_BASE_URL") or "https://ark.cn-beijing.volces.com/api/v3"
 
 
+# fitz / PIL 导入较慢，在各解析函数中按需导入，加快服务启动
 def image_to_base64(image_stream):
+    from PIL import Image
     image = Image.open(image_stream)
     buffer = BytesIO()
     image_format = image.format  # 自动获取图片的格式
@@ -25,86 +27,144 @@ def image_to_base64(image_stream):
     # 根据图片格式生成 Base64 URL
     return f"data:image/{image_format.lower()};base64,{base64_image}"
 
-def extract_markdown_from_pdf(file_bytes: bytes) -> str:
-    from io import BytesIO
+# PDF 图片：宽或高小于该像素数、在页面上占比过小或长宽比过于悬殊（分隔线、图标、水印）的视为装饰图，不做描述
+PDF_IMAGE_MIN_PX = int(os.environ.get("PDF_IMAGE_MIN_PX", "100"))
+PDF_IMAGE_MIN_AREA_RATIO = float(os.environ.get("PDF_IMAGE_MIN_AREA_RATIO", "0.01"))
+PDF_IMAGE_MAX_ASPECT = float(os.environ.get("PDF_IMAGE_MAX_ASPECT", "20"))
+# 单个文档最多描述的图片数，以及同时进行的图片描述请求数
+PDF_MAX_IMAGES = int(os.environ.get("PDF_MAX_IMAGES", "50"))
+CAPTION_CONCURRENCY = int(os.environ.get("CAPTION_CONCURRENCY", "4"))
+
+
+def _is_content_image(info: dict, page_area: float) -> bool:
+    width, height = info.get("width", 0), info.get("height", 0)
+    if min(width, height) < PDF_IMAGE_MIN_PX:
+        return False
+    if max(width, height) / max(min(width, height), 1) > PDF_IMAGE_MAX_ASPECT:
+        return False
+    x0, y0, x1, y1 = info["bbox"]
+    return page_area <= 0 or (x1 - x0) * (y1 - y0) / page_area >= PDF_IMAGE_MIN_AREA_RATIO
+
+
+def _pdf_image_data_url(doc, xref: int) -> str:
+    import fitz
+    pix = fitz.Pixmap(doc, xref)
+    if pix.n - pix.alpha >= 4:  # CMYK 等转为 RGB
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    return f"data:image/png;base64,{base64.b64encode(pix.tobytes('png')).decode('ascii')}"
+
+
+def _pdf_blocks(file_bytes: bytes) -> list:
+    """
+    同步解析 pdf（在线程中执行），按页面内从上到下的位置返回 ("text", markdown) 或 ("image", base64) 块。
+    同一图片（相同 xref）跨页只返回一次
+    """
+    import fitz
     doc = fitz.open(stream=file_bytes, filetype="pdf")
-    md_lines = []
+    blocks = []
+    seen_xrefs = set()
+    try:
+        for i, page in enumerate(doc):
+            # (y0, x0, 类型, 内容)；类型 0 为文本，1 为图片
+            items = []
+            for x0, y0, x1, y1, text, _no, block_type in page.get_text("blocks"):
+                if block_type == 0 and text.strip():
+                    items.append((y0, x0, 0, text))
+
+            page_area = page.rect.width * page.rect.height
+            for info in page.get_image_info(xrefs=True):
+                xref = info.get("xref", 0)
+                # xref 为 0 的是内联图片，无法单独提取
+                if not xref or xref in seen_xrefs or not _is_content_image(info, page_area):
+                    continue
+                seen_xrefs.add(xref)
+                if len(seen_xrefs) > PDF_MAX_IMAGES:
+                    if len(seen_xrefs) == PDF_MAX_IMAGES + 1:
+                        print(f"PDF 图片超过 {PDF_MAX_IMAGES} 张，后续图片不再描述")
+                    continue
+                try:
+                    items.append((info["bbox"][1], info["bbox"][0], 1, _pdf_image_data_url(doc, xref)))
+                except Exception as e:
+                    print(f"提取 PDF 图片 {xref} 失败，跳过: {e}")
 
-    for i, page in enumerate(doc):
-        text = page.get_text().strip()
-        if not text:
-            continue
-
-        # 粗略分页分段处理
-        md_lines.append(f"## 第 {i + 1} 页\n\n")
-        lines = text.split("\n")
-        for line in lines:
-            line = line.strip()
-            if not line:
+            if not items:
                 continue
-            # 简单处理 bullet/list
-            if line.startswith(("-", "•", "*", "·")):
-                md_lines.append(f"- {line.lstrip('-•*· ')}")
-            else:
-                md_lines.append(line)
+            items.sort(key=lambda item: (item[0], item[1]))
+
+            # 粗略分页分段处理
+            blocks.append(("text", f"## 第 {i + 1} 页\n\n"))
+            for _y, _x, kind, value in items:
+                if kind == 1:
+                    blocks.append(("image", value))
+                    continue
+                for line in value.split("\n"):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    # 简单处理 bullet/list
+                    if line.startswith(("-", "•", "*", "·")):
+                        blocks.append(("text", f"- {line.lstrip('-•*· ')}"))
+                    else:
+                        blocks.append(("text", line))
+
+            blocks.append(("text", "\n---"))  # 页面分隔
+    finally:
+        doc.close()
+    return blocks
+
+
+async def caption_blocks(blocks: list) -> str:
+    """并发描述 blocks 中的图片，描述文本放回图片原来的位置，拼成 markdown"""
+    semaphore = asyncio.Semaphore(CAPTION_CONCURRENCY)
+
+    async def caption(base64_image: str):
+        async with semaphore:
+            try:
+                return await get_model_text_from_image(base64_image)  # 调用模型
+            except Exception as e:
+                print(f"调用模型时出错: {e}")
+                return None
+
+    captions = await asyncio.gather(*(caption(value) for kind, value in blocks if kind == "image"))
+    captions = iter(captions)
+    md_lines = []
+    for kind, value in blocks:
+        text = value if kind == "text" else next(captions)
+        if text:
+            md_lines.append(text)
+    return "\n\n".join(md_lines)
 
-        md_lines.append("\n---")  # 页面分隔
 
-    return "\n\n".join(md_lines)
+@traced("parser", "pdf")
+async def extract_markdown_from_pdf(file_bytes: bytes) -> str:
+    # 文本和图片提取放到线程中执行，图片描述并发进行
+    blocks = await asyncio.to_thread(_pdf_blocks, file_bytes)
+    return await caption_blocks(blocks)
 
 
 # 文本提取
+@traced("parser", "docx")
 async def extract_markdown_from_docx(file_bytes: bytes) -> str:
-    from io import BytesIO
-    processed_images = set()
-    doc = Document(BytesIO(file_bytes))
-    md_lines = []
-    for para in doc.paragraphs:
-        style = para.style.name.lower()
-        text = para.text.strip()
-        if text:
-            # 根据样式映射为 markdown 语法
-            if 'heading 1' in style:
-                md_lines.append(f"# {text}")
-            elif 'heading 2' in style:
-                md_lines.append(f"## {text}")
-            elif 'heading 3' in style:
-                md_lines.append(f"### {text}")
-            elif 'list' in style or para._element.xpath('.//w:numPr'):
-                md_lines.append(f"- {text}")
-            else:
-                md_lines.append(text)
-
-        img = para._element.xpath('.//pic:pic')
-        if not img:
-            print("没找到图片")
-        else:
-            img: CT_Picture = img[0]
-            embed = img.xpath('.//a:blip/@r:embed')[0]
-            related_part: ImagePart = doc.part.related_parts[embed]
-            blob = related_part.blob
-            base64_image = image_to_base64(BytesIO(blob))
-
-            # 使用图片的base64编码作为唯一标识，避免重复处理
-            if base64_image not in processed_images:
-                processed_images.add(base64_image)  # 记录这张图片已经处理过
-                try:
-                    res = await get_model_text_from_image(base64_image)  # 调用模型
-                    md_lines.append(res)  # 将返回的文本添加到 Markdown
-                except Exception as e:
-                    print(f"调用模型时出错: {e}")
-            else:
-                print(f"图片已经处理过，跳过重复处理")
-
-    # 处理表格（可选）
-    for table in doc.tables:
-        for i, row in enumerate(table.rows):
-            cells = [cell.text.strip() for cell in row.cells]
-            if i == 0:
-                md_lines.append("| " + " | ".join(cells) + " |")
-                md_lines.append("|" + " --- |" * len(cells))
-            else:
-                md_lines.append("| " + " | ".join(cells) + " |")
+    # 正文解析和图片读取放到线程中执行，避免阻塞事件循环；图片只保留包内路径，描述时再读取
+    reader = DocxStreamReader(file_bytes)
+    try:
+        blocks = await asyncio.to_thread(lambda: list(reader.blocks()))
+        md_lines = []
+        for kind, value in blocks:
+            if kind == "text":
+                md_lines.append(value)
+                continue
+            base64_image = await asyncio.to_thread(reader.image_data_url, value)
+            if base64_image is None:
+                print(f"图片已经处理过或无法识别，跳过: {value}")
+                continue
+            try:
+                res = await get_model_text_from_image(base64_image)  # 调用模型
+                md_lines.append(res)  # 将返回的文本添加到 Markdown
+            except Exception as e:
+                print(f"调用模型时出错: {e}")
+    finally:
+        reader.close()
 
     return "\n\n".join(md_lines)
 
@@ -113,18 +173,26 @@ async def extract_markdown(file_bytes: bytes, filename: str) -> str:
     if filename.endswith(".docx"):
         return await extract_markdown_from_docx(file_bytes)
     elif filename.endswith(".pdf"):
-        return extract_markdown_from_pdf(file_bytes)
+        return await extract_markdown_from_pdf(file_bytes)
     else:
         raise ValueError("只支持 .docx 和 .pdf 文件")
 
-async def get_model_text_from_image(base64_image: str) -> str:
+async def _post_ark_chat(payload: dict, timeout: float = 180) -> dict:
+    """调用 Ark chat/completions 接口；返回非 2xx 状态码或网络错误时按统一策略重试，仍失败则打印并抛出 TransportError"""
     headers = {
         "Authorization": f"Bearer {ARK_API_KEY}",
         "Content-Type": "application/json"
     }
+    try:
+        return await post_json("ark", f"{ARK_BASE_URL}/chat/completions", payload, headers, timeout=timeout)
+    except TransportError as e:
+        print("❌ Ark 请求失败：", str(e))
+        raise
 
+@traced("http", "ark.vision_caption")
+async def get_model_text_from_image(base64_image: str) -> str:
     payload = {
-        "model": "doubao-1-5-vision-pro-32k-250115",
+        **stage_params("vision_caption"),
         "messages": [
             {"role": "user", "content": f"""
     请描述这张需求文档的图，以便我更精准地生成测试用例。
@@ -145,35 +213,19 @@ async def get_model_text_from_image(base64_image: str) -> str:
                     }
                 ]
             }
-    ],"temperature": 0.5,
-        "top_p": 0.9
+    ]
     }
-    try:
-        async with httpx.AsyncClient(timeout=180) as client:
-            res = await client.post(f"{ARK_BASE_URL}/chat/completions", json=payload, headers=headers)
-
-            # 如果 Ark 返回了非 2xx 状态码
-            if res.status_code != 200:
-                print("❌ Ark 请求失败：", res.status_code, res.text)
-
-            res.raise_for_status()
-            content = res.json()["choices"][0]["message"]["content"]
+    data = await _post_ark_chat(payload)
 
-            return content
+    record_tokens(payload["model"], data.get("usage"))
+    content = data["choices"][0]["message"]["content"]
 
-    except httpx.HTTPError as e:
-        # 捕获网络类错误，例如连接失败、超时
-        print("❌ 网络错误：", str(e))
-        return {"error": "网络错误", "detail": str(e)}
+    return content
 
+@traced("http", "ark.extract_keypoint")
 async def extract_keypoint_from_prd(prd: str) -> str:
-    headers = {
-        "Authorization": f"Bearer {ARK_API_KEY}",
-        "Content-Type": "application/json"
-    }
-
     payload = {
-        "model": "deepseek-r1-250120",
+        **stage_params("keypoint"),
         "messages": [
             {"role": "user", "content": f"""
     请基于以下需求文档，全面提取其中每个功能模块特有的校验细节、通用的校验细节和规则以及模块之间的流程触发过程。
@@ -183,36 +235,19 @@ async def extract_keypoint_from_prd(prd: str) -> str:
     以下是 PRD 文档内容：
     {prd}
     """}
-    ],"temperature": 0.5,
-        "top_p": 0.9,
-        "max_tokens": 16384
+    ]
     }
-    try:
-        async with httpx.AsyncClient(timeout=180) as client:
-            res = await client.post(f"{ARK_BASE_URL}/chat/completions", json=payload, headers=headers)
+    data = await _post_ark_chat(payload)
 
-            # 如果 Ark 返回了非 2xx 状态码
-            if res.status_code != 200:
-                print("❌ Ark 请求失败：", res.status_code, res.text)
+    record_tokens(payload["model"], data.get("usage"))
+    content = data["choices"][0]["message"]["content"]
 
-            res.raise_for_status()
-            content = res.json()["choices"][0]["message"]["content"]
-
-            return content
-
-    except httpx.HTTPError as e:
-        # 捕获网络类错误，例如连接失败、超时
-        print("❌ 网络错误：", str(e))
-        return {"error": "网络错误", "detail": str(e)}
+    return content
 
+@traced("http", "ark.image_cases")
 async def call_doubao_llm(text: str, image_name:str, image_base64: str):
-    headers = {
-        "Authorization": f"Bearer {ARK_API_KEY}",
-        "Content-Type": "application/json"
-    }
-
     payload = {
-        "model": "doubao-1.5-vision-pro-250328",
+        **stage_params("image_cases"),
         "messages": [
             {"role": "system", "content": "你是一个专业的测试用例生成助手。"},
             {"role": "user", "content": f"""
@@ -252,59 +287,44 @@ async def call_doubao_llm(text: str, image_name:str, image_base64: str):
                     }
                 ]
             }
-        ],
-        "temperature": 0.5,
-        "top_p": 0.9,
-        "max_tokens": 16384
+        ]
     }
-    try:
-        async with httpx.AsyncClient(timeout=180) as client:
-            res = await client.post(f"{ARK_BASE_URL}/chat/completions", json=payload, headers=headers)
-
-            # 如果 Ark 返回了非 2xx 状态码
-            if res.status_code != 200:
-                print("❌ Ark 请求失败：", res.status_code, res.text)
-
-            res.raise_for_status()
-            content = res.json()["choices"][0]["message"]["content"]
-
-            # 分离 markdown 和 json 部分
-            if '---JSON OUTPUT---' not in content:
-                print("没找到分隔符")
-                raise ValueError("响应中缺少 JSON 分隔符")
+    data = await _post_ark_chat(payload)
 
-            md_part, json_part = content.split('---JSON OUTPUT---', 1)
-
-            print(md_part)
-            print("----------")
-            print(json_part)
-
-            return {
-                "markdown": md_part.strip(),
-                "json": json_part
-            }
+    record_tokens(payload["model"], data.get("usage"))
+    content = data["choices"][0]["message"]["content"]
 
-    except httpx.HTTPError as e:
-        # 捕获网络类错误，例如连接失败、超时
-        print("❌ 网络错误：", str(e))
-        return {"error": "网络错误", "detail": str(e)}
+    # 分离 markdown 和 json 部分；缺少分隔符时直接在全文中定位 JSON
+    if '---JSON OUTPUT---' in content:
+        md_part, json_part = content.split('---JSON OUTPUT---', 1)
+    else:
+        print("没找到分隔符，尝试直接提取 JSON")
+        value, json_start, json_end = find_json(content, expect=dict)
+        md_part = content[:json_start].rstrip().removesuffix("```json").removesuffix("```")
+        json_part = json.dumps(value, ensure_ascii=False)
+
+    print(md_part)
+    print("----------")
+    print(json_part)
+
+    return {
+        "markdown": md_part.strip(),
+        "json": json_part
+    }
 
-    except Exception as e:
-        print("❌ 未知错误：", str(e))
-        return {"error": "未知错误", "detail": str(e)}
 
 
 # LLM 调用
 async def call_deepseek_llm(prd: str) -> Dict[str, any]:
     keypoint = await extract_keypoint_from_prd(prd)
     print(keypoint)
-    headers = {
-        "Authorization": f"Bearer {ARK_API_KEY}",
-        "Content-Type": "application/json"
-    }
+    return await generate_cases_from_keypoint(keypoint)
+
 
+@traced("http", "ark.generate_cases")
+async def generate_cases_from_keypoint(keypoint: str) -> Dict[str, any]:
     payload = {
-        "model": ARK_MODEL_ID,
+        **stage_params("generate_cases", ARK_MODEL_ID),
         "messages": [
             {"role": "system", "content": "你是一个专业的测试用例生成助手。"},
             {"role": "user", "content": f"""
@@ -329,33 +349,21 @@ async def call_deepseek_llm(prd: str) -> Dict[str, any]:
     以下是文档内容：
     {keypoint}
 """}
-        ],
-        "temperature": 0.5,
-        "top_p": 0.9,
-        "max_tokens": 16384
+        ]
     }
-    try:
-        async with httpx.AsyncClient(timeout=180) as client:
-            res = await client.post(f"{ARK_BASE_URL}/chat/completions", json=payload, headers=headers)
-
-            # 如果 Ark 返回了非 2xx 状态码
-            if res.status_code != 200:
-                print("❌ Ark 请求失败：", res.status_code, res.text)
-
+    data = await _post_ark_chat(payload)
 
-            res.raise_for_status()
-            content = res.json()["choices"][0]["message"]["content"]
+    record_tokens(payload["model"], data.get("usage"))
+    content = data["choices"][0]["message"]["content"]
 
-            return {
-                "success": True,
-                "json": content
-            }
+    # 去掉代码块和说明文字，只返回用例 JSON；提取失败时保留原文
+    try:
+        content = json.dumps(extract_json(content, expect=dict), ensure_ascii=False)
+    except JSONExtractError:
+        print("未能从模型输出中提取 JSON，返回原文")
 
-    except httpx.HTTPError as e:
-        # 捕获网络类错误，例如连接失败、超时
-        print("❌ 网络错误：", str(e))
-        return {"error": "网络错误", "detail": str(e)}
+    return {
+        "success": True,
+        "json": content
+    }
 
-    except Exception as e:
-        print("❌ 未知错误：", str(e))
-        return {"error": "未知错误", "detail": str(e)}
@@ -0,0 +1,171 @@
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from metrics import REGISTRY, span
+from model_routing import use_profile
+from HandleUpload import extract_markdown, extract_keypoint_from_prd, generate_cases_from_keypoint
+
+logger = logging.getLogger(__name__)
+
+# 各阶段的并发 worker 数：解析主要占 CPU（在线程中执行），后两个阶段主要在等待模型
+PARSE_WORKERS = int(os.environ.get("BATCH_PARSE_WORKERS", "2"))
+KEYPOINT_WORKERS = int(os.environ.get("BATCH_KEYPOINT_WORKERS", "4"))
+GENERATE_WORKERS = int(os.environ.get("BATCH_GENERATE_WORKERS", "4"))
+# 阶段之间队列的容量；下游跟不上时上游暂停，避免解析结果堆积在内存中
+QUEUE_SIZE = int(os.environ.get("BATCH_QUEUE_SIZE", "8"))
+MAX_DOCUMENTS = int(os.environ.get("BATCH_MAX_DOCUMENTS", "50"))
+
+QUEUE_DEPTH = REGISTRY.gauge(
+    "lark_batch_queue_depth", "批量生成各阶段等待处理的文档数", ["stage"])
+
+_DONE = object()
+
+
+@dataclass
+class BatchItem:
+    """批量任务中的一个文档，value 为当前阶段的输入，处理完后替换为该阶段的输出"""
+    index: int
+    name: str
+    value: object
+    filename: Optional[str] = None
+    error: Optional[str] = None
+    failed_stage: Optional[str] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    started_at: float = field(default_factory=time.perf_counter)
+
+    def result(self) -> dict:
+        elapsed = round(time.perf_counter() - self.started_at, 3)
+        timings = {stage: round(seconds, 3) for stage, seconds in self.timings.items()}
+        if self.error is not None:
+            return {"index": self.index, "name": self.name, "success": False, "stage": self.failed_stage,
+                    "error": self.error, "timings": timings, "elapsed": elapsed}
+        return {"index": self.index, "name": self.name, "success": True, "json": self.value["json"],
+                "timings": timings, "elapsed": elapsed}
+
+
+@dataclass
+class Stage:
+    name: str
+    func: Callable[[BatchItem], Awaitable[object]]
+    workers: int
+
+
+async def parse_document(item: BatchItem) -> str:
+    if item.filename is None:
+        return item.value
+    return await extract_markdown(item.value, item.filename)
+
+
+async def extract_keypoint(item: BatchItem) -> str:
+    return await extract_keypoint_from_prd(item.value)
+
+
+async def generate_cases(item: BatchItem) -> dict:
+    return await generate_cases_from_keypoint(item.value)
+
+
+def default_stages() -> List[Stage]:
+    return [
+        Stage("parse", parse_document, PARSE_WORKERS),
+        Stage("keypoint", extract_keypoint, KEYPOINT_WORKERS),
+        Stage("generate", generate_cases, GENERATE_WORKERS),
+    ]
+
+
+class BatchPipeline:
+    """
+    分阶段流水线：解析 -> 提取测试点 -> 生成用例。
+    每个阶段有独立的 worker 和有界队列，不同文档的解析与模型等待相互重叠；
+    文档按完成顺序产出结果，某一阶段失败的文档直接产出错误，不影响其他文档
+    """
+
+    def __init__(self, stages: Optional[List[Stage]] = None, queue_size: int = QUEUE_SIZE,
+                 profile: Optional[str] = None):
+        self.stages = stages or default_stages()
+        self.queue_size = queue_size
+        self.profile = profile
+
+    @staticmethod
+    async def _enqueue(queue: asyncio.Queue, item: BatchItem, stage_name: str):
+        QUEUE_DEPTH.inc(stage=stage_name)
+        try:
+            await queue.put(item)
+        except asyncio.CancelledError:
+            QUEUE_DEPTH.dec(stage=stage_name)
+            raise
+
+    async def _worker(self, stage: Stage, inbox: asyncio.Queue, outbox: asyncio.Queue,
+                      results: asyncio.Queue, next_stage: Optional[str]):
+        while True:
+            item = await inbox.get()
+            if item is _DONE:
+                return
+            QUEUE_DEPTH.dec(stage=stage.name)
+            start = time.perf_counter()
+            try:
+                with span("batch", stage.name):
+                    item.value = await stage.func(item)
+            except Exception as e:
+                logger.warning(f"批量任务 {item.name} 在 {stage.name} 阶段失败: {e}")
+                item.error = str(e) or type(e).__name__
+                item.failed_stage = stage.name
+                await results.put(item)
+                continue
+            finally:
+                item.timings[stage.name] = time.perf_counter() - start
+            if next_stage is None:
+                await outbox.put(item)
+            else:
+                await self._enqueue(outbox, item, next_stage)
+
+    async def _run_stage(self, stage: Stage, inbox: asyncio.Queue, outbox: asyncio.Queue,
+                         results: asyncio.Queue, next_stage: Optional[str], next_workers: int):
+        workers = [asyncio.create_task(self._worker(stage, inbox, outbox, results, next_stage))
+                   for _ in range(stage.workers)]
+        await asyncio.gather(*workers)
+        # 本阶段全部结束后通知下一阶段的每个 worker 退出
+        for _ in range(next_workers):
+            await outbox.put(_DONE)
+
+    async def _feed(self, items: List[BatchItem], inbox: asyncio.Queue, workers: int):
+        for item in items:
+            await self._enqueue(inbox, item, self.stages[0].name)
+        for _ in range(workers):
+            await inbox.put(_DONE)
+
+    async def run(self, items: List[BatchItem]) -> AsyncIterator[dict]:
+        """按完成顺序逐个产出每个文档的结果"""
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        # 结果队列不设上限：结果由调用方消费，worker 不能因调用方慢而卡住后续阶段
+        results: asyncio.Queue = asyncio.Queue()
+        tasks = []
+        # worker 在创建时复制当前上下文，模型配置对整个批次生效
+        with use_profile(self.profile):
+            tasks.append(asyncio.create_task(self._feed(items, queues[0], self.stages[0].workers)))
+            for i, stage in enumerate(self.stages):
+                if i + 1 < len(self.stages):
+                    following = self.stages[i + 1]
+                    outbox, next_stage, next_workers = queues[i + 1], following.name, following.workers
+                else:
+                    outbox, next_stage, next_workers = results, None, 1
+                tasks.append(asyncio.create_task(
+                    self._run_stage(stage, queues[i], outbox, results, next_stage, next_workers)))
+        try:
+            while True:
+                item = await results.get()
+                if item is _DONE:
+                    break
+                yield item.result()
+        finally:
+            # 调用方提前退出（如客户端断开）时取消所有未完成的工作
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for stage, queue in zip(self.stages, queues):
+                while not queue.empty():
+                    if queue.get_nowait() is not _DONE:
+                        QUEUE_DEPTH.dec(stage=stage.name)
@@ -0,0 +1,495 @@
+"""
+CPU 热点函数的微基准测试，结果保存为 JSON 基线，并与基线比较以发现性能回退
+
+用法：
+    python benchmark.py --save-baseline            # 生成/覆盖基线
+    python benchmark.py                            # 与基线比较，回退超过阈值时返回非零退出码
+    python benchmark.py --only clean_text,validate_testcases --sizes 100,10000
+    python benchmark.py --suite import              # 各服务模块在全新进程中的导入耗时
+    python benchmark.py --suite memory --sizes 100000  # 用例以 dict 和 TestCase 保存时的内存占用
+"""
+import os
+import sys
+import gc
+import subprocess
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import datetime
+import tracemalloc
+import importlib.util
+from typing import Callable, Dict, List, Optional
+
+DEFAULT_SIZES = (10 ** 2, 10 ** 4, 10 ** 6)
+DEFAULT_BASELINE_FILE = "benchmark_baseline.json"
+DEFAULT_THRESHOLD = 0.2  # 比基线慢 20% 以上视为回退
+
+EVALUATOR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "(sr)GenerateAndCompareCasesAPI.py")
+
+_WORDS = ["登录", "注册", "密码", "账号", "校验", "提示", "页面", "按钮", "输入", "提交", "跳转", "成功", "失败",
+          "手机号", "验证码", "权限", "列表", "详情", "导出", "上传"]
+
+
+def load_evaluator():
+    """评测脚本文件名带括号，无法直接 import，按路径加载"""
+    module = sys.modules.get("evaluator")
+    if module is None:
+        spec = importlib.util.spec_from_file_location("evaluator", EVALUATOR_PATH)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["evaluator"] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            sys.modules.pop("evaluator", None)
+            raise
+    return module
+
+
+# --- 合成数据 ---
+def random_sentence(rng: random.Random, words: int = 8) -> str:
+    return "".join(rng.choice(_WORDS) for _ in range(words))
+
+
+def make_test_cases(n: int, seed: int = 0, duplicate_ratio: float = 0.1) -> List[dict]:
+    """生成 n 条测试用例，其中约 duplicate_ratio 比例与前面的用例重复"""
+    rng = random.Random(seed)
+    cases = []
+    for i in range(n):
+        if cases and rng.random() < duplicate_ratio:
+            base = rng.choice(cases)
+            cases.append({**base, "case_id": f"{i + 1:03d}"})
+            continue
+        cases.append({
+            "case_id": f"{i + 1:03d}",
+            "title": f"{random_sentence(rng, 4)}{i}",
+            "preconditions": f"1. {random_sentence(rng)}；2. {random_sentence(rng)}",
+            "steps": [f"{k}. {random_sentence(rng)}{i}" for k in range(1, 4)],
+            "expected_results": [f"{k}. {random_sentence(rng)}{i}" for k in range(1, 3)],
+        })
+    return cases
+
+
+def make_feishu_blocks(n: int, seed: int = 0) -> List[dict]:
+    """生成 n 个飞书文档块：标题、正文、无序/有序列表和代码块混合，挂在同一个页面块下"""
+    rng = random.Random(seed)
+    page = {"block_id": "page", "block_type": 1, "children": []}
+    blocks = [page]
+    for i in range(n - 1):
+        block_id = f"b{i}"
+        elements = [{"text_run": {"content": random_sentence(rng)}}]
+        kind = rng.random()
+        if kind < 0.1:
+            level = rng.randint(1, 3)
+            block = {"block_id": block_id, "block_type": level + 2, f"heading{level}": {"elements": elements}}
+        elif kind < 0.6:
+            block = {"block_id": block_id, "block_type": 2, "text": {"elements": elements}}
+        elif kind < 0.8:
+            block = {"block_id": block_id, "block_type": 10, "bullet": {"elements": elements}}
+        elif kind < 0.95:
+            block = {"block_id": block_id, "block_type": 11, "ordered": {"elements": elements}}
+        else:
+            block = {"block_id": block_id, "block_type": 14, "code": {"elements": elements}}
+        block["parent_id"] = "page"
+        page["children"].append(block_id)
+        blocks.append(block)
+    return blocks
+
+
+def make_text(n: int, seed: int = 0) -> str:
+    """生成包含 n 个词、夹杂各种空白的文本"""
+    rng = random.Random(seed)
+    separators = [" ", "  ", "\n", "\t", " \n "]
+    return "".join(rng.choice(_WORDS) + rng.choice(separators) for _ in range(n))
+
+
+def make_docx(n: int, seed: int = 0) -> bytes:
+    """生成 n 个段落的 docx（含标题、列表、表格和少量图片）"""
+    from io import BytesIO
+    from docx import Document
+    from PIL import Image
+
+    rng = random.Random(seed)
+    image_buffer = BytesIO()
+    Image.new("RGB", (32, 32), (200, 30, 30)).save(image_buffer, format="PNG")
+
+    doc = Document()
+    for i in range(n):
+        kind = rng.random()
+        if kind < 0.1:
+            doc.add_heading(random_sentence(rng, 3), level=rng.randint(1, 3))
+        elif kind < 0.3:
+            doc.add_paragraph(random_sentence(rng), style="List Bullet")
+        elif kind < 0.301:
+            image_buffer.seek(0)
+            doc.add_picture(image_buffer)
+        else:
+            doc.add_paragraph(random_sentence(rng, 12))
+    table = doc.add_table(rows=max(2, n // 100), cols=4)
+    for row in table.rows:
+        for cell in row.cells:
+            cell.text = random_sentence(rng, 2)
+    buffer = BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def make_pdf(n: int, seed: int = 0, lines_per_page: int = 40) -> bytes:
+    """生成共 n 行文本的 pdf"""
+    import fitz
+
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for start in range(0, n, lines_per_page):
+        page = doc.new_page()
+        lines = []
+        for i in range(start, min(n, start + lines_per_page)):
+            prefix = "- " if rng.random() < 0.3 else ""
+            lines.append(f"{prefix}line {i} " + " ".join(rng.choice(["login", "password", "submit", "check"])
+                                                       for _ in range(6)))
+        page.insert_text((36, 36), "\n".join(lines), fontsize=8)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+# --- 基准项 ---
+class Benchmark:
+    def __init__(self, name: str, setup: Callable[[int], object], run: Callable[[object], object],
+                 max_size: int = max(DEFAULT_SIZES)):
+        self.name = name
+        self.setup = setup
+        self.run = run
+        # 超过 max_size 的规模会被跳过（例如 O(n^2) 的去重分析）
+        self.max_size = max_size
+
+
+def _run_async(coro):
+    return asyncio.run(coro)
+
+
+def _bench_blocks_to_markdown():
+    from feishu_api import blocks_to_markdown
+    return Benchmark("blocks_to_markdown",
+                     setup=lambda n: make_feishu_blocks(n),
+                     run=lambda blocks: blocks_to_markdown(blocks, {}))
+
+
+def _bench_find_duplicates():
+    from case_analysis import find_duplicate_test_cases
+    # 逐条与已有用例做 difflib 比较，复杂度为 O(n^2)
+    return Benchmark("find_duplicate_test_cases", setup=lambda n: make_test_cases(n),
+                     run=find_duplicate_test_cases, max_size=10 ** 3)
+
+
+def _bench_extract_pdf():
+    import HandleUpload
+
+    def run(data):
+        return _run_async(HandleUpload.extract_markdown_from_pdf(data))
+    return Benchmark("extract_markdown_from_pdf", setup=lambda n: make_pdf(n), run=run, max_size=10 ** 4)
+
+
+def _bench_extract_docx():
+    import HandleUpload
+
+    async def fake_caption(base64_image: str) -> str:
+        return "图片描述"
+
+    def run(data):
+        original = HandleUpload.get_model_text_from_image
+        HandleUpload.get_model_text_from_image = fake_caption  # 屏蔽视觉模型调用
+        try:
+            return _run_async(HandleUpload.extract_markdown_from_docx(data))
+        finally:
+            HandleUpload.get_model_text_from_image = original
+    return Benchmark("extract_markdown_from_docx", setup=lambda n: make_docx(n), run=run, max_size=10 ** 4)
+
+
+def _bench_format_test_cases():
+    evaluator = load_evaluator()
+
+    def setup(n):
+        return json.dumps({"testcases": {"test_suite": "bench", "test_cases": make_test_cases(n)}},
+                          ensure_ascii=False)
+
+    def run(content):
+        return _run_async(evaluator.format_test_cases(None, content, "AI"))
+    return Benchmark("format_test_cases", setup=setup, run=run, max_size=10 ** 5)
+
+
+def _bench_validate_testcases():
+    from langgraph_use import validate_testcases
+
+    def setup(n):
+        return {"prd_title": "bench", "testcases": {"test_cases": make_test_cases(n)}}
+
+    def run(state):
+        # validate_testcases 会原地重新编号，复制一层避免多次运行互相影响
+        fresh = {**state, "testcases": {"test_cases": [dict(c) for c in state["testcases"]["test_cases"]]}}
+        return _run_async(validate_testcases(fresh))
+    return Benchmark("validate_testcases", setup=setup, run=run, max_size=10 ** 5)
+
+
+def _testcase_json(n: int) -> str:
+    return json.dumps({"test_suite": "bench", "test_cases": make_test_cases(n)}, ensure_ascii=False)
+
+
+def _bench_testcase_json_dicts():
+    # 对照组：原先以 dict 列表保存并按 indent=2 编码、解码
+    def run(text):
+        data = json.loads(text)
+        return json.dumps(data, ensure_ascii=False, indent=2)
+    return Benchmark("testcase_json_dicts", setup=_testcase_json, run=run, max_size=10 ** 5)
+
+
+def _bench_testcase_json():
+    from testcase_model import TestSuite
+
+    def run(text):
+        return TestSuite.from_json(text).to_json()
+    return Benchmark("testcase_json", setup=_testcase_json, run=run, max_size=10 ** 5)
+
+
+def _bench_testcase_binary():
+    from testcase_model import TestSuite
+
+    def run(data):
+        return TestSuite.from_bytes(data).to_bytes()
+    return Benchmark("testcase_binary", setup=lambda n: TestSuite.from_json(_testcase_json(n)).to_bytes(),
+                     run=run, max_size=10 ** 5)
+
+
+def _bench_clean_text():
+    from utils import clean_text
+    return Benchmark("clean_text", setup=lambda n: make_text(n), run=clean_text)
+
+
+BENCHMARK_FACTORIES = {
+    "blocks_to_markdown": _bench_blocks_to_markdown,
+    "find_duplicate_test_cases": _bench_find_duplicates,
+    "extract_markdown_from_pdf": _bench_extract_pdf,
+    "extract_markdown_from_docx": _bench_extract_docx,
+    "format_test_cases": _bench_format_test_cases,
+    "validate_testcases": _bench_validate_testcases,
+    "clean_text": _bench_clean_text,
+    "testcase_json_dicts": _bench_testcase_json_dicts,
+    "testcase_json": _bench_testcase_json,
+    "testcase_binary": _bench_testcase_binary,
+}
+
+
+# --- 内存占用 ---
+# 解析同一份用例 JSON 后保留的对象占用的内存（字节）
+def _load_dicts(text: str):
+    return json.loads(text)
+
+
+def _load_testsuite(text: str):
+    from testcase_model import TestSuite
+    return TestSuite.from_json(text)
+
+
+MEMORY_TARGETS = {
+    "testcase_dicts": _load_dicts,
+    "testcase_suite": _load_testsuite,
+}
+
+
+def run_memory_benchmarks(names: List[str], sizes: List[int]) -> Dict[str, float]:
+    results = {}
+    for size in sizes:
+        text = _testcase_json(size)
+        for name in names:
+            gc.collect()
+            tracemalloc.start()
+            try:
+                value = MEMORY_TARGETS[name](text)
+                retained, _peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            del value
+            key = f"memory[{name}][{size}]"
+            results[key] = retained
+            print(f"{key:<40} {retained / 1024:>12.1f} KiB", file=sys.stderr)
+    return results
+
+
+# --- 导入耗时 ---
+# 每项在全新的解释器进程中执行，统计从导入开始到完成的耗时（不含解释器自身启动）
+IMPORT_TARGETS = {
+    "GenerateAndCompareCasesAPI": "import GenerateAndCompareCasesAPI",
+    "HandleUpload": "import HandleUpload",
+    "langgraph_use": "import langgraph_use",
+    "evaluator": "import benchmark; benchmark.load_evaluator()",
+}
+
+_IMPORT_SNIPPET = """
+import sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+exec({statement!r})
+print(time.perf_counter() - start)
+"""
+
+
+def time_import(statement: str, repeat: int) -> float:
+    """在子进程中执行导入语句，多次运行取最小值；导入失败时抛出 ImportError"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    code = _IMPORT_SNIPPET.format(root=root, statement=statement)
+    best = float("inf")
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True)
+        if proc.returncode != 0:
+            lines = proc.stderr.strip().splitlines()
+            raise ImportError(lines[-1] if lines else f"退出码 {proc.returncode}")
+        best = min(best, float(proc.stdout.strip().splitlines()[-1]))
+    return best
+
+
+def run_import_benchmarks(names: List[str], repeat: int) -> Dict[str, float]:
+    results = {}
+    for name in names:
+        try:
+            seconds = time_import(IMPORT_TARGETS[name], repeat)
+        except ImportError as e:
+            print(f"跳过 import[{name}]: {e}", file=sys.stderr)
+            continue
+        key = f"import[{name}]"
+        results[key] = seconds
+        print(f"{key:<40} {seconds * 1000:>12.3f} ms", file=sys.stderr)
+    return results
+
+
+def time_call(func: Callable, arg, repeat: int) -> float:
+    """多次运行取最小值，减少调度抖动的影响"""
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func(arg)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_benchmarks(names: List[str], sizes: List[int], repeat: int) -> Dict[str, float]:
+    results = {}
+    for name in names:
+        try:
+            bench = BENCHMARK_FACTORIES[name]()
+        except ImportError as e:
+            print(f"跳过 {name}: 缺少依赖 {e}", file=sys.stderr)
+            continue
+        for size in sizes:
+            if size > bench.max_size:
+                print(f"跳过 {name}[{size}]: 超过最大规模 {bench.max_size}", file=sys.stderr)
+                continue
+            data = bench.setup(size)
+            # 大规模输入只跑一次，避免基准耗时过长
+            seconds = time_call(bench.run, data, repeat if size < 10 ** 5 else 1)
+            key = f"{name}[{size}]"
+            results[key] = seconds
+            print(f"{key:<40} {seconds * 1000:>12.3f} ms", file=sys.stderr)
+    return results
+
+
+def compare_with_baseline(results: Dict[str, float], baseline: Dict[str, float], threshold: float) -> List[dict]:
+    regressions = []
+    for key, seconds in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        ratio = seconds / previous
+        if ratio > 1 + threshold:
+            regressions.append({"benchmark": key, "baseline_s": previous, "current_s": seconds,
+                                "slowdown": round(ratio, 3)})
+    return regressions
+
+
+def load_baseline(path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(path: str, results: Dict[str, float]):
+    # 与已有基线合并，分别保存不同 suite 的结果时互不覆盖
+    previous = load_baseline(path) or {}
+    results = {**previous.get("results", {}), **results}
+    data = {
+        "meta": {
+            "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="CPU 热点函数微基准")
+    parser.add_argument("--suite", choices=("cpu", "import", "memory", "all"), default="cpu",
+                        help="cpu: 热点函数；import: 模块导入耗时；memory: 用例对象内存占用；all: 全部")
+    parser.add_argument("--only", type=lambda v: [s.strip() for s in v.split(",") if s.strip()],
+                        default=None, help="逗号分隔的基准项名称（import suite 为模块名）")
+    parser.add_argument("--sizes", type=lambda v: [int(s) for s in v.split(",")], default=list(DEFAULT_SIZES),
+                        help="输入规模，逗号分隔")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数（取最小值）")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_FILE, help="基线文件路径")
+    parser.add_argument("--save-baseline", action="store_true", help="将本次结果保存为基线")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="回退判定阈值（比例）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    cpu_names, import_names, memory_names = [], [], []
+    if args.suite in ("cpu", "all"):
+        cpu_names = list(BENCHMARK_FACTORIES)
+    if args.suite in ("import", "all"):
+        import_names = list(IMPORT_TARGETS)
+    if args.suite in ("memory", "all"):
+        memory_names = list(MEMORY_TARGETS)
+    if args.only is not None:
+        unknown = [name for name in args.only
+                   if name not in BENCHMARK_FACTORIES and name not in IMPORT_TARGETS and name not in MEMORY_TARGETS]
+        if unknown:
+            print(f"未知基准项: {', '.join(unknown)}", file=sys.stderr)
+            return 2
+        cpu_names = [name for name in args.only if name in BENCHMARK_FACTORIES]
+        import_names = [name for name in args.only if name in IMPORT_TARGETS]
+        memory_names = [name for name in args.only if name in MEMORY_TARGETS]
+
+    results = run_benchmarks(cpu_names, args.sizes, args.repeat)
+    results.update(run_import_benchmarks(import_names, args.repeat))
+    results.update(run_memory_benchmarks(memory_names, args.sizes))
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        print(f"基线已保存到 {args.baseline}")
+        return 0
+
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        print(f"未找到基线文件 {args.baseline}，请先使用 --save-baseline 生成")
+        return 0
+
+    regressions = compare_with_baseline(results, baseline.get("results", {}), args.threshold)
+    if not regressions:
+        print("未发现性能回退")
+        return 0
+
+    print(f"发现 {len(regressions)} 项性能回退（阈值 {args.threshold:.0%}）：")
+    for item in regressions:
+        print(f"  {item['benchmark']}: {item['baseline_s'] * 1000:.3f} ms -> "
+              f"{item['current_s'] * 1000:.3f} ms (x{item['slowdown']})")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
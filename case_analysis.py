@@ -0,0 +1,158 @@
+import difflib
+from collections import Counter
+from dataclasses import dataclass
+from typing import List, Tuple
+
+from metrics import traced
+from testcase_model import TestCase, TestSuite, dumps_cases
+from json_stream import CaseStream
+
+# 评测中占 CPU 的步骤：格式化和查重。放在可独立导入的模块中，批量评测时可在子进程中执行
+
+# 格式化后的AI测试用例所属的测试套件名称
+SUITE_NAME = "B端产品登录功能模块"
+
+
+def format_case_stream(stream: CaseStream) -> list:
+    """逐条读取并格式化用例，内存中只保留格式化后的结果"""
+    formatted_test_cases = []
+    for i, (raw_case, _category) in enumerate(stream):
+        if not isinstance(raw_case, dict):
+            continue
+        case = TestCase.from_dict(raw_case, i)
+        # 确保case_id字段
+        if not case.case_id.startswith("TC-"):
+            case.case_id = f"TC-FUNC-{case.case_id}"
+        if not case.title:
+            case.title = f"测试用例{len(formatted_test_cases)+1}"
+        # 步骤和预期结果输出为字符串
+        formatted_test_cases.append(case.to_dict(joined=True))
+    return formatted_test_cases
+
+
+def format_cases(source, file_type: str = "AI") -> Tuple[dict, int]:
+    """
+    按流读取并格式化用例
+
+    :param source: JSON字符串或文件路径（pathlib.Path）
+    :param file_type: "AI" 时统一编号和字段格式；"Golden" 时不改写用例内容，只统一为按分类分组的结构
+    :return: (格式化后的用例, 读取的条目数)
+    """
+    stream = CaseStream(source)
+    if file_type == "Golden":
+        suite = TestSuite.from_pairs(stream)
+        suite.name = stream.suite_name
+        return suite.to_obj(grouped=True), stream.count
+
+    formatted_test_cases = format_case_stream(stream)
+    return {
+        "test_suite": SUITE_NAME,
+        "test_cases": {
+            "functional_test_cases": formatted_test_cases
+        }
+    }, stream.count
+
+
+@traced("stage", "find_duplicate_test_cases")
+def find_duplicate_test_cases(test_cases):
+    """
+    查找重复的测试用例
+
+    :param test_cases: 测试用例列表或迭代器
+    :return: 重复的测试用例信息和重复率
+    """
+    # 存储标题、步骤和预期结果的哈希值
+    title_hash = {}
+    steps_hash = {}
+    expected_results_hash = {}
+    duplicate_info = {
+        "duplicate_count": 0,
+        "duplicate_rate": 0.0,
+        "title_duplicates": [],
+        "steps_duplicates": [],
+        "mixed_duplicates": []  # 步骤和预期结果高度相似但标题不同的测试用例
+    }
+
+    # 只遍历一遍，test_cases 可以是列表，也可以是逐条产出用例的迭代器
+    total_cases = 0
+    title_counter = Counter()
+
+    # 查找步骤或预期结果高度相似的测试用例
+    for i, case in enumerate(test_cases):
+        # 规范化一次，之后直接使用拼接好的步骤和预期结果文本
+        case = TestCase.from_dict(case, i)
+        total_cases += 1
+        title_counter[case.title] += 1
+        case_id = case.case_id
+        title = case.title
+
+        # 处理步骤
+        steps = case.steps_text
+        if steps:
+            # 计算步骤的哈希值
+            for existing_steps, existing_ids in steps_hash.items():
+                # 使用序列匹配算法比较相似度
+                similarity = difflib.SequenceMatcher(None, steps, existing_steps).ratio()
+                if similarity > 0.8:  # 相似度阈值
+                    existing_ids.append((case_id, title))
+                    break
+            else:
+                steps_hash[steps] = [(case_id, title)]
+
+        # 处理预期结果
+        expected_results = case.expected_text
+        if expected_results:
+            # 计算预期结果的哈希值
+            for existing_results, existing_ids in expected_results_hash.items():
+                # 使用序列匹配算法比较相似度
+                similarity = difflib.SequenceMatcher(None, expected_results, existing_results).ratio()
+                if similarity > 0.8:  # 相似度阈值
+                    existing_ids.append((case_id, title))
+                    break
+            else:
+                expected_results_hash[expected_results] = [(case_id, title)]
+
+    if total_cases <= 1:
+        return duplicate_info
+
+    # 查找标题重复的测试用例
+    for title, count in title_counter.items():
+        if count > 1 and title:
+            duplicate_info["title_duplicates"].append({"title": title, "count": count})
+
+    # 统计步骤重复的测试用例
+    for steps, ids in steps_hash.items():
+        if len(ids) > 1:
+            duplicate_info["steps_duplicates"].append({
+                "count": len(ids),
+                "case_ids": [id[0] for id in ids],
+                "titles": [id[1] for id in ids]
+            })
+
+    # 计算重复测试用例数量和比率
+    duplicate_count = len(duplicate_info["title_duplicates"]) + len(duplicate_info["steps_duplicates"])
+    duplicate_info["duplicate_count"] = duplicate_count
+    duplicate_info["duplicate_rate"] = round(duplicate_count / total_cases * 100, 2) if total_cases > 0 else 0
+
+    return duplicate_info
+
+
+@dataclass
+class EvaluationInput:
+    """格式化、查重后的一组用例；同一输入只处理一次，供所有评测组合共用"""
+    name: str
+    cases: List[TestCase]
+    duplicates: dict
+    cases_json: str  # 评测提示中使用的紧凑 JSON
+
+
+def build_evaluation_input(formatted: dict, name: str = "") -> EvaluationInput:
+    """规范化格式化后的用例并统计重复情况"""
+    cases = TestSuite.from_obj(formatted).cases
+    return EvaluationInput(name, cases, find_duplicate_test_cases(cases), dumps_cases(cases))
+
+
+def prepare_file(source, file_type: str, name: str = "") -> EvaluationInput:
+    """格式化并查重一个用例文件，供进程池调用（参数和返回值均可 pickle）"""
+    formatted, _count = format_cases(source, file_type)
+    return build_evaluation_input(formatted, name or str(source))
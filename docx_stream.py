@@ -0,0 +1,280 @@
+import re
+import base64
+import zipfile
+import posixpath
+import hashlib
+from io import BytesIO
+from typing import Dict, Iterator, List, Optional, Tuple
+from xml.etree.ElementTree import iterparse, parse
+
+# 单遍流式解析 docx：直接对 word/document.xml 做 iterparse，按文档顺序输出标题、列表、表格和图片引用。
+# 正文中每个顶层块处理完即从树上移除，内存占用只与单个块（段落或表格）的大小有关，与文档页数无关
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+R = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+A = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+V = "{urn:schemas-microsoft-com:vml}"
+PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+DOCUMENT_PART = "word/document.xml"
+
+# 视觉模型可直接识别的图片格式，无需解码转换
+_IMAGE_MIME = {
+    "png": "png",
+    "jpg": "jpeg",
+    "jpeg": "jpeg",
+    "gif": "gif",
+    "bmp": "bmp",
+    "webp": "webp",
+}
+
+_HEADING_RE = re.compile(r"^heading\s*(\d)$")
+
+
+class DocxFormatError(ValueError):
+    pass
+
+
+def _attr(elem, name: str) -> Optional[str]:
+    return elem.get(W + name) if elem is not None else None
+
+
+class DocxStreamReader:
+    """
+    按文档顺序读取 docx 正文
+
+    用法：
+        with DocxStreamReader(file_bytes) as reader:
+            for kind, value in reader.blocks():
+                ...  # ("text", markdown) 或 ("image", 图片在包内的路径)
+            data_url = reader.image_data_url(path)
+    """
+
+    def __init__(self, file_bytes: bytes):
+        try:
+            self._zip = zipfile.ZipFile(BytesIO(file_bytes))
+        except zipfile.BadZipFile as e:
+            raise DocxFormatError(f"不是有效的 docx 文件: {e}") from e
+        if DOCUMENT_PART not in self._zip.namelist():
+            raise DocxFormatError("docx 缺少 word/document.xml")
+        self._rels = self._load_rels()
+        self._styles = self._load_styles()
+        self._numbering = self._load_numbering()
+        self._seen_images = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._zip.close()
+
+    # --- 辅助部件（体积小，一次性读取） ---
+    def _parse_part(self, name: str):
+        try:
+            with self._zip.open(name) as f:
+                return parse(f).getroot()
+        except KeyError:
+            return None
+
+    def _load_rels(self) -> Dict[str, str]:
+        """rId -> 包内路径（只保留内部图片等部件，外链忽略）"""
+        root = self._parse_part("word/_rels/document.xml.rels")
+        rels = {}
+        if root is None:
+            return rels
+        for rel in root.iter(PKG_REL + "Relationship"):
+            if rel.get("TargetMode") == "External":
+                continue
+            target = rel.get("Target", "")
+            if target.startswith("/"):
+                path = target.lstrip("/")
+            else:
+                path = posixpath.normpath(posixpath.join("word", target))
+            rels[rel.get("Id")] = path
+        return rels
+
+    def _load_styles(self) -> Dict[str, str]:
+        """styleId -> 样式名（小写），如 Heading1 -> heading 1"""
+        root = self._parse_part("word/styles.xml")
+        styles = {}
+        if root is None:
+            return styles
+        for style in root.iter(W + "style"):
+            style_id = _attr(style, "styleId")
+            name = _attr(style.find(W + "name"), "val")
+            if style_id:
+                styles[style_id] = (name or style_id).lower()
+        return styles
+
+    def _load_numbering(self) -> Dict[Tuple[str, str], str]:
+        """(numId, ilvl) -> 编号格式（bullet / decimal 等），用于区分有序和无序列表"""
+        root = self._parse_part("word/numbering.xml")
+        formats = {}
+        if root is None:
+            return formats
+        abstract_formats = {}
+        for abstract in root.iter(W + "abstractNum"):
+            levels = {}
+            for lvl in abstract.iter(W + "lvl"):
+                levels[_attr(lvl, "ilvl")] = _attr(lvl.find(W + "numFmt"), "val") or "bullet"
+            abstract_formats[_attr(abstract, "abstractNumId")] = levels
+        for num in root.iter(W + "num"):
+            levels = abstract_formats.get(_attr(num.find(W + "abstractNumId"), "val"), {})
+            for ilvl, fmt in levels.items():
+                formats[(_attr(num, "numId"), ilvl)] = fmt
+        return formats
+
+    # --- 正文 ---
+    def blocks(self) -> Iterator[Tuple[str, str]]:
+        """单遍遍历正文，按文档顺序产出 ("text", markdown) 和 ("image", 图片路径)"""
+        depth = 0
+        body = None
+        with self._zip.open(DOCUMENT_PART) as f:
+            for event, elem in iterparse(f, events=("start", "end")):
+                if event == "start":
+                    depth += 1
+                    if depth == 2 and elem.tag == W + "body":
+                        body = elem
+                    continue
+                depth -= 1
+                # depth == 2 说明刚结束的是 body 的直接子元素（段落、表格等）
+                if depth == 2 and body is not None:
+                    yield from self._block(elem)
+                    body.clear()
+
+    def _block(self, elem) -> Iterator[Tuple[str, str]]:
+        if elem.tag == W + "p":
+            yield from self._paragraph(elem)
+        elif elem.tag == W + "tbl":
+            yield from self._table(elem)
+        elif elem.tag in (W + "sdt", W + "customXml"):
+            # 内容控件等容器，展开其中的段落和表格
+            content = elem.find(W + "sdtContent") if elem.tag == W + "sdt" else elem
+            for child in (content if content is not None else ()):
+                yield from self._block(child)
+
+    def _paragraph_text(self, p) -> str:
+        parts = []
+        for node in p.iter():
+            if node.tag == W + "t":
+                parts.append(node.text or "")
+            elif node.tag == W + "tab":
+                parts.append("\t")
+            elif node.tag in (W + "br", W + "cr"):
+                parts.append("\n")
+        return "".join(parts).strip()
+
+    def _paragraph_images(self, elem) -> List[str]:
+        """段落（或表格）中引用的图片路径，同一图片只返回一次"""
+        images = []
+        for node in elem.iter():
+            if node.tag == A + "blip":
+                rel_id = node.get(R + "embed")
+            elif node.tag == V + "imagedata":
+                rel_id = node.get(R + "id")
+            else:
+                continue
+            path = self._rels.get(rel_id)
+            if path and path not in self._seen_images:
+                self._seen_images.add(path)
+                images.append(path)
+        return images
+
+    def _paragraph(self, p) -> Iterator[Tuple[str, str]]:
+        text = self._paragraph_text(p)
+        if text:
+            yield "text", self._format_paragraph(p, text)
+        for path in self._paragraph_images(p):
+            yield "image", path
+
+    def _format_paragraph(self, p, text: str) -> str:
+        """根据样式和编号映射为 markdown 语法"""
+        ppr = p.find(W + "pPr")
+        style_id = _attr(ppr.find(W + "pStyle"), "val") if ppr is not None else None
+        # 缺少 styles.xml 时退回样式 ID，如 Heading1
+        style = self._styles.get(style_id, style_id.lower()) if style_id else ""
+        heading = _HEADING_RE.match(style)
+        if heading:
+            level = min(max(int(heading.group(1)), 1), 6)
+            return f"{'#' * level} {text}"
+
+        num_pr = ppr.find(W + "numPr") if ppr is not None else None
+        num_id = _attr(num_pr.find(W + "numId"), "val") if num_pr is not None else None
+        if num_id not in (None, "0"):
+            ilvl = _attr(num_pr.find(W + "ilvl"), "val") or "0"
+            marker = "-" if self._numbering.get((num_id, ilvl), "bullet") in ("bullet", "none") else "1."
+            return f"{'  ' * int(ilvl)}{marker} {text}"
+        if "list" in style:
+            return f"- {text}"
+        return text
+
+    def _cell_text(self, tc) -> str:
+        """单元格内的所有段落（含嵌套表格）拼成一行，避免破坏 markdown 表格"""
+        texts = [self._paragraph_text(p) for p in tc.iter(W + "p")]
+        text = " ".join(t.replace("\n", " ") for t in texts if t)
+        return text.replace("|", "\\|")
+
+    def _table(self, tbl) -> Iterator[Tuple[str, str]]:
+        """
+        表格转为 markdown。横向合并（gridSpan）的单元格在每个被合并的列重复内容，
+        纵向合并（vMerge）的后续行沿用合并起始单元格的内容
+        """
+        rows = []
+        above: List[str] = []
+        for tr in tbl.findall(W + "tr"):
+            row: List[str] = []
+            trpr = tr.find(W + "trPr")
+            before = int(_attr(trpr.find(W + "gridBefore"), "val") or 0) if trpr is not None else 0
+            row.extend([""] * before)
+            for tc in tr.findall(W + "tc"):
+                tcpr = tc.find(W + "tcPr")
+                span = 1
+                merge = None
+                if tcpr is not None:
+                    span = int(_attr(tcpr.find(W + "gridSpan"), "val") or 1)
+                    v_merge = tcpr.find(W + "vMerge")
+                    if v_merge is not None:
+                        merge = _attr(v_merge, "val") or "continue"
+                col = len(row)
+                if merge == "continue":
+                    text = above[col] if col < len(above) else ""
+                else:
+                    text = self._cell_text(tc)
+                row.extend([text] * span)
+            rows.append(row)
+            above = row
+
+        if rows:
+            width = max(len(row) for row in rows)
+            for i, row in enumerate(rows):
+                cells = row + [""] * (width - len(row))
+                yield "text", "| " + " | ".join(cells) + " |"
+                if i == 0:
+                    yield "text", "|" + " --- |" * width
+        # 表格中的图片放在表格之后
+        for path in self._paragraph_images(tbl):
+            yield "image", path
+
+    # --- 图片 ---
+    def image_data_url(self, path: str) -> Optional[str]:
+        """读取图片并转为 data URL；与之前的图片内容相同或无法识别的格式返回 None"""
+        data = self._zip.read(path)
+        digest = hashlib.sha1(data).hexdigest()
+        if digest in self._seen_images:
+            return None
+        self._seen_images.add(digest)
+        mime = _IMAGE_MIME.get(posixpath.splitext(path)[1].lstrip(".").lower())
+        if mime is None:
+            # tiff 等格式用 PIL 转成 png，无法解码的（如 emf/wmf）跳过
+            try:
+                from PIL import Image
+                buffer = BytesIO()
+                Image.open(BytesIO(data)).save(buffer, format="PNG")
+            except Exception as e:
+                print(f"无法识别的图片 {path}，跳过: {e}")
+                return None
+            data, mime = buffer.getvalue(), "png"
+        return f"data:image/{mime};base64,{base64.b64encode(data).decode('ascii')}"
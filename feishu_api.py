@@ -1,8 +1,11 @@
 import httpx
+from metrics import traced
+from transport import request_json
 
 FEISHU_API_BASE = "https://open.feishu.cn/open-apis"
 
 
+@traced("http", "feishu.docx_blocks")
 async def fetch_all_blocks(document_id: str, user_access_token: str):
     headers = {"Authorization": f"Bearer {user_access_token}"}
     url = f"{FEISHU_API_BASE}/docx/v1/documents/{document_id}/blocks"
@@ -15,9 +18,7 @@ async def fetch_all_blocks(document_id: str, user_access_token: str):
             params = {"limit": limit}
             if cursor:
                 params["cursor"] = cursor
-            resp = await client.get(url, headers=headers, params=params)
-            resp.raise_for_status()
-            data = resp.json()
+            data = await request_json("feishu", "GET", url, client=client, headers=headers, params=params)
 
             items = data.get("data", {}).get("items", [])
             all_blocks.extend(items)
@@ -29,20 +30,43 @@ async def fetch_all_blocks(document_id: str, user_access_token: str):
     return all_blocks
 
 
+@traced("http", "feishu.media_tmp_url")
 async def get_single_image_url(file_token: str, user_access_token: str) -> str:
     headers = {"Authorization": f"Bearer {user_access_token}"}
     url = f"{FEISHU_API_BASE}/drive/v1/medias/batch_get_tmp_download_url"
     params = {"file_tokens": file_token}
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(url, headers=headers, params=params)
-        resp.raise_for_status()
-        data = resp.json()
+    data = await request_json("feishu", "GET", url, headers=headers, params=params, timeout=30)
     for item in data.get("data", {}).get("tmp_download_urls", []):
         if item.get("file_token") == file_token:
             return item.get("tmp_download_url", "")
     return ""
 
 
+@traced("http", "feishu.user_info")
+async def get_user_info(user_access_token: str) -> dict:
+    """获取 user_access_token 对应的用户信息（含 open_id、name），token 无效时抛出异常"""
+    headers = {"Authorization": f"Bearer {user_access_token}"}
+    data = await request_json("feishu", "GET", f"{FEISHU_API_BASE}/authen/v1/user_info",
+                              headers=headers, timeout=10)
+    if data.get("code", 0) != 0 or not data.get("data"):
+        raise ValueError(f"获取用户信息失败: {data.get('msg')}")
+    return data["data"]
+
+
+async def request_user_token(payload: dict) -> dict:
+    """
+    调用 OAuth v2 token 接口（授权码换取 / 刷新 user_access_token）。授权码只能使用一次，refresh_token
+    使用后即轮换，请求超时时飞书可能已经处理，重发只会得到 invalid_grant，因此不重试
+
+    :return: 包含 access_token、expires_in，以及申请了 offline_access 时的 refresh_token、refresh_token_expires_in
+    """
+    data = await request_json("feishu", "POST", f"{FEISHU_API_BASE}/authen/v2/oauth/token",
+                              json=payload, timeout=10, max_attempts=1)
+    if data.get("code", 0) != 0 or not data.get("access_token"):
+        raise ValueError(data.get("error_description") or data.get("msg") or "token 获取失败")
+    return data
+
+
 def extract_text(elements):
     texts = []
     for elem in elements:
@@ -122,6 +146,7 @@ def parse_block(block, blocks_map, image_url_map):
     return md
 
 
+@traced("parser", "feishu_blocks")
 def blocks_to_markdown(blocks, image_url_map):
     blocks_map = {b["block_id"]: b for b in blocks}
     roots = [b for b in blocks if not b.get("parent_id")]
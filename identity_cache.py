@@ -0,0 +1,129 @@
+import os
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from metrics import REGISTRY
+from singleflight import SingleFlight
+from feishu_api import get_user_info, request_user_token
+
+logger = logging.getLogger(__name__)
+
+# 用户信息缓存时长（秒）；缓存条目不会超过 access_token 本身的有效期
+IDENTITY_TTL = float(os.environ.get("FEISHU_IDENTITY_TTL", "300"))
+IDENTITY_MAX_ENTRIES = int(os.environ.get("FEISHU_IDENTITY_MAX_ENTRIES", "1024"))
+# access_token 到期前多久（秒）视为需要刷新
+REFRESH_MARGIN = float(os.environ.get("FEISHU_REFRESH_MARGIN", "300"))
+# refresh_token 用后即失效，刷新结果短暂保留，供同一浏览器紧接着的其他请求复用
+REFRESH_REUSE_WINDOW = 60.0
+
+IDENTITY_LOOKUPS = REGISTRY.counter(
+    "lark_identity_cache_total", "飞书用户信息缓存查询次数", ["result"])
+TOKEN_REFRESHES = REGISTRY.counter(
+    "lark_token_refresh_total", "飞书 user_access_token 刷新次数", ["result"])
+
+
+def token_digest(token: str) -> str:
+    """缓存只保存 token 的摘要，不保存 token 本身"""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class IdentityCache:
+    """按 access_token 摘要缓存飞书用户信息，带 TTL 和条目上限（LRU）"""
+
+    def __init__(self, ttl: float = IDENTITY_TTL, max_entries: int = IDENTITY_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[dict, float]]" = OrderedDict()
+        self._flight = SingleFlight("feishu_identity")
+
+    def _lookup(self, digest: str) -> Optional[dict]:
+        entry = self._entries.get(digest)
+        if entry is None:
+            return None
+        info, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[digest]
+            return None
+        self._entries.move_to_end(digest)
+        return info
+
+    def put(self, access_token: str, info: dict, token_expires_in: Optional[float] = None):
+        ttl = self.ttl if token_expires_in is None else min(self.ttl, token_expires_in)
+        digest = token_digest(access_token)
+        self._entries[digest] = (info, time.monotonic() + ttl)
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, access_token: str):
+        self._entries.pop(token_digest(access_token), None)
+
+    async def get(self, access_token: str) -> dict:
+        """返回用户信息，缓存未命中时请求飞书；并发的相同查询只请求一次。token 无效时抛出异常"""
+        digest = token_digest(access_token)
+        info = self._lookup(digest)
+        if info is not None:
+            IDENTITY_LOOKUPS.inc(result="hit")
+            return info
+        IDENTITY_LOOKUPS.inc(result="miss")
+
+        async def fetch():
+            fetched = await get_user_info(access_token)
+            self.put(access_token, fetched)
+            return fetched
+
+        return await self._flight.do(digest, fetch)
+
+
+class TokenRefresher:
+    """用 refresh_token 换取新的 user_access_token；同一 refresh_token 的并发或紧接着的刷新只请求一次"""
+
+    def __init__(self, app_id: str, app_secret: str):
+        self.app_id = app_id
+        self.app_secret = app_secret
+        self._flight = SingleFlight("feishu_refresh")
+        self._recent: "OrderedDict[str, Tuple[dict, float]]" = OrderedDict()
+
+    async def refresh(self, refresh_token: str) -> dict:
+        """
+        刷新 user_access_token。请求不重试（refresh_token 用过即轮换，重发只会得到 invalid_grant）；
+        只有成功的结果进入复用窗口，失败只由正在等待的并发调用方共享，之后的刷新重新请求
+        """
+        digest = token_digest(refresh_token)
+        recent = self._recent.get(digest)
+        if recent is not None and recent[1] > time.monotonic():
+            return recent[0]
+
+        async def do_refresh():
+            try:
+                tokens = await request_user_token({
+                    "grant_type": "refresh_token",
+                    "client_id": self.app_id,
+                    "client_secret": self.app_secret,
+                    "refresh_token": refresh_token
+                })
+            except Exception:
+                TOKEN_REFRESHES.inc(result="error")
+                self._recent.pop(digest, None)
+                raise
+            TOKEN_REFRESHES.inc(result="ok")
+            self._recent[digest] = (tokens, time.monotonic() + REFRESH_REUSE_WINDOW)
+            while len(self._recent) > IDENTITY_MAX_ENTRIES:
+                self._recent.popitem(last=False)
+            return tokens
+
+        return await self._flight.do(digest, do_refresh)
+
+
+IDENTITY_CACHE = IdentityCache()
+
+
+async def prime_identity(access_token: str, expires_in: Optional[float] = None):
+    """登录或刷新后预取用户信息，之后的鉴权请求直接命中缓存"""
+    try:
+        IDENTITY_CACHE.put(access_token, await get_user_info(access_token), expires_in)
+    except Exception as e:
+        logger.warning(f"预取飞书用户信息失败: {e}")
@@ -0,0 +1,177 @@
+import os
+import re
+import json
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from metrics import REGISTRY, span
+from singleflight import normalize_text, content_key
+from result_cache import ResultCache, RESULT_CACHE_DIR, result_key
+from testcase_model import TestCase, TestSuite
+from HandleUpload import extract_keypoint_from_prd, generate_cases_from_keypoint
+
+logger = logging.getLogger(__name__)
+
+# 按文档中最高的几级标题切分章节（更深的标题留在所属章节内），切分边界只取决于标题结构，修改正文不会影响其他章节
+SECTION_DEPTH = int(os.environ.get("INCREMENTAL_SECTION_DEPTH", "2"))
+# 同时重新生成的章节数
+SECTION_CONCURRENCY = int(os.environ.get("INCREMENTAL_CONCURRENCY", "4"))
+# 过短的章节（如只有标题）不单独生成用例
+SECTION_MIN_CHARS = int(os.environ.get("INCREMENTAL_SECTION_MIN_CHARS", "20"))
+
+# 章节结果按内容寻址：同一章节内容（含所属标题路径）在任何版本、任何文档中都复用
+SECTION_STORE = ResultCache(os.path.join(RESULT_CACHE_DIR, "sections"))
+
+SECTIONS = REGISTRY.counter(
+    "lark_incremental_sections_total", "增量生成中各章节的处理结果", ["result"])
+
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+
+
+@dataclass
+class Section:
+    title: str
+    path: str  # 标题路径，如 "登录模块 > 验证码"
+    text: str
+
+    @property
+    def fingerprint(self) -> str:
+        return hashlib.sha256(f"{self.path}\n{normalize_text(self.text)}".encode("utf-8")).hexdigest()
+
+    def prompt(self) -> str:
+        """提取测试点时带上标题路径，章节脱离全文后仍知道自己所属的模块"""
+        if not self.path:
+            return self.text
+        return f"（以下内容摘自需求文档的章节：{self.path}）\n\n{self.text}"
+
+
+def split_sections(markdown: str, depth: int = SECTION_DEPTH) -> List[Section]:
+    """按 markdown 标题切分章节，代码块中的 # 不视为标题；第一个标题之前的内容作为单独的章节"""
+    lines = markdown.splitlines()
+    headings = []  # (行号, 级别, 标题)
+    in_fence = False
+    for i, line in enumerate(lines):
+        if _FENCE_RE.match(line):
+            in_fence = not in_fence
+            continue
+        match = None if in_fence else _HEADING_RE.match(line)
+        if match:
+            headings.append((i, len(match.group(1)), match.group(2).strip()))
+
+    split_levels = set(sorted({level for _, level, _ in headings})[:depth])
+    sections: List[Section] = []
+    trail: Dict[int, str] = {}
+    start, title, path = 0, "", ""
+    for i, level, text in headings:
+        if level not in split_levels:
+            continue
+        sections.append(Section(title, path, "\n".join(lines[start:i]).strip()))
+        trail = {lvl: t for lvl, t in trail.items() if lvl < level}
+        trail[level] = text
+        start, title, path = i, text, " > ".join(trail[lvl] for lvl in sorted(trail))
+    sections.append(Section(title, path, "\n".join(lines[start:]).strip()))
+    return [section for section in sections if len(section.text) >= SECTION_MIN_CHARS]
+
+
+def _cases_by_type(result_json: str) -> Dict[str, list]:
+    """把单个章节的用例 JSON 规整为 {测试类型: [用例]}，字段名和步骤形式在此统一"""
+    value = json.loads(result_json)
+    if not isinstance(value, (dict, list)):
+        raise ValueError("用例 JSON 不是对象或数组")
+    # 形如 {"cases": {...}} 的外层包装
+    if isinstance(value, dict) and len(value) == 1 and isinstance(next(iter(value.values())), dict):
+        value = next(iter(value.values()))
+    return TestSuite.from_obj(value).to_obj(grouped=True)["test_cases"]
+
+
+def merge_section_cases(section_results: List[Dict[str, list]]) -> Dict[str, list]:
+    """按测试类型合并各章节的用例，去掉标题、步骤和预期结果都相同的重复用例，并统一重新编号"""
+    suite = TestSuite(cases=[TestCase.from_dict(case, i, group)
+                             for groups in section_results
+                             for group, cases in groups.items()
+                             for i, case in enumerate(cases) if isinstance(case, dict)])
+    suite.dedupe()
+    # 同一类型的用例编号连续
+    suite.cases = [case for group in suite.by_category().values() for case in group]
+    suite.renumber()
+    return suite.to_obj(grouped=True)["test_cases"]
+
+
+async def _generate_section(section: Section, key: str, semaphore: asyncio.Semaphore) -> Dict[str, list]:
+    async with semaphore:
+        with span("incremental", "section"):
+            keypoint = await extract_keypoint_from_prd(section.prompt())
+            result = await generate_cases_from_keypoint(keypoint)
+    groups = _cases_by_type(result["json"])
+    await SECTION_STORE.put(key, {"title": section.path, "keypoint": keypoint, "cases": groups}, "section")
+    return groups
+
+
+async def regenerate(markdown: str, profile: Optional[str] = None, doc_id: Optional[str] = None) -> dict:
+    """
+    增量生成：未变化的章节直接复用上次的测试点和用例，只有新增或修改的章节重新提取测试点、生成用例
+
+    :param markdown: 文档 markdown
+    :param profile: 模型配置名称（需已在调用方的 use_profile 中生效），用于区分缓存
+    :param doc_id: 文档标识，传入时与该文档上一版本比较，返回删除的章节
+    :return: {"json": 合并后的用例 JSON, "sections": 统计, "regenerated": [...], "failed": [...], "removed": [...]}
+    """
+    sections = split_sections(markdown)
+    if not sections:
+        raise ValueError("文档内容为空")
+    keys = [result_key("section", section.prompt(), profile) for section in sections]
+
+    stored = await asyncio.gather(*(SECTION_STORE.get(key, "section") for key in keys))
+    semaphore = asyncio.Semaphore(SECTION_CONCURRENCY)
+    pending = {i: asyncio.ensure_future(_generate_section(section, key, semaphore))
+               for i, (section, key, record) in enumerate(zip(sections, keys, stored)) if record is None}
+    logger.info(f"增量生成：共 {len(sections)} 个章节，复用 {len(sections) - len(pending)} 个，"
+                f"重新生成 {len(pending)} 个")
+    outcomes = dict(zip(pending, await asyncio.gather(*pending.values(), return_exceptions=True)))
+
+    section_results, failed = [], []
+    for i, (section, record) in enumerate(zip(sections, stored)):
+        if record is not None:
+            SECTIONS.inc(result="reused")
+            section_results.append(record["cases"])
+            continue
+        outcome = outcomes[i]
+        if isinstance(outcome, BaseException):
+            SECTIONS.inc(result="failed")
+            logger.warning(f"章节「{section.path or '开头'}」生成失败: {outcome}")
+            failed.append({"section": section.path, "error": str(outcome)})
+            continue
+        SECTIONS.inc(result="regenerated")
+        section_results.append(outcome)
+
+    if failed and len(failed) == len(sections):
+        first_error = next(outcome for outcome in outcomes.values() if isinstance(outcome, BaseException))
+        raise first_error
+
+    removed = []
+    if doc_id:
+        # 记录本版本的章节列表，与上一版本比较得出被删除的章节
+        manifest_key = content_key("manifest", doc_id, profile=profile)
+        previous = await SECTION_STORE.get(manifest_key, "manifest") or {}
+        current = {section.fingerprint: section.path for section in sections}
+        current_paths = set(current.values())
+        removed = [path for path in previous.get("sections", {}).values() if path not in current_paths]
+        await SECTION_STORE.put(manifest_key, {"sections": current}, "manifest")
+
+    return {
+        "json": json.dumps(merge_section_cases(section_results), ensure_ascii=False),
+        "sections": {
+            "total": len(sections),
+            "reused": len(sections) - len(pending),
+            "regenerated": len(pending) - len(failed),
+            "failed": len(failed),
+            "removed": len(removed),
+        },
+        "regenerated": [sections[i].path for i in pending if not isinstance(outcomes[i], BaseException)],
+        "failed": failed,
+        "removed": removed,
+    }
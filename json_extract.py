@@ -0,0 +1,261 @@
+import json
+from typing import Any, Iterator, List, Tuple
+
+_CLOSERS = {"{": "}", "[": "]"}
+_DECODER = json.JSONDecoder()
+
+
+class JSONExtractError(ValueError):
+    pass
+
+
+def _scan_value(text: str, start: int) -> Tuple[str, int, bool]:
+    """
+    从 start（必须是 { 或 [）开始扫描一个 JSON 值，顺带去掉 } ] 前多余的逗号
+
+    :return: (扫描到的片段, 结束位置, 是否被截断)
+    """
+    out = []
+    stack = []
+    in_string = False
+    escaped = False
+    i = start
+    n = len(text)
+    while i < n:
+        ch = text[i]
+        i += 1
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+            out.append(ch)
+        elif ch in _CLOSERS:
+            stack.append(_CLOSERS[ch])
+            out.append(ch)
+        elif ch in "}]":
+            # 去掉尾随逗号：{"a": 1,} / [1, 2,]
+            while out and out[-1] in " \t\r\n":
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            if not stack or stack[-1] != ch:
+                # 括号不匹配，视为该值到此结束
+                return "".join(out), i - 1, True
+            stack.pop()
+            out.append(ch)
+            if not stack:
+                return "".join(out), i, False
+        else:
+            out.append(ch)
+    return "".join(out), n, True
+
+
+def _close_truncated(fragment: str) -> List[str]:
+    """为被截断的片段生成若干补全候选，优先保留尽可能多的完整内容"""
+    stack = []
+    in_string = False
+    escaped = False
+    # 记录每个逗号位置及当时的括号栈，用于回退到最后一个完整元素
+    safe_points = []
+    for i, ch in enumerate(fragment):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in _CLOSERS:
+            stack.append(_CLOSERS[ch])
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+        elif ch == ",":
+            safe_points.append((i, list(stack)))
+
+    candidates = []
+    head = fragment
+    if in_string:
+        head = head[:-1] if escaped else head
+        head += '"'
+    head = head.rstrip().rstrip(",").rstrip()
+    if head.endswith(":"):
+        head += " null"
+    candidates.append(head + "".join(reversed(stack)))
+    for pos, point_stack in reversed(safe_points[-20:]):
+        candidates.append(fragment[:pos].rstrip() + "".join(reversed(point_stack)))
+    return candidates
+
+
+def repair_json(fragment: str) -> Any:
+    """解析可能带尾随逗号或被截断的 JSON 片段，无法修复时抛出 JSONExtractError"""
+    start = next((i for i, ch in enumerate(fragment) if ch in _CLOSERS), None)
+    if start is None:
+        raise JSONExtractError("未找到 JSON 对象或数组")
+    scanned, _, truncated = _scan_value(fragment, start)
+    candidates = _close_truncated(scanned) if truncated else [scanned]
+    for candidate in candidates:
+        try:
+            return json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+    raise JSONExtractError("JSON 无法修复")
+
+
+def iter_json_values(text: str) -> Iterator[Tuple[Any, int, int]]:
+    """
+    依次找出文本中的 JSON 对象/数组（可位于代码块中，或前后夹杂说明文字）
+
+    :return: 迭代 (值, 起始位置, 结束位置)
+    """
+    pos = 0
+    n = len(text)
+    while pos < n:
+        brace = text.find("{", pos)
+        bracket = text.find("[", pos)
+        candidates = [p for p in (brace, bracket) if p != -1]
+        if not candidates:
+            return
+        start = min(candidates)
+        try:
+            value, end = _DECODER.raw_decode(text, start)
+            yield value, start, end
+            pos = end
+            continue
+        except json.JSONDecodeError:
+            pass
+        scanned, end, truncated = _scan_value(text, start)
+        for candidate in (_close_truncated(scanned) if truncated else [scanned]):
+            try:
+                value = json.loads(candidate)
+            except json.JSONDecodeError:
+                continue
+            yield value, start, end
+            pos = end
+            break
+        else:
+            pos = start + 1
+
+
+def find_json(text: str, expect=(dict, list)) -> Tuple[Any, int, int]:
+    """返回文本中跨度最大的、类型符合 expect 的 JSON 值及其位置"""
+    best = None
+    for value, start, end in iter_json_values(text):
+        if not isinstance(value, expect):
+            continue
+        if best is None or end - start > best[2] - best[1]:
+            best = (value, start, end)
+    if best is None:
+        raise JSONExtractError("模型输出中未找到有效的 JSON")
+    return best
+
+
+def extract_json(text: str, expect=(dict, list)) -> Any:
+    """从模型输出中提取 JSON，兼容 ```json 代码块、前后说明文字、尾随逗号和截断"""
+    return find_json(text, expect)[0]
+
+
+class IncrementalJSONParser:
+    """
+    增量解析流式输出：顶层为数组时，每个元素一闭合就产出；顶层为对象时，对象闭合后整体产出。
+    JSON 之前的说明文字、代码块标记会被跳过
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._top = None          # 顶层括号类型："[" 或 "{"
+        self._element_start = None
+        self.finished = False
+
+    def feed(self, chunk: str) -> List[Any]:
+        self._buffer += chunk
+        values = []
+        buffer = self._buffer
+        i = self._pos
+        while i < len(buffer):
+            ch = buffer[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                i += 1
+                continue
+
+            if self._top is None:
+                if ch in _CLOSERS:
+                    self._top = ch
+                    self._depth = 1
+                    self._element_start = i if ch == "{" else None
+                i += 1
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in _CLOSERS:
+                if self._depth == 1 and self._top == "[":
+                    self._element_start = i
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 1 and self._top == "[" and self._element_start is not None:
+                    values.extend(self._emit(buffer[self._element_start:i + 1]))
+                    self._element_start = None
+                elif self._depth == 0:
+                    if self._top == "{":
+                        values.extend(self._emit(buffer[self._element_start:i + 1]))
+                    self._reset_top()
+            i += 1
+
+        # 丢弃已处理且不再需要的内容，控制缓冲区大小
+        keep_from = self._element_start if self._element_start is not None else i
+        self._buffer = buffer[keep_from:]
+        if self._element_start is not None:
+            self._element_start = 0
+        self._pos = i - keep_from
+        return values
+
+    def close(self) -> List[Any]:
+        """流结束时尝试修复最后一个未闭合的元素"""
+        values = []
+        if self._element_start is not None:
+            try:
+                values.append(repair_json(self._buffer[self._element_start:]))
+            except JSONExtractError:
+                pass
+        self._buffer = ""
+        self._pos = 0
+        self._element_start = None
+        return values
+
+    def _reset_top(self):
+        self._top = None
+        self._depth = 0
+        self._element_start = None
+        self.finished = True
+
+    @staticmethod
+    def _emit(fragment: str) -> List[Any]:
+        try:
+            return [json.loads(fragment)]
+        except json.JSONDecodeError:
+            try:
+                return [repair_json(fragment)]
+            except JSONExtractError:
+                return []
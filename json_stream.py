@@ -0,0 +1,199 @@
+import io
+import os
+import re
+import json
+from typing import Iterator, Optional, Tuple
+
+from testcase_model import TestCaseFormatError
+
+# 增量读取用例 JSON：按块读入文件，逐条解码用例，内存占用只与单条用例的大小有关，与文件大小无关。
+# 支持的结构与 testcase_model.iter_raw_cases 一致
+
+# 每次从文件读取的字符数
+CHUNK_SIZE = int(os.environ.get("JSON_STREAM_CHUNK_SIZE", str(64 * 1024)))
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_DECODER = json.JSONDecoder()
+_NUMBER_CHARS = frozenset("0123456789.eE+-")
+
+
+class _Reader:
+    """在按块读入的缓冲区上解析 JSON，已处理的内容随时丢弃"""
+
+    def __init__(self, fp, chunk_size: int):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _more(self, min_size: int = 0) -> bool:
+        if self.eof:
+            return False
+        data = self.fp.read(max(self.chunk_size, min_size))
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def error(self, message: str):
+        raise json.JSONDecodeError(message, self.buf, self.pos)
+
+    def peek(self) -> str:
+        """跳过空白，返回下一个字符，读完时返回空字符串"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._more():
+                return ""
+
+    def take(self, char: str):
+        if self.peek() != char:
+            self.error(f"应为 {char!r}")
+        self.pos += 1
+
+    def value(self):
+        """解码一个完整的 JSON 值"""
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buf, self.pos)
+                # 数字可能在缓冲区末尾被截断（如 "12" 实为 "12.5"），后面紧跟数字字符时再读一些确认
+                if self.eof or (end < len(self.buf) and self.buf[end] not in _NUMBER_CHARS):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # 按未解码部分的长度成倍读取，单个很大的值也不会被反复重新解析太多次
+            self._more(len(self.buf) - self.pos)
+
+    def array(self) -> Iterator:
+        self.take("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            char = self.peek()
+            self.pos += 1
+            if char == "]":
+                return
+            if char != ",":
+                self.pos -= 1
+                self.error("数组元素之间应为 ','")
+
+    def keys(self) -> Iterator[str]:
+        """依次产出对象的键，调用方须在取下一个键之前读取（或跳过）对应的值"""
+        self.take("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                self.error("对象的键应为字符串")
+            self.take(":")
+            yield key
+            char = self.peek()
+            self.pos += 1
+            if char == "}":
+                return
+            if char != ",":
+                self.pos -= 1
+                self.error("对象成员之间应为 ','")
+
+
+class CaseStream:
+    """
+    逐条读取用例 JSON 中的 (用例, 分类)，支持：
+    - [用例, ...]
+    - {"testcases": {"test_suite": ..., "test_cases": [...] 或 {分类: [...]}}} / {"testcases": [...]}
+    - {"test_suite": ..., "test_cases": [...] 或 {分类: [...]}}
+    - {分类: [用例, ...], ...}（按测试类型分组；出现在 test_cases 之后的其他数组会被忽略）
+
+    :param source: 文件路径（os.PathLike）、JSON 字符串、bytes 或已打开的文本文件对象
+    """
+
+    def __init__(self, source, chunk_size: int = CHUNK_SIZE):
+        self.source = source
+        self.chunk_size = chunk_size
+        # 读到 test_suite 字段后才有值
+        self.suite_name = ""
+        self.count = 0
+
+    def _open(self):
+        if isinstance(self.source, os.PathLike):
+            return open(self.source, "r", encoding="utf-8-sig"), True
+        if isinstance(self.source, str):
+            return io.StringIO(self.source), True
+        if isinstance(self.source, (bytes, bytearray)):
+            return io.TextIOWrapper(io.BytesIO(self.source), encoding="utf-8-sig"), True
+        if hasattr(self.source, "read"):
+            return self.source, False
+        raise TypeError(f"不支持的用例来源类型: {type(self.source).__name__}")
+
+    def __iter__(self) -> Iterator[Tuple[object, str]]:
+        fp, owned = self._open()
+        try:
+            reader = _Reader(fp, self.chunk_size)
+            char = reader.peek()
+            if char == "[":
+                cases = ((case, "") for case in reader.array())
+            elif char == "{":
+                cases = self._object(reader)
+            else:
+                raise TestCaseFormatError("无法识别的用例结构：顶层应为对象或数组")
+            for item in cases:
+                self.count += 1
+                yield item
+            if reader.peek():
+                reader.error("JSON 结束后存在多余内容")
+        finally:
+            if owned:
+                fp.close()
+
+    def _object(self, reader: _Reader) -> Iterator[Tuple[object, str]]:
+        found = False
+        for key in reader.keys():
+            char = reader.peek()
+            if key == "testcases" and char == "{":
+                found = True
+                yield from self._object(reader)
+            elif key in ("testcases", "test_cases") and char == "[":
+                found = True
+                for case in reader.array():
+                    yield case, ""
+            elif key == "test_cases" and char == "{":
+                found = True
+                for category in reader.keys():
+                    if reader.peek() == "[":
+                        for case in reader.array():
+                            yield case, category
+                    else:
+                        reader.value()
+            elif key == "test_suite":
+                name = reader.value()
+                if name:
+                    self.suite_name = str(name)
+            elif char == "[" and not found:
+                for case in reader.array():
+                    yield case, key
+            else:
+                reader.value()
+
+
+def iter_cases(source, chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[object, str]]:
+    return iter(CaseStream(source, chunk_size))
+
+
+def source_size(source) -> Optional[int]:
+    """用例来源的大小（文件为字节数，字符串为字符数），无法得知时返回 None"""
+    if isinstance(source, os.PathLike):
+        return os.path.getsize(source)
+    if isinstance(source, (str, bytes, bytearray)):
+        return len(source)
+    return None
@@ -1,16 +1,31 @@
-import json
+import os
 import re
+import uuid
 import logging
 import asyncio
 import time
-from typing import TypedDict
-from langgraph.graph import StateGraph
-from model_api import call_model
+import weakref
+from typing import Dict, List, Optional, Tuple, TypedDict
+from model_api import call_model, stream_model
+from metrics import traced, record_retry
+from json_extract import IncrementalJSONParser
+from model_routing import resolve_profile, use_profile, with_state_profile
+from singleflight import SingleFlight, content_key
+from transport import RETRY_BUDGET, CircuitOpenError, TransportError, backoff_delay
+from run_events import emit, track, open_channel
+from result_cache import RESULT_CACHE, result_key
+from testcase_model import TestCase, TestSuite
 from typing import Union
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
+MAX_CONCURRENT = 10
+MAX_RETRIES = 2
+# 每批测试点的 token 预算和最大测试点数
+BATCH_TOKEN_BUDGET = int(os.environ.get("CASE_BATCH_TOKEN_BUDGET", "1200"))
+MAX_POINTS_PER_BATCH = int(os.environ.get("CASE_BATCH_MAX_POINTS", "15"))
+
 
 class GraphState(TypedDict):
     prd_text: str
@@ -18,8 +33,13 @@ class GraphState(TypedDict):
     requirements: str
     testcases: dict
     validated: str
+    raw_points: list
+    case_results: list
+    profile: str
 
 
+@traced("node", "step1_extract_title")
+@with_state_profile
 async def extract_prd_title(state: GraphState) -> GraphState:
     logger.info("[Step 1] 尝试直接从 PRD 文本提取标题")
     lines = state['prd_text'].splitlines()
@@ -30,21 +50,23 @@ async def extract_prd_title(state: GraphState) -> GraphState:
             if len(line) < 50:
                 title = line.strip()
                 logger.info(f"[Step 1] 提取标题成功: {title}")
-                return {**state, "prd_title": title}
+                return {"prd_title": title}
     logger.info("[Step 1] 未提取成功，调用模型")
     prompt = f"""请从以下产品需求文档中提取模块或系统名称作为文档标题，文中包含顺序图文，图片以 Markdown 格式插入，请结合文本和图片内容理解：
 {state['prd_text'][:1500]}
 （只返回标题，不要解释）"""
     try:
-        res = await call_model(prompt)
+        res = await call_model(prompt, hedge=True, stage="title")
         title = res.strip().splitlines()[0]
         title = re.sub(r"^#+\s*", "", title).strip()
     except Exception as e:
         logger.warning(f"标题提取失败，使用默认标题: {e}")
         title = "自动生成测试用例"
-    return {**state, "prd_title": title}
+    return {"prd_title": title}
 
 
+@traced("node", "step2_extract_requirements")
+@with_state_profile
 async def extract_requirements(state: GraphState) -> GraphState:
     logger.info("[Step 2] 提取测试点")
     prompt = f"""你是一位资深测试工程师，根据以下产品需求文档，文中包含顺序图文，图片通过 Markdown 格式插入。请综合文本和图片内容，提取详细测试点（功能、易用、异常等维度），并按模块分类输出：
@@ -56,14 +78,115 @@ async def extract_requirements(state: GraphState) -> GraphState:
   - 测试点2：
 """
     try:
-        requirements = await call_model(prompt)
-        return {**state, "requirements": requirements.strip()}
+        requirements = await call_model(prompt, hedge=True, stage="requirements")
+        return {"requirements": requirements.strip()}
     except Exception as e:
         logger.error(f"[Step 2] 测试点提取失败: {e}")
         raise
 
 
+def is_module_header(line: str) -> bool:
+    """顶格且以标题符号开头或以冒号结尾的行视为模块标题，例如 "- 登录模块：" 或 "### 登录模块" """
+    if not line.strip() or line[0].isspace():
+        return False
+    stripped = line.strip().strip("*").strip()
+    return stripped.startswith("#") or stripped.endswith(("：", ":"))
+
+
+def points_from_lines(lines: List[str]) -> List[str]:
+    return [
+        line.strip("-• 0123456789.").strip()
+        for line in lines
+        if line.strip() and len(line.strip()) > 4
+    ]
+
+
+def block_points(block: List[str]) -> Tuple[str, List[str]]:
+    """拆出模块名和模块下的测试点，模块标题行本身不作为测试点"""
+    if block and is_module_header(block[0]):
+        module = block[0].strip().lstrip("#-*• ").strip("*：: ")
+        return module, points_from_lines(block[1:])
+    return "", points_from_lines(block)
+
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中文字符按 1 个，其余字符按 4 个 1 个"""
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+class ModuleBlockSplitter:
+    """把流式输出的测试点文本按模块切块，下一个模块标题出现时，上一个模块即视为已定稿"""
+
+    def __init__(self):
+        self._buffer = ""
+        self._current: List[str] = []
+
+    def feed(self, text: str) -> List[List[str]]:
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split("\n")
+        finished = []
+        for line in lines:
+            if is_module_header(line) and self._current:
+                finished.append(self._current)
+                self._current = []
+            self._current.append(line)
+        return finished
+
+    def close(self) -> List[List[str]]:
+        if self._buffer:
+            self._current.append(self._buffer)
+            self._buffer = ""
+        finished = [self._current] if self._current else []
+        self._current = []
+        return finished
+
+
+class BatchPacker:
+    """按模块顺序把测试点打包成批，每批不超过 token 预算和最大测试点数"""
+
+    def __init__(self, token_budget: int = None, max_points: int = None):
+        self.token_budget = token_budget or BATCH_TOKEN_BUDGET
+        self.max_points = max_points or MAX_POINTS_PER_BATCH
+        self._pending: List[dict] = []
+        self._tokens = 0
+
+    def add(self, item: dict) -> List[List[dict]]:
+        cost = estimate_tokens(item["module"]) + estimate_tokens(item["point"])
+        finished = []
+        if self._pending and (self._tokens + cost > self.token_budget or len(self._pending) >= self.max_points):
+            finished.append(self._pending)
+            self._pending, self._tokens = [], 0
+        self._pending.append(item)
+        self._tokens += cost
+        return finished
+
+    def flush(self) -> List[List[dict]]:
+        finished = [self._pending] if self._pending else []
+        self._pending, self._tokens = [], 0
+        return finished
+
+
+def points_from_requirements(requirements: str) -> List[dict]:
+    splitter = ModuleBlockSplitter()
+    points = []
+    for block in splitter.feed(requirements + "\n") + splitter.close():
+        module, texts = block_points(block)
+        for text in texts:
+            points.append({"id": len(points) + 1, "module": module, "point": text})
+    return points
+
+
+@traced("node", "step3_optimize_requirements")
+@with_state_profile
 async def optimize_requirements(state: GraphState) -> GraphState:
+    """
+    流式优化测试点：测试点一旦定稿就按 token 预算打包并派发用例生成，
+    用例生成与优化输出的后半段重叠执行，不必等整段优化结果返回
+    """
     logger.info("[Step 3] 优化测试点")
     prompt = f"""你是一位测试专家，请对以下功能测试点内容进行检查和优化。产品需求文档包含顺序图文，图片以 Markdown 格式插入，请结合文本和图片内容理解：
 目标：
@@ -73,72 +196,220 @@ async def optimize_requirements(state: GraphState) -> GraphState:
 请优化以下测试点内容，补充遗漏，分类清晰，并注明测试维度：
 {state['requirements']}
 """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT)
+    splitter = ModuleBlockSplitter()
+    packer = BatchPacker()
+    raw_points, tasks, chunks = [], [], []
+
+    def dispatch_batches(batches: List[List[dict]]):
+        for batch in batches:
+            tasks.append(asyncio.create_task(generate_case_batch(batch, semaphore)))
+
+    def dispatch(blocks: List[List[str]]):
+        for block in blocks:
+            module, texts = block_points(block)
+            for text in texts:
+                item = {"id": len(raw_points) + 1, "module": module, "point": text}
+                raw_points.append(item)
+                dispatch_batches(packer.add(item))
+
     try:
-        optimized = await call_model(prompt)
-        return {**state, "requirements": optimized.strip()}
+        async for chunk in stream_model(prompt, hedge=True, stage="optimize"):
+            chunks.append(chunk)
+            dispatch(splitter.feed(chunk))
+        dispatch(splitter.close())
+        dispatch_batches(packer.flush())
     except Exception as e:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
         logger.error(f"[Step 3] 优化失败: {e}")
         raise
 
-
-MAX_CONCURRENT = 10
-MAX_RETRIES = 2
+    logger.info(f"[Step 3] 优化完成，{len(raw_points)} 个测试点已打包为 {len(tasks)} 批派发用例生成")
+    emit("points", total=len(raw_points))
+    merged = {}
+    for result in await asyncio.gather(*tasks):
+        merged.update(result)
+    return {
+        "requirements": "".join(chunks).strip(),
+        "raw_points": raw_points,
+        "case_results": [merged.get(item["id"]) for item in raw_points]
+    }
 
 
-async def generate_case(point: str, idx: int, semaphore: asyncio.Semaphore) -> Union[dict, None]:
-    for attempt in range(1, MAX_RETRIES + 1):
-        try:
-            async with semaphore:
-                start = time.time()
-                logger.info(f"生成第 {idx} 个用例，第 {attempt} 次尝试")
-                prompt = f"""你是一个测试用例生成专家。根据以下测试点，结合产品需求文档中的顺序图文（图片通过 Markdown 格式插入），生成格式规范的测试用例，输出 JSON 格式，字段包括：
+def build_batch_prompt(batch: List[dict]) -> str:
+    lines = []
+    current_module = None
+    for item in batch:
+        if item["module"] != current_module:
+            current_module = item["module"]
+            lines.append(f"【模块：{current_module or '未分类'}】")
+        lines.append(f"[{item['id']}] {item['point']}")
+    points_text = "\n".join(lines)
+    return f"""你是一个测试用例生成专家。根据以下测试点，结合产品需求文档中的顺序图文（图片通过 Markdown 格式插入），为每个测试点生成一个格式规范的测试用例，输出 JSON 数组，数组中每个元素的字段包括：
 
 {{
+  "point_id": 测试点编号（即测试点前方括号中的数字）,
   "title": "简洁明确的测试标题",
   "precondition": "按点列出前置条件，例如 1. 系统正常运行；2. 测试账号已登录",
   "steps": ["1. 打开页面", "2. 输入信息", "3. 点击提交"],
   "expected_results": ["1. 页面跳转成功", "2. 显示欢迎信息"]
 }}
 
-请仅返回 JSON，不要附加文字。测试点如下：
-{point}
-你最多根据这些测试点生成5个主要的测试用例。
+请仅返回 JSON 数组，不要附加文字，每个测试点对应数组中的一个元素。测试点如下：
+{points_text}
 """
-                resp = await call_model(prompt)
-                case_json = json.loads(resp)
-                if isinstance(case_json, list):
-                    case_json = case_json[0]
-                duration = time.time() - start
-                logger.info(f" 第 {idx} 个用例生成成功，用时 {duration:.2f}s")
-                return {
-                    "case_id": f"{idx:03d}",
-                    "title": case_json["title"],
-                    "preconditions": case_json["precondition"],
-                    "steps": case_json["steps"],
-                    "expected_results": case_json["expected_results"]
-                }
-        except Exception as e:
-            logger.warning(f" 第 {idx} 个测试点失败（第 {attempt} 次）：{str(e)[:100]}...")
-            await asyncio.sleep(1)
-    logger.error(f" 第 {idx} 个用例多次失败，跳过")
-    return None
 
 
+class BatchCaseCollector:
+    """把模型返回的用例按 point_id 映射回测试点，可逐条接收流式解析出的用例"""
+
+    def __init__(self, batch: List[dict]):
+        self.ids = [item["id"] for item in batch]
+        self.results: Dict[int, dict] = {}
+        self._unnumbered: List[dict] = []
+        self._received = 0
+
+    def add(self, value) -> List[int]:
+        """接收一个解析出的 JSON 值，返回新完成的测试点编号"""
+        if isinstance(value, dict) and "title" not in value:
+            # 形如 {"test_cases": [...]} 的包装
+            lists = [v for v in value.values() if isinstance(v, list)]
+            return [pid for v in (lists[0] if len(lists) == 1 else []) for pid in self.add(v)]
+        if isinstance(value, list):
+            return [pid for v in value for pid in self.add(v)]
+        if not isinstance(value, dict):
+            return []
+        self._received += 1
+        try:
+            point_id = int(value.get("point_id"))
+        except (TypeError, ValueError):
+            self._unnumbered.append(value)
+            return []
+        return [point_id] if self._store(point_id, value) else []
+
+    def finish(self) -> Dict[int, dict]:
+        # 未返回编号且数量一致时按顺序对应
+        if self._unnumbered and self._received == len(self.ids):
+            pending = [pid for pid in self.ids if pid not in self.results]
+            for point_id, value in zip(pending, self._unnumbered):
+                self._store(point_id, value)
+        self._unnumbered = []
+        return self.results
+
+    def _store(self, point_id: int, case_json: dict) -> bool:
+        if point_id not in self.ids or point_id in self.results:
+            return False
+        if not all(key in case_json for key in ("title", "steps", "expected_results")):
+            # 字段不全的用例视为缺失，由调用方拆分重试
+            return False
+        case = TestCase.from_dict(case_json)
+        case.case_id = f"{point_id:03d}"
+        case.extra = None  # point_id 等辅助字段不进入用例
+        self.results[point_id] = case.to_dict()
+        # 复制一份再发送，之后的重新编号不影响已发出的事件
+        emit("case", point_id=point_id, case=dict(self.results[point_id]))
+        return True
+
+
+@traced("case", "generate_case_batch")
+async def generate_case_batch(batch: List[dict], semaphore: asyncio.Semaphore, attempt: int = 1) -> Dict[int, dict]:
+    """
+    为一批测试点生成用例，返回 {测试点编号: 用例}
+
+    以流式方式调用模型，每个用例一闭合就解析入库；中途断流或解析失败时已完成的用例保留，
+    只把缺失的测试点对半拆分后分别重试；拆到单个测试点后最多重试 MAX_RETRIES 次
+    """
+    ids = [item["id"] for item in batch]
+    collector = BatchCaseCollector(batch)
+    parser = IncrementalJSONParser()
+    upstream_failed = False
+    try:
+        async with semaphore:
+            start = time.time()
+            logger.info(f"生成测试点 {ids[0]}~{ids[-1]} 的用例（共 {len(batch)} 个），第 {attempt} 次尝试")
+            async for chunk in stream_model(build_batch_prompt(batch), hedge=True, stage="case"):
+                for value in parser.feed(chunk):
+                    collector.add(value)
+            # 不取 parser.close() 修复出的最后一个元素：输出被截断（如 finish_reason=length）时它只是半条用例，
+            # 对应的测试点应视为缺失，走拆分重试重新生成
+        logger.info(f" 测试点 {ids[0]}~{ids[-1]} 生成 {len(collector.results)}/{len(batch)} 个用例，"
+                    f"用时 {time.time() - start:.2f}s")
+    except CircuitOpenError as e:
+        # 上游熔断中，不再拆分重试，缺失的测试点留待 retry_failed_cases
+        logger.warning(f" 测试点 {ids[0]}~{ids[-1]} 未生成：{e}")
+        results = collector.finish()
+        emit("case_failed", point_ids=[pid for pid in ids if pid not in results], reason="circuit_open")
+        return results
+    except Exception as e:
+        upstream_failed = isinstance(e, TransportError)
+        logger.warning(f" 测试点 {ids[0]}~{ids[-1]} 生成中断（第 {attempt} 次），"
+                       f"已完成 {len(collector.results)} 个：{str(e)[:100]}...")
+    results = collector.finish()
+
+    missing = [item for item in batch if item["id"] not in results]
+    if not missing:
+        return results
+    if upstream_failed and not RETRY_BUDGET.try_acquire():
+        # 上游故障且重试预算耗尽时不再拆分，避免重试风暴
+        logger.error(f" 重试预算耗尽，{len(missing)} 个测试点留待重试")
+        emit("case_failed", point_ids=[item["id"] for item in missing], reason="retry_budget")
+        return results
+
+    if len(missing) > 1:
+        record_retry("generate_case", "batch_split")
+        emit("retry", reason="batch_split", point_ids=[item["id"] for item in missing])
+        mid = len(missing) // 2
+        for part in await asyncio.gather(generate_case_batch(missing[:mid], semaphore),
+                                         generate_case_batch(missing[mid:], semaphore)):
+            results.update(part)
+    elif attempt < MAX_RETRIES and (upstream_failed or RETRY_BUDGET.try_acquire()):
+        record_retry("generate_case", "point_retry")
+        emit("retry", reason="point_retry", point_ids=[missing[0]["id"]], attempt=attempt + 1)
+        await asyncio.sleep(backoff_delay(attempt))
+        results.update(await generate_case_batch(missing, semaphore, attempt + 1))
+    else:
+        logger.error(f" 第 {missing[0]['id']} 个测试点多次失败，跳过")
+        emit("case_failed", point_ids=[missing[0]["id"]], reason="max_retries")
+    return results
+
+
+async def generate_cases_for_points(points: List[dict], semaphore: asyncio.Semaphore) -> List[Optional[dict]]:
+    """按批生成用例，返回与 points 一一对应的结果，失败的为 None"""
+    packer = BatchPacker()
+    batches = []
+    for item in points:
+        batches.extend(packer.add(item))
+    batches.extend(packer.flush())
+    merged = {}
+    for result in await asyncio.gather(*[generate_case_batch(batch, semaphore) for batch in batches]):
+        merged.update(result)
+    return [merged.get(item["id"]) for item in points]
+
+
+async def generate_case(point: str, idx: int, semaphore: asyncio.Semaphore, module: str = "") -> Union[dict, None]:
+    """为单个测试点生成用例"""
+    results = await generate_case_batch([{"id": idx, "module": module, "point": point}], semaphore)
+    return results.get(idx)
+
+
+@traced("node", "step4_generate_testcases")
+@with_state_profile
 async def generate_testcases(state: GraphState) -> GraphState:
+    """汇总第 3 步中已提前派发的用例生成结果；未经过第 3 步时按测试点重新生成"""
     logger.info("[Step 4] 生成测试用例")
-    raw_points = [
-        line.strip("-• 0123456789.").strip()
-        for line in state["requirements"].splitlines()
-        if line.strip() and len(line.strip()) > 4
-    ]
+    start = time.time()
+    raw_points = state.get("raw_points")
+    all_results = state.get("case_results")
+    if raw_points is None or all_results is None:
+        raw_points = points_from_requirements(state["requirements"])
+        if not raw_points:
+            raise ValueError("未能提取有效的测试点")
+        all_results = await generate_cases_for_points(raw_points, asyncio.Semaphore(MAX_CONCURRENT))
     if not raw_points:
         raise ValueError("未能提取有效的测试点")
 
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT)
-    start = time.time()
-    tasks = [generate_case(p, i + 1, semaphore) for i, p in enumerate(raw_points)]
-    all_results = await asyncio.gather(*tasks)
-
     # 成功用例
     test_cases = [c for c in all_results if c is not None]
 
@@ -148,14 +419,14 @@ async def generate_testcases(state: GraphState) -> GraphState:
 
     # 失败的保留原位信息（供重试）
     failed_cases = [
-        {"case_id": f"{i + 1:03d}", "requirement": p}
-        for i, (p, r) in enumerate(zip(raw_points, all_results)) if r is None
+        {"case_id": f"{item['id']:03d}", "point_id": item["id"], "module": item["module"],
+         "requirement": item["point"]}
+        for item, r in zip(raw_points, all_results) if r is None
     ]
 
     logger.info(
         f"[Step 4] 用例生成完成: 成功 {len(test_cases)} 个，失败 {len(failed_cases)} 个，用时 {time.time() - start:.2f}s")
     return {
-        **state,
         "testcases": {
             "test_suite": state["prd_title"],
             "test_cases": test_cases,
@@ -164,58 +435,286 @@ async def generate_testcases(state: GraphState) -> GraphState:
     }
 
 
+def dedupe_testcases(testcases: List[dict]) -> List[dict]:
+    """移除标题、步骤、预期结果完全一致的重复用例，并重新编号"""
+    suite = TestSuite.from_cases(testcases)
+    removed = suite.dedupe()
+    if removed:
+        logger.info(f"移除重复用例 {removed} 条")
+    suite.renumber()
+    return suite.case_dicts()
+
+
+@traced("node", "step5_validate_testcases")
 async def validate_testcases(state: GraphState) -> GraphState:
     logger.info("[Step 5] 校验测试用例，移除高度一致的重复项")
 
     testcases = state.get("testcases", {}).get("test_cases", [])
     if not testcases:
         logger.warning("无测试用例可校验")
-        return {
-            **state,
-            "validated": "无测试用例"
-        }
-
-    seen = set()
-    unique_testcases = []
-    for case in testcases:
-        key = (case["title"], tuple(case["steps"]), tuple(case["expected_results"]))
-        if key not in seen:
-            seen.add(key)
-            unique_testcases.append(case)
-        else:
-            logger.info(f"移除重复用例: {case['title']}")
+        return {"validated": "无测试用例"}
 
-    # 重新编号
-    for idx, case in enumerate(unique_testcases, start=1):
-        case["case_id"] = f"{idx:03d}"
+    unique_testcases = dedupe_testcases(testcases)
 
     removed_count = len(testcases) - len(unique_testcases)
     validated_msg = f"共去除重复用例 {removed_count} 条" if removed_count else "未发现重复用例"
     logger.info(validated_msg)
 
     logger.info(f"[Step 5] 校验完成：{validated_msg}")
+    emit("dedup", total=len(testcases), unique=len(unique_testcases), removed=removed_count,
+         failed=len(state.get("testcases", {}).get("failed_cases", [])))
 
     return {
-        **state,
+        "validated": validated_msg,
         "testcases": {
             "test_suite": state["prd_title"],
-            "test_cases": unique_testcases
+            "test_cases": unique_testcases,
+            # 保留失败的测试点，供 retry_failed_cases 按 run_id 重试
+            "failed_cases": state.get("testcases", {}).get("failed_cases", [])
         }
     }
 
 
-workflow = StateGraph(GraphState)
-workflow.add_node("step1_extract_title", extract_prd_title)
-workflow.add_node("step2_extract_requirements", extract_requirements)
-workflow.add_node("step3_optimize_requirements", optimize_requirements)
-workflow.add_node("step4_generate_testcases", generate_testcases)
-workflow.add_node("step5_validate_testcases", validate_testcases)
+def build_workflow():
+    """构建流程定义；langgraph 较重，首次使用时才导入"""
+    from langgraph.graph import StateGraph, START, END
+
+    workflow = StateGraph(GraphState)
+    workflow.add_node("step1_extract_title", extract_prd_title)
+    workflow.add_node("step2_extract_requirements", extract_requirements)
+    workflow.add_node("step3_optimize_requirements", optimize_requirements)
+    workflow.add_node("step4_generate_testcases", generate_testcases)
+    workflow.add_node("step5_validate_testcases", validate_testcases)
+
+    # 标题提取与测试点提取/优化互不依赖，并行执行，在第 4 步汇合
+    workflow.add_edge(START, "step1_extract_title")
+    workflow.add_edge(START, "step2_extract_requirements")
+    workflow.add_edge("step2_extract_requirements", "step3_optimize_requirements")
+    workflow.add_edge(["step1_extract_title", "step3_optimize_requirements"], "step4_generate_testcases")
+    workflow.add_edge("step4_generate_testcases", "step5_validate_testcases")
+    workflow.add_edge("step5_validate_testcases", END)
+    return workflow
+
+
+_graph = None
+
+
+def get_graph():
+    """返回编译好的（不带检查点的）流程，首次调用时编译"""
+    global _graph
+    if _graph is None:
+        _graph = build_workflow().compile()
+    return _graph
+
+
+def __getattr__(name):
+    # 兼容 from langgraph_use import graph
+    if name == "graph":
+        return get_graph()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# --- 按 run_id 持久化的流程（本地 SQLite 检查点） ---
+CHECKPOINT_DB = os.environ.get("LANGGRAPH_CHECKPOINT_DB") or "checkpoints/langgraph.sqlite"
+
+_checkpointed_graph = None
+_checkpointed_graph_lock = asyncio.Lock()
+# 只在有重试进行或等待时持有，重试结束后自动释放
+_run_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+_graph_flight = SingleFlight("graph")
+
+
+async def get_checkpointed_graph():
+    """首次使用时打开 SQLite 检查点并编译带检查点的流程"""
+    global _checkpointed_graph
+    async with _checkpointed_graph_lock:
+        if _checkpointed_graph is None:
+            import aiosqlite
+            from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+            os.makedirs(os.path.dirname(CHECKPOINT_DB) or ".", exist_ok=True)
+            conn = await aiosqlite.connect(CHECKPOINT_DB)
+            saver = AsyncSqliteSaver(conn)
+            # 导入 langgraph 和编译流程较慢，放到线程中执行，避免阻塞事件循环
+            _checkpointed_graph = await asyncio.to_thread(
+                lambda: build_workflow().compile(checkpointer=saver))
+    return _checkpointed_graph
+
+
+async def invoke_graph(prd_text: str, profile: Optional[str] = None) -> GraphState:
+    """不带检查点执行流程，相同 PRD、相同模型配置的并发调用合并为一次"""
+    initial = {"prd_text": prd_text, "profile": resolve_profile(profile)}
+    return await _graph_flight.do(content_key("invoke", prd_text, profile=initial["profile"]),
+                                  lambda: get_graph().ainvoke(initial))
+
+
+def run_config(run_id: str) -> dict:
+    return {"configurable": {"thread_id": run_id}}
+
+
+async def _cache_final_state(cache_key: str, run_id: str, final: GraphState):
+    """只缓存没有失败测试点的完整结果"""
+    testcases = final.get("testcases") or {}
+    if testcases.get("test_cases") and not testcases.get("failed_cases"):
+        await RESULT_CACHE.put(cache_key, {"run_id": run_id, "state": {
+            "prd_title": final.get("prd_title"),
+            "validated": final.get("validated"),
+            "testcases": testcases
+        }}, "graph")
+
+
+async def run_graph(prd_text: str, run_id: Optional[str] = None,
+                    profile: Optional[str] = None) -> Tuple[str, GraphState]:
+    """
+    执行带检查点的流程
+
+    :param prd_text: PRD 文本
+    :param run_id: 运行 ID，不传则自动生成；传入已有 ID 时从上次中断的节点继续
+    :param profile: 模型配置名称，见 model_routing.PROFILES
+    :return: (run_id, 最终状态)
+    """
+    initial = {"prd_text": prd_text, "profile": resolve_profile(profile)}
+    checkpointed = await get_checkpointed_graph()
+    if run_id is None:
+        # 相同 PRD、相同模型配置已有完整结果时直接返回，state 中带 cached=True
+        cache_key = result_key("graph", prd_text, initial["profile"])
+        cached = await RESULT_CACHE.get(cache_key, "graph")
+        if cached is not None:
+            return cached["run_id"], {**cached["state"], "cached": True}
+
+        # 相同 PRD、相同模型配置的并发请求合并为一次运行，共享同一个 run_id
+        async def start_run():
+            new_run_id = uuid.uuid4().hex
+            with track(new_run_id) as channel:
+                final = await channel.run(checkpointed.ainvoke(initial, run_config(new_run_id)))
+            await _cache_final_state(cache_key, new_run_id, final)
+            return new_run_id, final
+
+        run_id, state = await _graph_flight.do(content_key(prd_text, profile=initial["profile"]), start_run)
+    else:
+        snapshot = await checkpointed.aget_state(run_config(run_id))
+        # 有未完成节点时传入 None 从检查点恢复，否则重新开始
+        resume_input = None if snapshot.next else initial
+        with track(run_id) as channel:
+            state = await channel.run(checkpointed.ainvoke(resume_input, run_config(run_id)))
+    return run_id, state
+
+
+_background_runs = set()
+# 进行中的后台运行：内容键 -> run_id，相同 PRD、相同模型配置的请求共享同一次运行
+_background_run_ids: Dict[str, str] = {}
+
+
+async def start_graph_run(prd_text: str, profile: Optional[str] = None) -> str:
+    """
+    在后台启动带检查点的流程并立即返回 run_id，进度通过 run_events 订阅，
+    结果通过 get_run_state 查询。相同 PRD、相同模型配置已有完整结果时返回原 run_id，
+    并在其事件通道上直接发布缓存的结果；正在运行时返回进行中的 run_id
+    """
+    profile = resolve_profile(profile)
+    cache_key = result_key("graph", prd_text, profile)
+    flight_key = content_key(prd_text, profile=profile)
+    running = _background_run_ids.get(flight_key)
+    if running is not None:
+        return running
+
+    cached = await RESULT_CACHE.get(cache_key, "graph")
+    if cached is not None:
+        run_id = cached["run_id"]
+        channel = open_channel(run_id)
+        # 该 run_id 上有进行中的重试时沿用其通道，不提前结束
+        if channel.seq == 0:
+            channel.publish("run_start", cached=True)
+            channel.publish("cached_result", prd_title=cached["state"].get("prd_title"),
+                            validated=cached["state"].get("validated"),
+                            testcases=cached["state"].get("testcases"))
+            channel.close("ok", cached=True)
+        return run_id
+
+    # 查询缓存期间可能已有相同请求启动了运行
+    running = _background_run_ids.get(flight_key)
+    if running is not None:
+        return running
+    run_id = uuid.uuid4().hex
+    # 先创建事件通道，客户端拿到 run_id 后立即订阅不会错过事件
+    open_channel(run_id)
+    _background_run_ids[flight_key] = run_id
+
+    async def background():
+        try:
+            _, final = await run_graph(prd_text, run_id, profile)
+            await _cache_final_state(cache_key, run_id, final)
+        except Exception as e:
+            logger.error(f"[{run_id}] 后台运行失败: {e}")
+        finally:
+            _background_run_ids.pop(flight_key, None)
+
+    task = asyncio.get_running_loop().create_task(background())
+    _background_runs.add(task)
+    task.add_done_callback(_background_runs.discard)
+    return run_id
+
 
-workflow.set_entry_point("step1_extract_title")
-workflow.add_edge("step1_extract_title", "step2_extract_requirements")
-workflow.add_edge("step2_extract_requirements", "step3_optimize_requirements")
-workflow.add_edge("step3_optimize_requirements", "step4_generate_testcases")
-workflow.add_edge("step4_generate_testcases", "step5_validate_testcases")
-workflow.set_finish_point("step5_validate_testcases")
+async def get_run_state(run_id: str) -> Optional[GraphState]:
+    checkpointed = await get_checkpointed_graph()
+    snapshot = await checkpointed.aget_state(run_config(run_id))
+    return snapshot.values or None
 
-graph = workflow.compile()
+
+def _failed_point_id(item: dict, index: int) -> int:
+    """失败记录中的原测试点编号；旧检查点中只有 case_id（即编号补零），都没有时按顺序编号"""
+    point_id = item.get("point_id")
+    if point_id is None:
+        try:
+            point_id = int(item.get("case_id"))
+        except (TypeError, ValueError):
+            point_id = index + 1
+    return int(point_id)
+
+
+async def retry_failed_cases(run_id: str) -> dict:
+    """
+    只重新生成某次运行中失败的测试点，并合并到已保存的用例集中
+
+    :param run_id: 运行 ID
+    :return: 合并后的 testcases
+    """
+    lock = _run_locks.get(run_id)
+    if lock is None:
+        lock = _run_locks[run_id] = asyncio.Lock()
+    async with lock:
+        checkpointed = await get_checkpointed_graph()
+        values = (await checkpointed.aget_state(run_config(run_id))).values
+        if not values:
+            raise KeyError(f"未找到运行记录: {run_id}")
+
+        testcases = values.get("testcases") or {}
+        failed_cases = testcases.get("failed_cases", [])
+        if not failed_cases:
+            logger.info(f"[{run_id}] 没有需要重试的测试点")
+            return testcases
+
+        logger.info(f"[{run_id}] 重试 {len(failed_cases)} 个失败的测试点")
+        # 沿用原运行中的测试点编号，同一事件通道上的 case / retry / case_failed 事件才能对应到正确的测试点
+        points = [
+            {"id": _failed_point_id(item, i), "module": item.get("module", ""), "point": item["requirement"]}
+            for i, item in enumerate(failed_cases)
+        ]
+        with track(run_id), use_profile(values.get("profile")):
+            results = await generate_cases_for_points(points, asyncio.Semaphore(MAX_CONCURRENT))
+
+            candidates = list(testcases.get("test_cases", [])) + [case for case in results if case is not None]
+            merged_cases = dedupe_testcases(candidates)
+            still_failed = [item for item, case in zip(failed_cases, results) if case is None]
+            emit("dedup", total=len(candidates), unique=len(merged_cases),
+                 removed=len(candidates) - len(merged_cases), failed=len(still_failed))
+        merged = {
+            "test_suite": testcases.get("test_suite") or values.get("prd_title"),
+            "test_cases": merged_cases,
+            "failed_cases": still_failed
+        }
+        validated_msg = f"重试成功 {len(failed_cases) - len(still_failed)} 个，仍失败 {len(still_failed)} 个"
+        await checkpointed.aupdate_state(run_config(run_id), {"testcases": merged, "validated": validated_msg},
+                                         as_node="step5_validate_testcases")
+        logger.info(f"[{run_id}] {validated_msg}")
+        return merged
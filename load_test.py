@@ -0,0 +1,200 @@
+"""
+异步压测驱动：按并发阶梯压测 API 接口和 LangGraph 流程，输出吞吐量、p50/p95/p99 和错误率
+
+用法（配合 mock_ark_server.py 离线运行）：
+    python mock_ark_server.py --port 9000 &
+    ARK_BASE_URL=http://127.0.0.1:9000 uvicorn GenerateAndCompareCasesAPI:app --port 8000 &
+    ARK_BASE_URL=http://127.0.0.1:9000 python load_test.py --scenarios generate_from_text,graph --ramp 1,5,20 --duration 30
+"""
+import os
+import io
+import sys
+import json
+import time
+import asyncio
+import argparse
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+SAMPLE_PRD = """# 用户登录模块
+
+## 功能说明
+1. 用户可通过账号和密码登录系统，账号为手机号，密码长度 6-20 位。
+2. 密码连续输错 5 次后锁定账号 30 分钟。
+3. 登录成功后跳转到首页，并展示用户昵称。
+"""
+
+# 1x1 像素 PNG，用于 /upload_img
+SAMPLE_PNG_BASE64 = ("data:image/png;base64,"
+                     "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg==")
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+class StageResult:
+    def __init__(self, scenario: str, concurrency: int):
+        self.scenario = scenario
+        self.concurrency = concurrency
+        self.latencies: List[float] = []
+        self.errors: Dict[str, int] = {}
+        self.started = 0.0
+        self.elapsed = 0.0
+
+    def record(self, latency: float, error: Optional[str] = None):
+        self.latencies.append(latency)
+        if error:
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+    def summary(self) -> dict:
+        total = len(self.latencies)
+        error_count = sum(self.errors.values())
+        values = sorted(self.latencies)
+        return {
+            "scenario": self.scenario,
+            "concurrency": self.concurrency,
+            "requests": total,
+            "throughput_rps": round(total / self.elapsed, 3) if self.elapsed else 0.0,
+            "p50_s": round(percentile(values, 50), 3),
+            "p95_s": round(percentile(values, 95), 3),
+            "p99_s": round(percentile(values, 99), 3),
+            "error_rate": round(error_count / total, 4) if total else 0.0,
+            "errors": self.errors
+        }
+
+
+# --- 场景 ---
+def build_scenarios(args, client: httpx.AsyncClient) -> Dict[str, Callable]:
+    prd_text = SAMPLE_PRD
+    if args.text_file:
+        with open(args.text_file, "r", encoding="utf-8") as f:
+            prd_text = f.read()
+
+    doc_bytes, doc_name = None, None
+    if args.doc:
+        with open(args.doc, "rb") as f:
+            doc_bytes = f.read()
+        doc_name = os.path.basename(args.doc)
+
+    async def upload_doc():
+        if doc_bytes is None:
+            raise RuntimeError("upload_doc 场景需要 --doc 参数")
+        files = {"file": (doc_name, io.BytesIO(doc_bytes))}
+        resp = await client.post(f"{args.base_url}/upload_doc", files=files, data={"profile": args.profile or ""})
+        resp.raise_for_status()
+
+    async def generate_from_text():
+        resp = await client.post(f"{args.base_url}/generate_from_text",
+                                 json={"text": prd_text, "profile": args.profile})
+        resp.raise_for_status()
+
+    async def upload_img():
+        resp = await client.post(f"{args.base_url}/upload_img", json={
+            "text": prd_text, "image_name": "login.png", "image_base64": SAMPLE_PNG_BASE64, "profile": args.profile
+        })
+        resp.raise_for_status()
+
+    async def graph_run():
+        # 进程内直接调用 LangGraph 流程
+        from langgraph_use import invoke_graph
+        await invoke_graph(prd_text, args.profile)
+
+    return {
+        "upload_doc": upload_doc,
+        "generate_from_text": generate_from_text,
+        "upload_img": upload_img,
+        "graph": graph_run,
+    }
+
+
+def classify_error(e: Exception) -> str:
+    if isinstance(e, httpx.HTTPStatusError):
+        return f"http_{e.response.status_code}"
+    return type(e).__name__
+
+
+async def run_stage(name: str, scenario: Callable, concurrency: int, duration: float,
+                    max_requests: Optional[int]) -> StageResult:
+    """闭环压测：concurrency 个 worker 持续发请求，直到时间或请求数用完"""
+    result = StageResult(name, concurrency)
+    deadline = time.perf_counter() + duration
+    issued = 0
+
+    async def worker():
+        nonlocal issued
+        while time.perf_counter() < deadline:
+            if max_requests is not None and issued >= max_requests:
+                return
+            issued += 1
+            start = time.perf_counter()
+            try:
+                await scenario()
+                result.record(time.perf_counter() - start)
+            except Exception as e:
+                result.record(time.perf_counter() - start, classify_error(e))
+
+    result.started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.elapsed = time.perf_counter() - result.started
+    return result
+
+
+def print_table(summaries: List[dict]):
+    header = f"{'scenario':<20}{'conc':>6}{'reqs':>7}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'err%':>8}"
+    print(header)
+    print("-" * len(header))
+    for s in summaries:
+        print(f"{s['scenario']:<20}{s['concurrency']:>6}{s['requests']:>7}{s['throughput_rps']:>9.2f}"
+              f"{s['p50_s']:>9.2f}{s['p95_s']:>9.2f}{s['p99_s']:>9.2f}{s['error_rate'] * 100:>7.1f}%")
+
+
+async def async_main(args) -> List[dict]:
+    timeout = httpx.Timeout(args.timeout)
+    limits = httpx.Limits(max_connections=max(args.ramp) * 2)
+    summaries = []
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        scenarios = build_scenarios(args, client)
+        for name in args.scenarios:
+            if name not in scenarios:
+                raise SystemExit(f"未知场景: {name}，可选: {', '.join(scenarios)}")
+            for concurrency in args.ramp:
+                print(f"==> {name} 并发 {concurrency}，持续 {args.duration}s", file=sys.stderr)
+                stage = await run_stage(name, scenarios[name], concurrency, args.duration, args.max_requests)
+                summaries.append(stage.summary())
+    return summaries
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="测试用例生成服务压测工具")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000", help="API 服务地址")
+    parser.add_argument("--scenarios", default="generate_from_text",
+                        type=lambda v: [s.strip() for s in v.split(",") if s.strip()],
+                        help="逗号分隔：upload_doc,generate_from_text,upload_img,graph")
+    parser.add_argument("--ramp", default="1,5,10", type=lambda v: [int(c) for c in v.split(",")],
+                        help="并发阶梯，逗号分隔")
+    parser.add_argument("--duration", type=float, default=30.0, help="每个阶梯的持续时间（秒）")
+    parser.add_argument("--max-requests", type=int, default=None, help="每个阶梯的最大请求数")
+    parser.add_argument("--timeout", type=float, default=600.0, help="单次请求超时（秒）")
+    parser.add_argument("--doc", help="upload_doc 场景使用的 .docx/.pdf 文件")
+    parser.add_argument("--text-file", help="generate_from_text / graph 场景使用的 PRD 文本文件")
+    parser.add_argument("--profile", default=None, help="模型配置名称，如 fast")
+    parser.add_argument("--output", help="将结果写入 JSON 文件")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    summaries = asyncio.run(async_main(args))
+    print_table(summaries)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summaries, f, ensure_ascii=False, indent=2)
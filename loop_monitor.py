@@ -0,0 +1,96 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Optional
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# 单个回调占用事件循环超过该时长（秒）视为阻塞
+BLOCK_THRESHOLD = float(os.environ.get("LOOP_BLOCK_THRESHOLD", "0.1"))
+# 采样间隔（秒）
+SAMPLE_INTERVAL = float(os.environ.get("LOOP_SAMPLE_INTERVAL", "0.5"))
+
+LOOP_LAG = REGISTRY.histogram(
+    "lark_event_loop_lag_seconds", "事件循环调度延迟（定时器实际触发时间与预期之差）",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+LOOP_BLOCKED = REGISTRY.counter(
+    "lark_event_loop_blocked_total", "阻塞事件循环超过阈值的回调次数", ["callback"])
+LOOP_BLOCKED_SECONDS = REGISTRY.counter(
+    "lark_event_loop_blocked_seconds_total", "阻塞事件循环超过阈值的回调累计耗时", ["callback"])
+
+_original_handle_run = None
+_monitor_task: Optional[asyncio.Task] = None
+
+
+def describe_handle(handle: asyncio.Handle) -> str:
+    """返回回调的可读名称；Task 的每一步显示为协程的限定名"""
+    callback = getattr(handle, "_callback", None)
+    owner = getattr(callback, "__self__", None)
+    if isinstance(owner, asyncio.Task):
+        coro = owner.get_coro()
+        return getattr(coro, "__qualname__", None) or repr(coro)
+    return getattr(callback, "__qualname__", None) or repr(callback)
+
+
+def _timed_run(self):
+    start = time.perf_counter()
+    try:
+        return _original_handle_run(self)
+    finally:
+        elapsed = time.perf_counter() - start
+        if elapsed >= BLOCK_THRESHOLD:
+            name = describe_handle(self)
+            LOOP_BLOCKED.inc(callback=name)
+            LOOP_BLOCKED_SECONDS.inc(elapsed, callback=name)
+            logger.warning(f"事件循环被 {name} 阻塞 {elapsed * 1000:.0f}ms")
+
+
+def instrument_callbacks() -> bool:
+    """
+    为标准 asyncio 事件循环的每个回调计时，记录超过阈值的回调名称。
+    uvloop 等 C 实现的事件循环不支持，此时只有调度延迟采样生效
+    """
+    global _original_handle_run
+    if _original_handle_run is not None:
+        return True
+    loop = asyncio.get_running_loop()
+    if not isinstance(loop, asyncio.BaseEventLoop):
+        logger.info(f"{type(loop).__name__} 不支持回调计时，仅采样调度延迟")
+        return False
+    _original_handle_run = asyncio.Handle._run
+    asyncio.Handle._run = _timed_run
+    return True
+
+
+async def _sample_lag():
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + SAMPLE_INTERVAL
+        await asyncio.sleep(SAMPLE_INTERVAL)
+        lag = max(0.0, loop.time() - expected)
+        LOOP_LAG.observe(lag)
+        if lag >= BLOCK_THRESHOLD:
+            logger.warning(f"事件循环调度延迟 {lag * 1000:.0f}ms")
+
+
+def start_loop_monitor():
+    """在事件循环中启动监控，应用启动时调用一次"""
+    global _monitor_task
+    if _monitor_task is not None and not _monitor_task.done():
+        return
+    instrument_callbacks()
+    _monitor_task = asyncio.get_running_loop().create_task(_sample_lag())
+
+
+async def stop_loop_monitor():
+    global _monitor_task
+    if _monitor_task is not None:
+        _monitor_task.cancel()
+        try:
+            await _monitor_task
+        except asyncio.CancelledError:
+            pass
+        _monitor_task = None
@@ -0,0 +1,319 @@
+import time
+import asyncio
+import logging
+import functools
+import threading
+import contextvars
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Prometheus 文本格式的 Content-Type
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+# 默认的延迟分桶（秒），覆盖解析（毫秒级）到 deepseek-r1 长调用（分钟级）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple, extra: Optional[Dict[str, str]] = None) -> str:
+    pairs = [f'{k}="{_escape(v)}"' for k, v in zip(labelnames, values)]
+    if extra:
+        pairs.extend(f'{k}="{_escape(v)}"' for k, v in extra.items())
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [各分桶计数..., 总数, 总和]
+                state = [0] * len(self.buckets) + [0, 0.0]
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += 1
+            state[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        for key, state in items:
+            for bound, count in zip(self.buckets, state):
+                labels = _format_labels(self.labelnames, key, {"le": _format_value(bound)})
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key, {"le": "+Inf"})
+            lines.append(f"{self.name}_bucket{labels} {state[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-2]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-1])}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, documentation, labelnames, **kwargs)
+                self._metrics[name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- 内置指标 ---
+SPAN_DURATION = REGISTRY.histogram(
+    "lark_span_duration_seconds", "各阶段（节点/解析器/上游调用/接口）耗时", ["kind", "name", "status"])
+SPAN_IN_FLIGHT = REGISTRY.gauge(
+    "lark_span_in_flight", "正在执行中的阶段数量", ["kind", "name"])
+SPAN_ERRORS = REGISTRY.counter(
+    "lark_span_errors_total", "阶段执行异常次数", ["kind", "name", "error"])
+UPSTREAM_RETRIES = REGISTRY.counter(
+    "lark_upstream_retries_total", "上游调用重试次数", ["upstream", "reason"])
+LLM_TOKENS = REGISTRY.counter(
+    "lark_llm_tokens_total", "模型消耗的 token 数", ["model", "type"])
+
+
+def render_latest() -> str:
+    """以 Prometheus 文本格式导出全部指标"""
+    return REGISTRY.render()
+
+
+def record_retry(upstream: str, reason: str):
+    UPSTREAM_RETRIES.inc(upstream=upstream, reason=reason)
+
+
+def record_tokens(model: str, usage: Optional[dict]):
+    """记录 Ark 响应中 usage 字段的 token 数"""
+    if not isinstance(usage, dict):
+        return
+    for field_name, token_type in (("prompt_tokens", "prompt"), ("completion_tokens", "completion")):
+        value = usage.get(field_name)
+        if isinstance(value, (int, float)):
+            LLM_TOKENS.inc(value, model=model, type=token_type)
+    reasoning = (usage.get("completion_tokens_details") or {}).get("reasoning_tokens")
+    if isinstance(reasoning, (int, float)):
+        LLM_TOKENS.inc(reasoning, model=model, type="reasoning")
+
+
+# --- 链路追踪 ---
+_current_span: contextvars.ContextVar = contextvars.ContextVar("lark_current_span", default=None)
+_span_listeners: List[Callable] = []
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "kind", "name", "attrs", "start", "duration", "status")
+
+    def __init__(self, kind: str, name: str, parent: Optional["Span"], attrs: dict):
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:8]
+        self.parent_id = parent.span_id if parent else None
+        self.kind = kind
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.status = "ok"
+
+
+def add_span_listener(listener: Callable):
+    """注册阶段事件监听器，listener(event, span)，event 为 "start" 或 "end" """
+    _span_listeners.append(listener)
+
+
+def _notify(event: str, current: Span):
+    for listener in list(_span_listeners):
+        try:
+            listener(event, current)
+        except Exception as e:
+            logger.debug(f"span 监听器执行失败: {e}")
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextmanager
+def span(kind: str, name: str, **attrs):
+    """
+    记录一个阶段的耗时、并发数和异常，可在同步和异步代码中使用
+
+    :param kind: 阶段类别，如 node / parser / http / endpoint
+    :param name: 阶段名称
+    """
+    current = Span(kind, name, _current_span.get(), attrs)
+    token = _current_span.set(current)
+    SPAN_IN_FLIGHT.inc(kind=kind, name=name)
+    _notify("start", current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "cancelled" if isinstance(e, asyncio.CancelledError) else "error"
+        SPAN_ERRORS.inc(kind=kind, name=name, error=type(e).__name__)
+        raise
+    finally:
+        current.duration = time.perf_counter() - current.start
+        SPAN_IN_FLIGHT.dec(kind=kind, name=name)
+        SPAN_DURATION.observe(current.duration, kind=kind, name=name, status=current.status)
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # 在异步生成器中使用时，可能在其他上下文中结束
+            pass
+        logger.debug(f"[trace {current.trace_id}] {kind}/{name} {current.status} {current.duration:.3f}s")
+        _notify("end", current)
+
+
+class SpanTimer:
+    """
+    供跨越 yield 的异步生成器（如流式响应）使用的 span：只在 with 块内计时，多次进入时累加，
+    且不设为当前 span。生成器挂起期间调用方代码的耗时不计入，调用方此时创建的 span 也不会挂在它下面。
+    用法：每次等待上游时 with timer: ...，结束时调用 finish()
+    """
+
+    def __init__(self, kind: str, name: str, **attrs):
+        self.span = Span(kind, name, _current_span.get(), attrs)
+        self._finished = False
+        SPAN_IN_FLIGHT.inc(kind=kind, name=name)
+        _notify("start", self.span)
+
+    def __enter__(self):
+        self._entered = time.perf_counter()
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.duration += time.perf_counter() - self._entered
+        # StopAsyncIteration 是流正常结束
+        if exc_type is not None and not issubclass(exc_type, StopAsyncIteration):
+            self.span.status = "cancelled" if issubclass(exc_type, asyncio.CancelledError) else "error"
+            SPAN_ERRORS.inc(kind=self.span.kind, name=self.span.name, error=exc_type.__name__)
+        return False
+
+    def finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        current = self.span
+        SPAN_IN_FLIGHT.dec(kind=current.kind, name=current.name)
+        SPAN_DURATION.observe(current.duration, kind=current.kind, name=current.name, status=current.status)
+        logger.debug(f"[trace {current.trace_id}] {current.kind}/{current.name} {current.status} "
+                     f"{current.duration:.3f}s")
+        _notify("end", current)
+
+
+def traced(kind: str, name: Optional[str] = None):
+    """为同步或异步函数自动包裹 span"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(kind, span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(kind, span_name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
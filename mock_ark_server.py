@@ -0,0 +1,239 @@
+"""
+本地 Ark /chat/completions 替身，用于离线压测
+
+用法：
+    python mock_ark_server.py --port 9000 --latency lognormal:2.0,0.6 --error-429 0.05 --error-5xx 0.02
+    ARK_BASE_URL=http://127.0.0.1:9000 python GenerateAndCompareCasesAPI.py
+"""
+import os
+import json
+import math
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from typing import List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="Mock Ark API")
+
+
+class MockConfig:
+    # 延迟分布: fixed:<秒> / uniform:<最小>,<最大> / lognormal:<中位数>,<sigma>
+    latency = os.environ.get("MOCK_ARK_LATENCY", "lognormal:1.0,0.5")
+    error_429 = float(os.environ.get("MOCK_ARK_ERROR_429", "0"))
+    error_5xx = float(os.environ.get("MOCK_ARK_ERROR_5XX", "0"))
+    retry_after = float(os.environ.get("MOCK_ARK_RETRY_AFTER", "1"))
+    # 流式输出时每个分片的间隔（秒）
+    chunk_interval = float(os.environ.get("MOCK_ARK_CHUNK_INTERVAL", "0.01"))
+    # 额外的固定输出（JSON 文件，键为提示词中的关键字，值为返回内容）
+    canned_file = os.environ.get("MOCK_ARK_CANNED_FILE")
+
+
+def sample_latency(spec: str) -> float:
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "fixed":
+        return values[0]
+    if kind == "uniform":
+        return random.uniform(values[0], values[1])
+    if kind == "lognormal":
+        median, sigma = values
+        return random.lognormvariate(math.log(median), sigma)
+    raise ValueError(f"不支持的延迟分布: {spec}")
+
+
+SAMPLE_CASE = {
+    "title": "使用正确的账号密码登录成功",
+    "precondition": "1. 系统正常运行；2. 测试账号已注册",
+    "steps": ["1. 打开登录页面", "2. 输入正确的账号和密码", "3. 点击登录"],
+    "expected_results": ["1. 登录成功", "2. 跳转到首页"]
+}
+
+SAMPLE_CATEGORIZED_CASES = {
+    "functional": [
+        {"case_id": "TC-001", **{k: v for k, v in SAMPLE_CASE.items() if k != "precondition"},
+         "preconditions": SAMPLE_CASE["precondition"]}
+    ],
+    "boundary": [
+        {"case_id": "TC-002", "title": "密码长度刚好为最小长度", "preconditions": "1. 测试账号已注册",
+         "steps": ["1. 输入 6 位密码", "2. 点击登录"], "expected_results": ["1. 登录成功"]}
+    ]
+}
+
+SAMPLE_REQUIREMENTS = """- 登录模块：
+  - 测试点1：使用正确的账号密码登录（功能）
+  - 测试点2：密码错误时给出提示（异常）
+  - 测试点3：账号长度超过上限时的校验（边界）
+- 注册模块：
+  - 测试点1：手机号格式校验（功能）
+  - 测试点2：重复注册提示（异常）
+"""
+
+SAMPLE_KEYPOINT = """一、功能模块特有校验细节
+1. 登录模块：账号不能为空，密码长度 6-20 位
+二、通用校验规则
+1. 所有输入框需去除首尾空格
+三、模块间流程触发关系
+1. 注册成功后跳转到登录页
+"""
+
+SAMPLE_EVALUATION = {
+    "evaluation_summary": {"overall_score": "3.8", "final_suggestion": "补充异常和边界场景"},
+    "detailed_report": {
+        key: {"score": "3.5", "reason": "mock"}
+        for key in ("format_compliance", "content_accuracy", "test_coverage", "functional_coverage",
+                    "defect_detection", "engineering_efficiency", "semantic_quality", "security_economy")
+    }
+}
+
+
+_canned_cache = {}
+
+
+def load_canned() -> dict:
+    path = MockConfig.canned_file
+    if not path:
+        return {}
+    if path not in _canned_cache:
+        with open(path, "r", encoding="utf-8") as f:
+            _canned_cache[path] = json.load(f)
+    return _canned_cache[path]
+
+
+def prompt_text(messages: List[dict]) -> str:
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(item.get("text", "") for item in content if isinstance(item, dict))
+    return "\n".join(parts)
+
+
+def canned_reply(payload: dict) -> str:
+    """根据提示词中的关键字返回与各调用方格式一致的固定输出"""
+    text = prompt_text(payload.get("messages", []))
+    for keyword, reply in load_canned().items():
+        if keyword in text:
+            return reply if isinstance(reply, str) else json.dumps(reply, ensure_ascii=False)
+
+    if "只返回标题" in text:
+        return "用户登录模块"
+    if "提取详细测试点" in text or "优化测试点" in text or "请优化以下测试点内容" in text:
+        return SAMPLE_REQUIREMENTS
+    if "全面提取其中每个功能模块" in text:
+        return SAMPLE_KEYPOINT
+    if "请仅返回 JSON" in text:
+        return json.dumps(SAMPLE_CASE, ensure_ascii=False)
+    if "evaluation_summary" in text:
+        return "```json\n" + json.dumps(SAMPLE_EVALUATION, ensure_ascii=False) + "\n```"
+    if "文本描述" in text or "图片名称" in text:
+        return ("## 测试用例\n\n- 登录成功\n\n---JSON OUTPUT---\n"
+                + json.dumps(SAMPLE_CATEGORIZED_CASES, ensure_ascii=False))
+    if "测试用例生成助手" in text:
+        return json.dumps(SAMPLE_CATEGORIZED_CASES, ensure_ascii=False)
+    if "请描述这张需求文档的图" in text:
+        return "原型图：登录页包含账号、密码输入框和登录按钮"
+    return "# 报告\n\nmock 输出"
+
+
+def usage_for(payload: dict, content: str) -> dict:
+    prompt_tokens = len(prompt_text(payload.get("messages", [])))
+    completion_tokens = len(content)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
+
+
+def chunk_text(content: str, size: int = 16):
+    for i in range(0, len(content), size):
+        yield content[i:i + size]
+
+
+async def stream_reply(payload: dict, content: str, completion_id: str):
+    model = payload.get("model", "mock")
+    for piece in chunk_text(content):
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]
+        }
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        await asyncio.sleep(MockConfig.chunk_interval)
+    final = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        "usage": usage_for(payload, content)
+    }
+    yield f"data: {json.dumps(final, ensure_ascii=False)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/chat/completions")
+async def chat_completions(request: Request):
+    payload = await request.json()
+
+    # 故障注入
+    roll = random.random()
+    if roll < MockConfig.error_429:
+        await asyncio.sleep(min(sample_latency(MockConfig.latency), 0.2))
+        return JSONResponse(status_code=429, headers={"Retry-After": str(MockConfig.retry_after)},
+                            content={"error": {"code": "RateLimitExceeded", "message": "mock 429"}})
+    if roll < MockConfig.error_429 + MockConfig.error_5xx:
+        await asyncio.sleep(sample_latency(MockConfig.latency))
+        return JSONResponse(status_code=random.choice([500, 502, 503]),
+                            content={"error": {"code": "InternalServiceError", "message": "mock 5xx"}})
+
+    content = canned_reply(payload)
+    completion_id = f"mock-{uuid.uuid4().hex[:12]}"
+
+    if payload.get("stream"):
+        # 首包延迟使用配置的分布，其余按分片间隔输出
+        await asyncio.sleep(sample_latency(MockConfig.latency))
+        return StreamingResponse(stream_reply(payload, content, completion_id), media_type="text/event-stream")
+
+    await asyncio.sleep(sample_latency(MockConfig.latency))
+    return JSONResponse(content={
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": payload.get("model", "mock"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": usage_for(payload, content)
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地 Ark 接口替身")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", default=MockConfig.latency, help="fixed:1 / uniform:0.5,3 / lognormal:2,0.6")
+    parser.add_argument("--error-429", type=float, default=MockConfig.error_429, help="返回 429 的比例")
+    parser.add_argument("--error-5xx", type=float, default=MockConfig.error_5xx, help="返回 5xx 的比例")
+    parser.add_argument("--retry-after", type=float, default=MockConfig.retry_after, help="429 的 Retry-After 秒数")
+    parser.add_argument("--chunk-interval", type=float, default=MockConfig.chunk_interval)
+    parser.add_argument("--canned", default=MockConfig.canned_file, help="关键字 -> 输出 的 JSON 文件")
+    args = parser.parse_args()
+
+    sample_latency(args.latency)  # 提前校验分布格式
+    MockConfig.latency = args.latency
+    MockConfig.error_429 = args.error_429
+    MockConfig.error_5xx = args.error_5xx
+    MockConfig.retry_after = args.retry_after
+    MockConfig.chunk_interval = args.chunk_interval
+    MockConfig.canned_file = args.canned
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -1,13 +1,155 @@
 import os
+import json
+import time
+import asyncio
+import threading
 import httpx
-from typing import List, Optional
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from metrics import REGISTRY, SpanTimer, traced, record_tokens
+from transport import call_with_retries, check_response, RetryableError, TransportError
+from model_routing import stage_params
 
 ARK_API_KEY = os.environ.get("ARK_API_KEY") or "f3fbd54b-1775-4250-be19-528cf14f1291"
 ARK_MODEL_ID = "deepseek-r1-250120"
-ARK_BASE_URL = "https://ark.cn-beijing.volces.com/api/v3"
+ARK_BASE_URL = os.environ.get("ARK_BASE_URL") or "https://ark.cn-beijing.volces.com/api/v3"
 
+# 对冲请求：调用耗时超过该模型近期延迟的分位数后，再发一份相同请求，谁先返回用谁
+HEDGE_ENABLED = os.environ.get("LLM_HEDGE_ENABLED", "1") != "0"
+HEDGE_PERCENTILE = float(os.environ.get("LLM_HEDGE_PERCENTILE", "95"))
+# 对冲请求占总请求数的上限比例
+HEDGE_BUDGET_RATIO = float(os.environ.get("LLM_HEDGE_BUDGET", "0.05"))
+# 样本不足时不对冲，避免冷启动阶段误判
+HEDGE_MIN_SAMPLES = int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY = float(os.environ.get("LLM_HEDGE_MIN_DELAY", "1.0"))
 
-async def call_model(prompt: str, img_urls: Optional[List[str]] = None) -> str:
+LLM_HEDGES = REGISTRY.counter(
+    "lark_llm_hedges_total", "对冲请求次数（sent 已发出 / won 对冲请求先返回 / denied 预算不足）", ["model", "outcome"])
+
+
+class LatencyTracker:
+    """按 key（模型名 + 调用方式）记录最近的成功调用耗时"""
+
+    def __init__(self, window: int = 200):
+        self._window = window
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, key: str, latency: float):
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self._window)
+            samples.append(latency)
+
+    def percentile(self, key: str, pct: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(key) or ())
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+class HedgeBudget:
+    """令牌桶：每个请求积攒 ratio 个令牌，每次对冲消耗 1 个，保证对冲数不超过总请求数的 ratio"""
+
+    def __init__(self, ratio: float, burst: float = 5.0):
+        self.ratio = ratio
+        self.burst = burst
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+
+    def on_request(self):
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+LATENCY = LatencyTracker()
+HEDGE_BUDGET = HedgeBudget(HEDGE_BUDGET_RATIO)
+
+
+def hedge_delay(key: str) -> Optional[float]:
+    """返回发出对冲请求前的等待时间，样本不足或未开启对冲时返回 None"""
+    if not HEDGE_ENABLED or HEDGE_BUDGET_RATIO <= 0:
+        return None
+    delay = LATENCY.percentile(key, HEDGE_PERCENTILE)
+    if delay is None:
+        return None
+    return max(delay, HEDGE_MIN_DELAY)
+
+
+async def _cancel_all(tasks):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def hedged(key: str, attempt: Callable[[], Awaitable], hedge: bool = True,
+                 discard: Optional[Callable[[object], Awaitable]] = None):
+    """
+    执行 attempt()；若超过 key 对应的延迟分位数仍未返回且预算允许，再发起一次 attempt()，
+    取先成功的结果并取消另一个。只能用于幂等调用
+
+    :param discard: 两个请求同时成功时，用于释放落选结果（如关闭流）
+    """
+    HEDGE_BUDGET.on_request()
+    delay = hedge_delay(key) if hedge else None
+    start = time.perf_counter()
+    primary = asyncio.ensure_future(attempt())
+    if delay is None:
+        result = await primary
+        LATENCY.observe(key, time.perf_counter() - start)
+        return result
+
+    tasks = [primary]
+    winner = None
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            if HEDGE_BUDGET.try_acquire():
+                LLM_HEDGES.inc(model=key, outcome="sent")
+                tasks.append(asyncio.ensure_future(attempt()))
+                pending = set(tasks)
+            else:
+                LLM_HEDGES.inc(model=key, outcome="denied")
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    winner = task
+                    break
+                error = task.exception()
+            if winner is not None:
+                break
+        if winner is None:
+            if error is None:
+                # 只发出了主请求且在等待期间已完成
+                winner = primary
+            else:
+                raise error
+        if winner is not primary:
+            LLM_HEDGES.inc(model=key, outcome="won")
+        result = winner.result()
+        LATENCY.observe(key, time.perf_counter() - start)
+        return result
+    finally:
+        losers = [task for task in tasks if task is not winner]
+        await _cancel_all([task for task in losers if not task.done()])
+        if discard is not None:
+            for task in losers:
+                if task.done() and not task.cancelled() and task.exception() is None:
+                    await discard(task.result())
+
+
+def _build_request(prompt: str, img_urls: Optional[List[str]] = None, stage: Optional[str] = None):
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {ARK_API_KEY}"
@@ -27,8 +169,9 @@ async def call_model(prompt: str, img_urls: Optional[List[str]] = None) -> str:
         "text": prompt
     })
 
+    # 模型和参数按当前 profile 的阶段配置选择
     payload = {
-        "model": ARK_MODEL_ID,
+        **stage_params(stage, ARK_MODEL_ID),
         "messages": [
             {
                 "role": "user",
@@ -36,22 +179,123 @@ async def call_model(prompt: str, img_urls: Optional[List[str]] = None) -> str:
             }
         ]
     }
+    return headers, payload
+
+
+
+@traced("http", "ark.chat_completions")
+async def call_model(prompt: str, img_urls: Optional[List[str]] = None, hedge: bool = False,
+                     stage: Optional[str] = None) -> str:
+    """
+    :param hedge: 调用是否幂等、允许发出对冲请求
+    :param stage: 流程阶段，用于按 profile 选择模型，见 model_routing
+    """
+    headers, payload = _build_request(prompt, img_urls, stage)
+    model = payload["model"]
+
+    async def attempt():
+        try:
+            async with httpx.AsyncClient(timeout=1000.0) as client:
+                response = await client.post(f"{ARK_BASE_URL}/chat/completions", json=payload, headers=headers)
+        except httpx.TransportError as e:
+            raise RetryableError("ark", f"{type(e).__name__}: {e}") from e
+        check_response("ark", response)
+        return response.json()
 
     try:
-        async with httpx.AsyncClient(timeout=1000.0) as client:
-            response = await client.post(f"{ARK_BASE_URL}/chat/completions", json=payload, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-            return content
-    except httpx.HTTPStatusError as e:
-        # HTTP响应错误
-        print(f"HTTP error: {e.response.status_code} - {e.response.text}")
-        raise
-    except httpx.RequestError as e:
-        # 请求连接错误
-        print(f"Request error: {e}")
+        # 重试在外层：每次重试内部仍可对冲，熔断和重试预算按逻辑调用计数
+        data = await call_with_retries("ark", lambda: hedged(model, attempt, hedge))
+        record_tokens(model, data.get("usage"))
+        content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
+        return content
+    except TransportError as e:
+        print(f"Ark error: {e}")
         raise
     except Exception as e:
         print(f"Unexpected error: {e}")
         raise
+
+
+async def _stream_once(headers: dict, payload: dict) -> AsyncIterator[str]:
+    async with httpx.AsyncClient(timeout=1000.0) as client:
+        async with client.stream("POST", f"{ARK_BASE_URL}/chat/completions",
+                                 json=payload, headers=headers) as response:
+            if response.status_code != 200:
+                await response.aread()
+            check_response("ark", response)
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if chunk.get("usage"):
+                    record_tokens(payload["model"], chunk["usage"])
+                for choice in chunk.get("choices") or []:
+                    content = (choice.get("delta") or {}).get("content")
+                    if content:
+                        yield content
+
+
+async def stream_model(prompt: str, img_urls: Optional[List[str]] = None,
+                       hedge: bool = False, stage: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    以流式方式调用模型，逐段产出回复内容（只包含 content，不包含推理过程）
+
+    :param hedge: 调用是否幂等；开启后按首包耗时对冲，先收到首包的流胜出
+    :param stage: 流程阶段，用于按 profile 选择模型，见 model_routing
+    """
+    headers, payload = _build_request(prompt, img_urls, stage)
+    payload["stream"] = True
+    payload["stream_options"] = {"include_usage": True}
+
+    async def open_stream():
+        stream = _stream_once(headers, payload)
+        try:
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            first = None
+        except httpx.TransportError as e:
+            await stream.aclose()
+            raise RetryableError("ark", f"{type(e).__name__}: {e}") from e
+        except BaseException:
+            await stream.aclose()
+            raise
+        return stream, first
+
+    async def close_stream(opened):
+        await opened[0].aclose()
+
+    # 只统计等待上游的时间：span 不跨越 yield 成为当前 span，调用方处理每段内容时创建的 span 不会挂在它下面
+    timer = SpanTimer("http", "ark.chat_completions_stream")
+    try:
+        # 只在收到首包之前重试；首包之后中断由调用方处理
+        with timer:
+            stream, first = await call_with_retries(
+                "ark", lambda: hedged(f"{payload['model']}:ttft", open_stream, hedge, discard=close_stream))
+        try:
+            if first is None:
+                return
+            yield first
+            while True:
+                try:
+                    with timer:
+                        try:
+                            content = await stream.__anext__()
+                        except httpx.TransportError as e:
+                            # 流中途断开同样是上游故障，转换为 RetryableError，调用方据此走重试预算而不是当作本地错误
+                            raise RetryableError("ark", f"{type(e).__name__}: {e}") from e
+                except StopAsyncIteration:
+                    break
+                yield content
+        finally:
+            await stream.aclose()
+    except TransportError as e:
+        print(f"Ark error: {e}")
+        raise
+    except httpx.RequestError as e:
+        print(f"Request error: {e}")
+        raise
+    finally:
+        timer.finish()
@@ -0,0 +1,116 @@
+import os
+import json
+import logging
+import functools
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+REASONING_MODEL = "deepseek-r1-250120"
+FAST_MODEL = "doubao-1-5-pro-32k-250115"
+
+DEFAULT_PROFILE = "default"
+
+# 各阶段使用的模型和参数；其他 profile 只需写出与 default 不同的阶段
+# 未写 model 的阶段沿用调用方自己的默认模型（如评测脚本的 MODEL_NAME）
+PROFILES: Dict[str, Dict[str, dict]] = {
+    "default": {
+        # LangGraph 流程
+        "title": {"model": REASONING_MODEL},
+        "requirements": {"model": REASONING_MODEL},
+        "optimize": {"model": REASONING_MODEL},
+        "case": {"model": REASONING_MODEL},
+        # 上传文档 / 图片流程
+        "vision_caption": {"model": "doubao-1-5-vision-pro-32k-250115", "temperature": 0.5, "top_p": 0.9},
+        "keypoint": {"model": REASONING_MODEL, "temperature": 0.5, "top_p": 0.9, "max_tokens": 16384},
+        "image_cases": {"model": "doubao-1.5-vision-pro-250328", "temperature": 0.5, "top_p": 0.9,
+                        "max_tokens": 16384},
+        "generate_cases": {"model": FAST_MODEL, "temperature": 0.5, "top_p": 0.9, "max_tokens": 16384},
+        # 评测流程
+        "eval_judge": {},
+        "eval_report": {},
+    },
+    # 标题、用例扩写、报告等不需要推理的阶段改用非推理模型
+    "fast": {
+        "title": {"model": FAST_MODEL, "max_tokens": 64},
+        "optimize": {"model": FAST_MODEL},
+        "case": {"model": FAST_MODEL},
+        "keypoint": {"model": FAST_MODEL},
+        "eval_report": {"model": FAST_MODEL},
+    },
+}
+
+
+class UnknownProfileError(ValueError):
+    pass
+
+
+def _load_overrides():
+    """从 MODEL_ROUTING_FILE 指定的 JSON 文件合并自定义 profile，格式同 PROFILES"""
+    path = os.environ.get("MODEL_ROUTING_FILE")
+    if not path:
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            overrides = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.error(f"读取模型路由配置 {path} 失败: {e}")
+        return
+    for name, stages in overrides.items():
+        profile = PROFILES.setdefault(name, {})
+        for stage, params in stages.items():
+            profile[stage] = {**profile.get(stage, {}), **params}
+
+
+_load_overrides()
+
+_current_profile: contextvars.ContextVar = contextvars.ContextVar("lark_model_profile", default=DEFAULT_PROFILE)
+
+
+def list_profiles() -> List[str]:
+    return list(PROFILES)
+
+
+def resolve_profile(name: Optional[str]) -> str:
+    """校验 profile 名称，为空时返回默认 profile"""
+    if not name:
+        return DEFAULT_PROFILE
+    if name not in PROFILES:
+        raise UnknownProfileError(f"未知的模型配置: {name}，可选: {', '.join(PROFILES)}")
+    return name
+
+
+def current_profile() -> str:
+    return _current_profile.get()
+
+
+@contextmanager
+def use_profile(name: Optional[str]):
+    """在当前上下文（及其中创建的异步任务）中使用指定 profile"""
+    token = _current_profile.set(resolve_profile(name))
+    try:
+        yield
+    finally:
+        _current_profile.reset(token)
+
+
+def stage_params(stage: str, default_model: Optional[str] = None) -> dict:
+    """返回当前 profile 下某阶段的请求参数（model、temperature 等），可直接合并进 payload"""
+    params = dict(PROFILES[DEFAULT_PROFILE].get(stage, {}))
+    profile = _current_profile.get()
+    if profile != DEFAULT_PROFILE:
+        params.update(PROFILES[profile].get(stage, {}))
+    if not params.get("model"):
+        params["model"] = default_model
+    return params
+
+
+def with_state_profile(func):
+    """LangGraph 节点装饰器：按 state["profile"] 选择模型配置"""
+    @functools.wraps(func)
+    async def wrapper(state, *args, **kwargs):
+        with use_profile(state.get("profile")):
+            return await func(state, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,367 @@
+import re
+import datetime
+from typing import List, Optional, Tuple
+
+# 根据评测结果 JSON 在本地生成 Markdown 报告，不调用模型；章节与原先让模型撰写报告时的要求一致
+
+# 评估维度：(字段名, 名称, 权重, 评估内容)，与评测提示中的评分公式一致
+DIMENSIONS = (
+    ("functional_coverage", "功能覆盖度", 0.30, "需求覆盖率、边界值覆盖度、分支路径覆盖率"),
+    ("defect_detection", "缺陷发现能力", 0.25, "缺陷检测率、突变分数、失败用例比例"),
+    ("engineering_efficiency", "工程效率", 0.20, "测试用例生成速度、维护成本、CI/CD集成度"),
+    ("semantic_quality", "语义质量", 0.15, "语义准确性、人工可读性、断言描述清晰度"),
+    ("security_economy", "安全与经济性", 0.10, "恶意代码率、冗余用例比例、综合成本"),
+)
+# 不参与加权、单独展示的维度
+AUXILIARY_DIMENSIONS = (
+    ("format_compliance", "格式合规性"),
+    ("content_accuracy", "内容准确性"),
+    ("test_coverage", "测试覆盖度"),
+)
+
+# 得分不低于 STRENGTH_SCORE 的维度列为优势，低于 WEAKNESS_SCORE 的列为劣势（5 分制）
+STRENGTH_SCORE = 4.0
+WEAKNESS_SCORE = 3.0
+MAX_SUGGESTIONS = 5
+
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+
+def parse_score(value) -> Optional[float]:
+    """模型给出的分数可能是数字，也可能是 "4.2"、"4.2分" 之类的字符串"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        match = _NUMBER_RE.search(value)
+        if match:
+            return float(match.group())
+    return None
+
+
+def score_level(score: Optional[float]) -> str:
+    if score is None:
+        return "未评分"
+    if score >= 4.5:
+        return "优秀"
+    if score >= 3.5:
+        return "良好"
+    if score >= 2.5:
+        return "一般"
+    return "较差"
+
+
+def _fmt(score: Optional[float]) -> str:
+    return "N/A" if score is None else f"{score:.1f}"
+
+
+def _as_list(value) -> List[str]:
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(item) for item in value if item]
+    return [str(value)]
+
+
+class _Evaluation:
+    """从评测结果中取出报告所需的字段，缺失的字段按空值处理"""
+
+    def __init__(self, result: dict):
+        summary = result.get("evaluation_summary")
+        self.summary = summary if isinstance(summary, dict) else {}
+        detailed = result.get("detailed_report")
+        self.detailed = detailed if isinstance(detailed, dict) else {}
+        duplicates = result.get("duplicate_analysis")
+        self.duplicates = duplicates if isinstance(duplicates, dict) else {}
+        self.overall = parse_score(self.summary.get("overall_score"))
+        self.suggestion = str(self.summary.get("final_suggestion") or "").strip()
+        analysis = self.section("test_coverage").get("analysis")
+        analysis = analysis if isinstance(analysis, dict) else {}
+        self.covered = _as_list(analysis.get("covered_features"))
+        self.missed = _as_list(analysis.get("missed_features_or_scenarios"))
+        self.scenario_types = _as_list(analysis.get("scenario_types_found"))
+
+    def section(self, key: str) -> dict:
+        value = self.detailed.get(key)
+        return value if isinstance(value, dict) else {}
+
+    def score(self, key: str) -> Optional[float]:
+        return parse_score(self.section(key).get("score"))
+
+    def reason(self, key: str) -> str:
+        return str(self.section(key).get("reason") or "").strip()
+
+    def scored_dimensions(self) -> List[Tuple[str, str, float]]:
+        """有得分的加权维度：(字段名, 名称, 得分)"""
+        return [(key, name, self.score(key)) for key, name, _weight, _desc in DIMENSIONS
+                if self.score(key) is not None]
+
+    def weighted_score(self) -> Optional[float]:
+        """按权重计算的总分；缺失的维度不计入，权重按已有维度重新归一"""
+        total = weights = 0.0
+        for key, _name, weight, _desc in DIMENSIONS:
+            score = self.score(key)
+            if score is not None:
+                total += score * weight
+                weights += weight
+        return total / weights if weights else None
+
+    def duplicate_rate(self, side: str) -> Optional[float]:
+        info = self.duplicates.get(side)
+        if not isinstance(info, dict):
+            return None
+        return parse_score(info.get("duplicate_rate"))
+
+
+def _summary(ev: _Evaluation, title: str) -> List[str]:
+    overall = ev.overall if ev.overall is not None else ev.weighted_score()
+    lines = [f"# {title}", "", "## 一、报告摘要", ""]
+    lines.append(f"- **总体评分**：{_fmt(overall)} / 5（{score_level(overall)}）")
+    weighted = ev.weighted_score()
+    if weighted is not None and ev.overall is not None and abs(weighted - ev.overall) >= 0.05:
+        lines.append(f"- **按权重计算的总分**：{_fmt(weighted)} / 5")
+    scored = ev.scored_dimensions()
+    if scored:
+        best = max(scored, key=lambda item: item[2])
+        worst = min(scored, key=lambda item: item[2])
+        lines.append(f"- **表现最好的维度**：{best[1]}（{_fmt(best[2])}）")
+        if worst[0] != best[0]:
+            lines.append(f"- **最需改进的维度**：{worst[1]}（{_fmt(worst[2])}）")
+    if ev.covered or ev.missed:
+        lines.append(f"- **功能覆盖**：已覆盖 {len(ev.covered)} 项，未覆盖 {len(ev.missed)} 项")
+    ai_rate, golden_rate = ev.duplicate_rate("ai"), ev.duplicate_rate("golden")
+    if ai_rate is not None:
+        text = f"- **重复率**：AI 用例 {ai_rate:g}%"
+        if golden_rate is not None:
+            text += f"，黄金标准 {golden_rate:g}%"
+        lines.append(text)
+    if ev.suggestion:
+        lines.append(f"- **核心建议**：{ev.suggestion}")
+    return lines + [""]
+
+
+def _method() -> List[str]:
+    lines = ["## 二、评估指标与方法", "",
+             "以人工编写的黄金标准测试用例为基准，从以下五个维度评估 AI 生成的测试用例，各维度满分 5 分：", "",
+             "| 维度 | 权重 | 评估内容 |", "| --- | --- | --- |"]
+    for _key, name, weight, desc in DIMENSIONS:
+        lines.append(f"| {name} | {weight:.0%} | {desc} |")
+    formula = " + ".join(f"{weight:g}×{name}" for _key, name, weight, _desc in DIMENSIONS)
+    lines += ["", f"总分 = {formula}。", "",
+              "此外单独给出格式合规性、内容准确性和测试覆盖度的评分，作为参考，不计入总分。", ""]
+    return lines
+
+
+def _scores(ev: _Evaluation) -> List[str]:
+    lines = ["## 三、综合评分", "", "| 维度 | 权重 | 得分 | 加权得分 | 等级 |", "| --- | --- | --- | --- | --- |"]
+    for key, name, weight, _desc in DIMENSIONS:
+        score = ev.score(key)
+        weighted = None if score is None else score * weight
+        lines.append(f"| {name} | {weight:.0%} | {_fmt(score)} | {'N/A' if weighted is None else f'{weighted:.2f}'} "
+                     f"| {score_level(score)} |")
+    overall = ev.overall if ev.overall is not None else ev.weighted_score()
+    lines.append(f"| **总分** | 100% | **{_fmt(overall)}** | — | {score_level(overall)} |")
+    auxiliary = [(name, ev.score(key)) for key, name in AUXILIARY_DIMENSIONS if ev.section(key)]
+    if auxiliary:
+        lines += ["", "| 参考维度 | 得分 | 等级 |", "| --- | --- | --- |"]
+        lines += [f"| {name} | {_fmt(score)} | {score_level(score)} |" for name, score in auxiliary]
+    return lines + [""]
+
+
+def _duplicates(ev: _Evaluation) -> List[str]:
+    sides = [(label, ev.duplicates.get(side)) for side, label in (("ai", "AI 用例"), ("golden", "黄金标准"))]
+    sides = [(label, info) for label, info in sides if isinstance(info, dict)]
+    if not sides:
+        return []
+    lines = ["### 重复用例分析", "", "| 指标 | " + " | ".join(label for label, _ in sides) + " |",
+             "| --- |" + " --- |" * len(sides)]
+    rows = (("重复率", "duplicate_rate", "%"), ("重复用例数", "duplicate_count", ""),
+            ("标题重复", "title_duplicates", ""), ("步骤高度相似", "steps_duplicates", ""))
+    for label, field, unit in rows:
+        cells = []
+        for _side, info in sides:
+            value = info.get(field, "N/A")
+            if isinstance(value, list):
+                value = len(value)
+            cells.append(f"{value}{unit}")
+        lines.append(f"| {label} | " + " | ".join(cells) + " |")
+    return lines + [""]
+
+
+def _details(ev: _Evaluation) -> List[str]:
+    lines = ["## 四、详细分析", ""]
+    for key, name, _weight, _desc in DIMENSIONS:
+        lines += [f"### {name}分析", "", f"**评分**：{_fmt(ev.score(key))}（{score_level(ev.score(key))}）", "",
+                  ev.reason(key) or "评测结果中没有该维度的说明。", ""]
+    for key, name in AUXILIARY_DIMENSIONS:
+        if not ev.section(key):
+            continue
+        lines += [f"### {name}", "", f"**评分**：{_fmt(ev.score(key))}", "", ev.reason(key) or "无说明。", ""]
+        if key == "test_coverage":
+            for label, items in (("已覆盖的功能", ev.covered), ("未覆盖的功能或场景", ev.missed),
+                                 ("发现的场景类型", ev.scenario_types)):
+                if items:
+                    lines += [f"**{label}**：", ""] + [f"- {item}" for item in items] + [""]
+    return lines + _duplicates(ev)
+
+
+def _pros_cons(ev: _Evaluation) -> List[str]:
+    strengths = [f"{name}（{_fmt(score)}）：{ev.reason(key) or '表现良好'}"
+                 for key, name, score in ev.scored_dimensions() if score >= STRENGTH_SCORE]
+    if ev.scenario_types:
+        strengths.append(f"覆盖了多种场景类型：{'、'.join(ev.scenario_types)}")
+    weaknesses = [f"{name}（{_fmt(score)}）：{ev.reason(key) or '得分偏低'}"
+                  for key, name, score in ev.scored_dimensions() if score < WEAKNESS_SCORE]
+    if ev.missed:
+        weaknesses.append(f"存在 {len(ev.missed)} 项未覆盖的功能或场景：{'、'.join(ev.missed)}")
+    ai_rate, golden_rate = ev.duplicate_rate("ai"), ev.duplicate_rate("golden")
+    if ai_rate is not None and golden_rate is not None and ai_rate > golden_rate:
+        weaknesses.append(f"重复率高于黄金标准（{ai_rate:g}% 对比 {golden_rate:g}%）")
+    lines = ["## 五、优缺点对比", "", "**优势**：", ""]
+    lines += [f"- {item}" for item in strengths] or ["- 暂无得分突出的维度"]
+    lines += ["", "**劣势**：", ""]
+    lines += [f"- {item}" for item in weaknesses] or ["- 各维度表现较为均衡，没有明显短板"]
+    return lines + [""]
+
+
+def _suggestions(ev: _Evaluation) -> List[str]:
+    suggestions = []
+    if ev.suggestion:
+        suggestions.append(ev.suggestion)
+    if ev.missed:
+        suggestions.append(f"补充未覆盖的功能和场景的用例：{'、'.join(ev.missed[:5])}")
+    ai_rate, golden_rate = ev.duplicate_rate("ai"), ev.duplicate_rate("golden")
+    if ai_rate is not None and golden_rate is not None and ai_rate > golden_rate:
+        suggestions.append("生成后按标题和步骤去重、合并相似用例，把重复率降到黄金标准的水平")
+    # 按得分从低到高补充各维度的改进方向
+    for key, name, score in sorted(ev.scored_dimensions(), key=lambda item: item[2]):
+        if len(suggestions) >= MAX_SUGGESTIONS or score >= STRENGTH_SCORE:
+            break
+        desc = next(desc for k, _n, _w, desc in DIMENSIONS if k == key)
+        suggestions.append(f"提升{name}（当前 {_fmt(score)} 分），重点关注{desc}")
+    lines = ["## 六、改进建议", ""]
+    lines += [f"{i}. {item}" for i, item in enumerate(suggestions[:MAX_SUGGESTIONS], start=1)] \
+        or ["1. 当前各维度表现良好，保持现有生成策略，并持续用新的黄金标准用例回归评测"]
+    return lines + [""]
+
+
+def _conclusion(ev: _Evaluation) -> List[str]:
+    overall = ev.overall if ev.overall is not None else ev.weighted_score()
+    level = score_level(overall)
+    verdicts = {
+        "优秀": "AI 生成的测试用例整体质量接近或达到人工标准，可以直接作为测试设计的主要来源，人工只需抽查。",
+        "良好": "AI 生成的测试用例整体可用，适合作为测试设计的初稿，由测试人员补充遗漏场景后使用。",
+        "一般": "AI 生成的测试用例只能覆盖主要流程，适合用于快速梳理测试点，仍需人工大量补充和修改。",
+        "较差": "AI 生成的测试用例与人工标准差距较大，暂不适合直接使用，建议先改进需求输入和生成提示。",
+        "未评分": "评测结果中缺少总体评分，无法给出结论，请检查评测步骤的输出。",
+    }
+    lines = ["## 七、综合结论", "", f"总体评分 {_fmt(overall)} / 5，评级为「{level}」。{verdicts[level]}"]
+    scored = ev.scored_dimensions()
+    strong = [name for _key, name, score in scored if score >= STRENGTH_SCORE]
+    weak = [name for _key, name, score in scored if score < WEAKNESS_SCORE]
+    if strong:
+        lines.append(f"在{'、'.join(strong)}方面表现较好。")
+    if weak:
+        lines.append(f"{'、'.join(weak)}是主要短板，应优先改进。")
+    return lines + [""]
+
+
+def render_markdown_report(evaluation_result, title: str = "AI测试用例评估报告",
+                           generated_at: Optional[datetime.datetime] = None) -> str:
+    """
+    根据评测结果生成完整的 Markdown 报告：摘要、评估方法、综合评分、详细分析、优缺点、改进建议和结论
+
+    :param evaluation_result: evaluate_test_cases 的输出（含 evaluation_summary、detailed_report，
+        可选 duplicate_analysis）；模型未返回 JSON 时为 {"text": 原始回复}
+    """
+    if not isinstance(evaluation_result, dict):
+        return "# 评测报告生成失败\n\n无法解析评测结果，请检查数据格式。"
+    if "evaluation_summary" not in evaluation_result and "detailed_report" not in evaluation_result:
+        text = evaluation_result.get("text")
+        if not text:
+            return "# 评测报告生成失败\n\n无法解析评测结果，请检查数据格式。"
+        return f"# {title}\n\n> 评测结果不是结构化数据，以下为评测模型的原始输出。\n\n{text}\n"
+
+    ev = _Evaluation(evaluation_result)
+    lines = (_summary(ev, title) + _method() + _scores(ev) + _details(ev) + _pros_cons(ev)
+             + _suggestions(ev) + _conclusion(ev))
+    generated_at = generated_at or datetime.datetime.now()
+    lines += ["---", "", f"*报告生成时间：{generated_at:%Y-%m-%d %H:%M:%S}*", ""]
+    return "\n".join(lines)
+
+
+# --- 矩阵评测对比表 ---
+def summarize_evaluation(evaluation_result) -> dict:
+    """从单次评测结果中取出对比表所需的分数：总分、加权总分、各维度得分和 AI 用例重复率"""
+    if not isinstance(evaluation_result, dict):
+        return {"overall": None, "weighted": None, "scores": {}, "ai_duplicate_rate": None}
+    ev = _Evaluation(evaluation_result)
+    weighted = ev.weighted_score()
+    return {
+        "overall": ev.overall if ev.overall is not None else weighted,
+        "weighted": weighted,
+        "scores": {key: ev.score(key) for key, _name, _weight, _desc in DIMENSIONS},
+        "ai_duplicate_rate": ev.duplicate_rate("ai"),
+    }
+
+
+def _mean(values: List[float]) -> Optional[float]:
+    return sum(values) / len(values) if values else None
+
+
+def _grouped_scores(rows: List[dict], field: str) -> List[Tuple[str, List[float], int]]:
+    """按 field 分组的有效总分：(分组名, 总分列表, 评测次数)，保持首次出现的顺序"""
+    scores: dict = {}
+    counts: dict = {}
+    for row in rows:
+        name = row[field]
+        counts[name] = counts.get(name, 0) + 1
+        scores.setdefault(name, [])
+        if row.get("overall") is not None:
+            scores[name].append(row["overall"])
+    return [(name, scores[name], count) for name, count in counts.items()]
+
+
+def render_matrix_report(rows: List[dict], title: str = "测试用例评测矩阵",
+                         generated_at: Optional[datetime.datetime] = None) -> str:
+    """
+    生成矩阵评测的对比报告：每个组合一行的明细表，以及按 AI 用例、评审模型汇总的平均分
+
+    :param rows: 每个组合一条，含 ai、golden、judge、success、error（失败时）及 summarize_evaluation 的字段
+    """
+    names = [name for _key, name, _weight, _desc in DIMENSIONS]
+    lines = [f"# {title}", "",
+             f"共 {len(rows)} 个组合，成功 {sum(1 for row in rows if row.get('success'))} 个。", "",
+             "## 一、AI 用例排名", "",
+             "按所有黄金标准和评审模型下的平均总分排序。", "",
+             "| 排名 | AI 用例 | 平均总分 | 最低 | 最高 | 有效评测 |", "| --- | --- | --- | --- | --- | --- |"]
+    ranking = sorted(_grouped_scores(rows, "ai"), key=lambda item: -(_mean(item[1]) or 0))
+    for rank, (name, scores, count) in enumerate(ranking, start=1):
+        lines.append(f"| {rank} | {name} | {_fmt(_mean(scores))} | {_fmt(min(scores) if scores else None)} "
+                     f"| {_fmt(max(scores) if scores else None)} | {len(scores)}/{count} |")
+
+    lines += ["", "## 二、评审模型对比", "",
+              "同一组用例在不同评审模型下的平均总分，差异较大时说明评分受评审模型影响明显。", "",
+              "| 评审模型 | 平均总分 | 有效评测 |", "| --- | --- | --- |"]
+    for name, scores, count in _grouped_scores(rows, "judge"):
+        lines.append(f"| {name} | {_fmt(_mean(scores))} | {len(scores)}/{count} |")
+
+    lines += ["", "## 三、明细", "",
+              "| AI 用例 | 黄金标准 | 评审模型 | 总分 | " + " | ".join(names) + " | AI 重复率 |",
+              "| --- | --- | --- | --- |" + " --- |" * (len(names) + 1)]
+    for row in rows:
+        prefix = f"| {row['ai']} | {row['golden']} | {row['judge']} |"
+        if not row.get("success"):
+            lines.append(f"{prefix} 失败：{str(row.get('error') or '未知错误').replace('|', '/')} |"
+                         + " |" * (len(names) + 1))
+            continue
+        scores = row.get("scores") or {}
+        cells = [_fmt(scores.get(key)) for key, _name, _weight, _desc in DIMENSIONS]
+        rate = row.get("ai_duplicate_rate")
+        lines.append(f"{prefix} {_fmt(row.get('overall'))} | " + " | ".join(cells)
+                     + f" | {'N/A' if rate is None else f'{rate:g}%'} |")
+
+    generated_at = generated_at or datetime.datetime.now()
+    lines += ["", "---", "", f"*报告生成时间：{generated_at:%Y-%m-%d %H:%M:%S}*", ""]
+    return "\n".join(lines)
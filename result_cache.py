@@ -0,0 +1,155 @@
+import os
+import gzip
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from metrics import REGISTRY
+from model_routing import PROFILES, DEFAULT_PROFILE, resolve_profile
+from singleflight import content_key
+
+logger = logging.getLogger(__name__)
+
+# 提示词或流程有改动、旧结果不再适用时递增
+PIPELINE_VERSION = "1"
+
+RESULT_CACHE_ENABLED = os.environ.get("RESULT_CACHE_ENABLED", "1") != "0"
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR") or "cache/results"
+# 磁盘占用上限（字节），超过时按最近最少使用淘汰
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+CACHE_LOOKUPS = REGISTRY.counter(
+    "lark_result_cache_total", "整次生成结果缓存的查询、写入和淘汰次数", ["pipeline", "result"])
+
+_SUFFIX = ".json.gz"
+
+
+def profile_fingerprint(profile: Optional[str]) -> str:
+    """profile 名称加上其各阶段的实际参数，修改模型配置后旧结果自动失效"""
+    profile = resolve_profile(profile)
+    stages = {**PROFILES[DEFAULT_PROFILE]}
+    for stage, params in PROFILES[profile].items():
+        stages[stage] = {**stages.get(stage, {}), **params}
+    digest = hashlib.sha256(json.dumps(stages, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return f"{profile}:{digest}"
+
+
+def result_key(pipeline: str, content, profile: Optional[str] = None) -> str:
+    """
+    结果缓存键：流程名称 + 流程版本 + 模型配置 + 内容（文本按 normalize_text 规范化，bytes 原样）
+
+    :param pipeline: 流程名称，如 upload_doc / generate_from_text / graph
+    """
+    return content_key(pipeline, PIPELINE_VERSION, content, profile=profile_fingerprint(profile))
+
+
+class ResultCache:
+    """
+    gzip 压缩的 JSON 结果缓存，每个结果一个文件；按文件修改时间（命中时更新）做 LRU 淘汰，
+    重启后从目录恢复索引
+    """
+
+    def __init__(self, directory: str = RESULT_CACHE_DIR, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._total = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    def _load_index(self):
+        if self._loaded:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(_SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name[:-len(_SUFFIX)], stat.st_size))
+        for _mtime, key, size in sorted(entries):
+            self._index[key] = size
+            self._total += size
+        self._loaded = True
+
+    def _get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            self._load_index()
+            if key not in self._index:
+                return None
+            self._index.move_to_end(key)
+        path = self._path(key)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                value = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取结果缓存 {key[:12]} 失败，丢弃: {e}")
+            self._remove(key)
+            return None
+        return value
+
+    def _put(self, key: str, value: dict) -> int:
+        data = gzip.compress(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        path = self._path(key)
+        with self._lock:
+            self._load_index()
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._total += len(data) - self._index.pop(key, 0)
+            self._index[key] = len(data)
+            evicted = 0
+            while self._total > self.max_bytes and len(self._index) > 1:
+                old_key, size = self._index.popitem(last=False)
+                self._total -= size
+                evicted += 1
+                try:
+                    os.remove(self._path(old_key))
+                except OSError:
+                    pass
+        return evicted
+
+    def _remove(self, key: str):
+        with self._lock:
+            self._total -= self._index.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    async def get(self, key: str, pipeline: str = "") -> Optional[dict]:
+        if not RESULT_CACHE_ENABLED:
+            return None
+        value = await asyncio.to_thread(self._get, key)
+        CACHE_LOOKUPS.inc(pipeline=pipeline, result="hit" if value is not None else "miss")
+        return value
+
+    async def put(self, key: str, value: dict, pipeline: str = ""):
+        if not RESULT_CACHE_ENABLED:
+            return
+        try:
+            evicted = await asyncio.to_thread(self._put, key, value)
+        except OSError as e:
+            logger.warning(f"写入结果缓存失败: {e}")
+            return
+        CACHE_LOOKUPS.inc(pipeline=pipeline, result="store")
+        if evicted:
+            CACHE_LOOKUPS.inc(evicted, pipeline=pipeline, result="evict")
+
+    def invalidate(self, key: str):
+        self._remove(key)
+
+
+RESULT_CACHE = ResultCache()
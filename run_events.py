@@ -0,0 +1,171 @@
+import os
+import time
+import asyncio
+import logging
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import AsyncIterator, Dict, Optional
+
+from metrics import Span, add_span_listener
+
+logger = logging.getLogger(__name__)
+
+# 每个运行保留的事件条数（供晚订阅或断线重连的客户端补发），以及运行结束后事件保留多久（秒）
+HISTORY_SIZE = int(os.environ.get("RUN_EVENTS_HISTORY", "5000"))
+RETENTION = float(os.environ.get("RUN_EVENTS_RETENTION", "600"))
+
+
+class RunCancelledError(Exception):
+    """运行被用户取消"""
+
+    def __init__(self, run_id: str):
+        super().__init__(f"运行 {run_id} 已取消")
+        self.run_id = run_id
+
+
+class RunChannel:
+    """
+    一次运行的进度事件：按顺序编号保存最近的事件，订阅者从任意编号开始读取并等待新事件。
+    订阅者读的是同一份事件历史，慢订阅者不会拖慢运行，也不会占用额外队列
+    """
+
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self.seq = 0
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self.closed_at: Optional[float] = None
+        self.status = "running"
+        self.task: Optional[asyncio.Task] = None
+        self._cancel_requested = False
+        self._changed = asyncio.Event()
+
+    @property
+    def closed(self) -> bool:
+        return self.closed_at is not None
+
+    def publish(self, event_type: str, **data):
+        if self.closed:
+            return
+        self.seq += 1
+        self.history.append({"seq": self.seq, "run_id": self.run_id, "type": event_type,
+                             "ts": round(time.time(), 3), **data})
+        self._wake()
+
+    def close(self, status: str, **data):
+        if self.closed:
+            return
+        self.publish("run_end", status=status, **data)
+        self.status = status
+        self.closed_at = time.monotonic()
+        self._wake()
+
+    def _wake(self):
+        # 唤醒所有等待中的订阅者，并为下一批等待换一个新的 Event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def events(self, after: int = 0, heartbeat: Optional[float] = None) -> AsyncIterator[Optional[dict]]:
+        """
+        依次产出编号大于 after 的事件，运行结束且事件读完后停止。
+        设置 heartbeat 时，超过该秒数没有新事件则产出 None，供调用方发送心跳
+        """
+        while True:
+            changed = self._changed
+            for event in list(self.history):
+                if event["seq"] > after:
+                    after = event["seq"]
+                    yield event
+            if self.closed and after >= self.seq:
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), heartbeat)
+            except asyncio.TimeoutError:
+                yield None
+
+    async def run(self, coro):
+        """在独立任务中执行 coro，使其可以被 cancel() 取消；调用方被取消时同时取消该任务"""
+        self.task = asyncio.ensure_future(coro)
+        try:
+            return await asyncio.shield(self.task)
+        except asyncio.CancelledError:
+            if self._cancel_requested and self.task.cancelled():
+                raise RunCancelledError(self.run_id) from None
+            self.task.cancel()
+            raise
+
+    def cancel(self) -> bool:
+        if self.closed or self.task is None or self.task.done():
+            return False
+        self._cancel_requested = True
+        self.publish("cancel_requested")
+        self.task.cancel()
+        return True
+
+
+_runs: Dict[str, RunChannel] = {}
+_current_run: contextvars.ContextVar = contextvars.ContextVar("lark_current_run", default=None)
+
+
+def _prune():
+    now = time.monotonic()
+    for run_id, channel in list(_runs.items()):
+        if channel.closed and now - channel.closed_at > RETENTION:
+            del _runs[run_id]
+
+
+def get_channel(run_id: str) -> Optional[RunChannel]:
+    return _runs.get(run_id)
+
+
+def open_channel(run_id: str) -> RunChannel:
+    """创建（或复用未结束的）运行事件通道"""
+    _prune()
+    channel = _runs.get(run_id)
+    if channel is None or channel.closed:
+        channel = _runs[run_id] = RunChannel(run_id)
+    return channel
+
+
+@contextmanager
+def track(run_id: str):
+    """在上下文中执行的流程节点、用例生成、重试等都会向该运行的通道发送事件"""
+    channel = open_channel(run_id)
+    token = _current_run.set(channel)
+    channel.publish("run_start")
+    status = "error"
+    try:
+        yield channel
+        status = "ok"
+    except (RunCancelledError, asyncio.CancelledError):
+        status = "cancelled"
+        raise
+    finally:
+        _current_run.reset(token)
+        channel.close(status)
+
+
+def emit(event_type: str, **data):
+    """向当前运行发送事件，不在运行中时什么也不做"""
+    channel = _current_run.get()
+    if channel is not None:
+        channel.publish(event_type, **data)
+
+
+def cancel_run(run_id: str) -> bool:
+    channel = _runs.get(run_id)
+    return channel is not None and channel.cancel()
+
+
+def _on_span(event: str, current: Span):
+    # 流程节点的开始/结束转为进度事件
+    if current.kind != "node" or _current_run.get() is None:
+        return
+    if event == "start":
+        emit("node_start", node=current.name)
+    else:
+        emit("node_end", node=current.name, status=current.status,
+             duration_ms=round(current.duration * 1000, 1))
+
+
+add_span_listener(_on_span)
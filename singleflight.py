@@ -0,0 +1,79 @@
+import asyncio
+import hashlib
+import logging
+import unicodedata
+from typing import Awaitable, Callable, Dict, Optional
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+COALESCED = REGISTRY.counter(
+    "lark_singleflight_coalesced_total", "与进行中的相同请求合并、未重复计算的请求数", ["name"])
+
+
+def normalize_text(text: str) -> str:
+    """统一换行、去掉行尾空白和首尾空行，避免空白差异导致同一内容被视为不同请求"""
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n").replace("\r", "\n")
+    return "\n".join(line.rstrip() for line in text.split("\n")).strip()
+
+
+def content_key(*parts, profile: Optional[str] = None) -> str:
+    """根据请求内容（文本按 normalize_text 规范化，bytes 原样）和模型配置计算合并键"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if part is None:
+            part = b""
+        elif isinstance(part, str):
+            part = normalize_text(part).encode("utf-8")
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    digest.update(f"profile={profile or ''}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    合并进行中的相同请求：同一 key 的并发调用只执行一次 fn()，所有调用方拿到同一结果或同一异常。
+    单个调用方取消（如客户端断开）不影响其他调用方；所有调用方都取消后才取消计算
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[str, _Flight] = {}
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]):
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(fn()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _task, k=key, f=flight: self._forget(k, f))
+        else:
+            COALESCED.inc(name=self.name)
+            logger.info(f"[{self.name}] 合并到进行中的相同请求 {key[:12]}")
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                flight.task.cancel()
+                self._forget(key, flight)
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _forget(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
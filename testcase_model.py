@@ -0,0 +1,272 @@
+import json
+import zlib
+import marshal
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# 测试用例在各模块间流转时的统一表示：入口处规范化一次（字段名、步骤的列表/字符串形式），
+# 之后直接使用；带 __slots__，大量用例时内存占用远小于 dict
+
+_TITLE_KEYS = ("title", "标题")
+_PRECONDITION_KEYS = ("preconditions", "precondition", "前置条件")
+_STEPS_KEYS = ("steps", "步骤")
+_EXPECTED_KEYS = ("expected_results", "expected_result", "预期结果")
+_KNOWN_KEYS = frozenset(("case_id", "id", "category") + _TITLE_KEYS + _PRECONDITION_KEYS + _STEPS_KEYS
+                        + _EXPECTED_KEYS)
+
+_BINARY_MAGIC = b"LTC1"
+_JSON_SEPARATORS = (",", ":")
+
+
+class TestCaseFormatError(ValueError):
+    pass
+
+
+def _first(data: dict, keys: Tuple[str, ...], default=None):
+    for key in keys:
+        value = data.get(key)
+        if value:
+            return value
+    return default
+
+
+def _lines(value) -> Tuple[str, ...]:
+    """步骤/预期结果统一为字符串元组：列表逐项转字符串，字符串按行拆分"""
+    if not value:
+        return ()
+    if isinstance(value, str):
+        return tuple(line.strip() for line in value.split("\n") if line.strip())
+    if isinstance(value, (list, tuple)):
+        return tuple(str(item).strip() for item in value if item is not None and str(item).strip())
+    return (str(value),)
+
+
+def _text(value) -> str:
+    if not value:
+        return ""
+    if isinstance(value, (list, tuple)):
+        return "\n".join(str(item) for item in value)
+    return str(value)
+
+
+class TestCase:
+    __slots__ = ("case_id", "title", "preconditions", "steps", "expected_results", "category", "extra")
+
+    def __init__(self, case_id: str, title: str, preconditions: str = "", steps: Tuple[str, ...] = (),
+                 expected_results: Tuple[str, ...] = (), category: str = "", extra: Optional[dict] = None):
+        self.case_id = case_id
+        self.title = title
+        self.preconditions = preconditions
+        self.steps = steps
+        self.expected_results = expected_results
+        self.category = category
+        # 未识别的字段原样保留，避免丢失信息
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, data: dict, index: int = 0, category: str = "") -> "TestCase":
+        """
+        从任意来源的用例 dict 构建，兼容 precondition/preconditions、中文字段名，
+        以及步骤为列表或多行字符串的写法
+
+        :param index: 缺少 case_id 时用于生成编号（从 0 开始）
+        """
+        if isinstance(data, TestCase):
+            return data
+        if not isinstance(data, dict):
+            raise TestCaseFormatError(f"测试用例应为对象，实际为 {type(data).__name__}")
+        case_id = data.get("case_id") or data.get("id") or f"{index + 1:03d}"
+        extra = {key: value for key, value in data.items() if key not in _KNOWN_KEYS} or None
+        return cls(
+            case_id=str(case_id),
+            title=str(_first(data, _TITLE_KEYS, "")),
+            preconditions=_text(_first(data, _PRECONDITION_KEYS)),
+            steps=_lines(_first(data, _STEPS_KEYS)),
+            expected_results=_lines(_first(data, _EXPECTED_KEYS)),
+            category=data.get("category") or category,
+            extra=extra,
+        )
+
+    def to_dict(self, joined: bool = False) -> dict:
+        """
+        :param joined: True 时步骤和预期结果输出为换行拼接的字符串，否则为列表
+        """
+        data = {
+            "case_id": self.case_id,
+            "title": self.title,
+            "preconditions": self.preconditions,
+            "steps": "\n".join(self.steps) if joined else list(self.steps),
+            "expected_results": "\n".join(self.expected_results) if joined else list(self.expected_results),
+        }
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    @property
+    def steps_text(self) -> str:
+        return "\n".join(self.steps)
+
+    @property
+    def expected_text(self) -> str:
+        return "\n".join(self.expected_results)
+
+    def key(self) -> tuple:
+        """判断重复用例的键：标题、步骤、预期结果完全一致"""
+        return self.title, self.steps, self.expected_results
+
+    def as_tuple(self) -> tuple:
+        return (self.case_id, self.title, self.preconditions, self.steps, self.expected_results,
+                self.category, self.extra)
+
+    def __repr__(self):
+        return f"TestCase({self.case_id!r}, {self.title!r})"
+
+
+def iter_raw_cases(data) -> Iterator[Tuple[dict, str]]:
+    """
+    从常见的几种用例 JSON 结构中依次取出 (用例 dict, 分类)：
+    - [用例, ...]
+    - {"testcases": {"test_suite": ..., "test_cases": [...] 或 {分类: [...]}}} / {"testcases": [...]}
+    - {"test_suite": ..., "test_cases": [...] 或 {分类: [...]}}
+    - {分类: [用例, ...], ...}（按测试类型分组）
+    """
+    if isinstance(data, list):
+        for case in data:
+            yield case, ""
+        return
+    if not isinstance(data, dict):
+        raise TestCaseFormatError(f"无法识别的用例结构: {type(data).__name__}")
+    if "testcases" in data:
+        yield from iter_raw_cases(data["testcases"])
+        return
+    if "test_cases" in data:
+        cases = data["test_cases"]
+        if isinstance(cases, dict):
+            for category, group in cases.items():
+                for case in group if isinstance(group, list) else ():
+                    yield case, category
+        elif isinstance(cases, list):
+            for case in cases:
+                yield case, ""
+        return
+    for category, group in data.items():
+        if isinstance(group, list):
+            for case in group:
+                yield case, category
+
+
+def _suite_name(data) -> str:
+    if isinstance(data, dict):
+        inner = data.get("testcases")
+        if isinstance(inner, dict) and inner.get("test_suite"):
+            return str(inner["test_suite"])
+        if data.get("test_suite"):
+            return str(data["test_suite"])
+    return ""
+
+
+class TestSuite:
+    __slots__ = ("name", "cases")
+
+    def __init__(self, name: str = "", cases: Optional[List[TestCase]] = None):
+        self.name = name
+        self.cases = cases if cases is not None else []
+
+    def __len__(self):
+        return len(self.cases)
+
+    def __iter__(self) -> Iterator[TestCase]:
+        return iter(self.cases)
+
+    @classmethod
+    def from_obj(cls, data, name: Optional[str] = None) -> "TestSuite":
+        """从已解析的 JSON 构建，非对象的条目跳过"""
+        return cls.from_pairs(iter_raw_cases(data), name if name is not None else _suite_name(data))
+
+    @classmethod
+    def from_pairs(cls, pairs: Iterable[Tuple[dict, str]], name: str = "") -> "TestSuite":
+        """从 (用例 dict, 分类) 序列构建（如 iter_raw_cases 或 json_stream 的输出），非对象的条目跳过"""
+        return cls(name, [TestCase.from_dict(case, i, category)
+                          for i, (case, category) in enumerate(pairs) if isinstance(case, dict)])
+
+    @classmethod
+    def from_cases(cls, cases: Iterable, name: str = "") -> "TestSuite":
+        return cls(name, [TestCase.from_dict(case, i) for i, case in enumerate(cases)])
+
+    def by_category(self) -> Dict[str, List[TestCase]]:
+        groups: Dict[str, List[TestCase]] = {}
+        for case in self.cases:
+            groups.setdefault(case.category, []).append(case)
+        return groups
+
+    def dedupe(self) -> int:
+        """移除重复用例（保留第一条），返回移除的数量"""
+        seen = set()
+        unique = []
+        for case in self.cases:
+            key = case.key()
+            if key not in seen:
+                seen.add(key)
+                unique.append(case)
+        removed = len(self.cases) - len(unique)
+        self.cases = unique
+        return removed
+
+    def renumber(self, prefix: str = "", width: int = 3):
+        for i, case in enumerate(self.cases, start=1):
+            case.case_id = f"{prefix}{i:0{width}d}"
+
+    def case_dicts(self, joined: bool = False) -> List[dict]:
+        return [case.to_dict(joined) for case in self.cases]
+
+    def to_obj(self, grouped: bool = False, joined: bool = False) -> dict:
+        """
+        :param grouped: True 时 test_cases 按分类分组为 {分类: [...]}，否则为列表
+        """
+        if grouped:
+            cases = {category or "未分类": [case.to_dict(joined) for case in group]
+                     for category, group in self.by_category().items()}
+        else:
+            cases = self.case_dicts(joined)
+        return {"test_suite": self.name, "test_cases": cases}
+
+    # --- JSON ---
+    def to_json(self, grouped: bool = False, joined: bool = False) -> str:
+        """紧凑 JSON（无缩进），比 indent=2 体积小、编码快，也更省 token"""
+        return json.dumps(self.to_obj(grouped, joined), ensure_ascii=False, separators=_JSON_SEPARATORS)
+
+    @classmethod
+    def from_json(cls, text: str, name: Optional[str] = None) -> "TestSuite":
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise TestCaseFormatError(f"用例 JSON 解析失败: {e}") from e
+        return cls.from_obj(data, name)
+
+    # --- 二进制（供缓存使用，仅在同一 Python 版本的进程间读写） ---
+    def to_bytes(self, compress: bool = False) -> bytes:
+        """
+        :param compress: 是否 zlib 压缩；体积约为原来的 1/4，但编码耗时约为不压缩的 3 倍
+        """
+        payload = marshal.dumps((self.name, [case.as_tuple() for case in self.cases]))
+        if compress:
+            return _BINARY_MAGIC + b"z" + zlib.compress(payload, 1)
+        return _BINARY_MAGIC + b"r" + payload
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "TestSuite":
+        if data[:4] != _BINARY_MAGIC:
+            raise TestCaseFormatError("不是测试用例二进制数据")
+        payload = data[5:]
+        if data[4:5] == b"z":
+            payload = zlib.decompress(payload)
+        try:
+            name, rows = marshal.loads(payload)
+        except (EOFError, ValueError, TypeError) as e:
+            raise TestCaseFormatError(f"测试用例二进制数据损坏: {e}") from e
+        return cls(name, [TestCase(*row) for row in rows])
+
+
+def dumps_cases(cases: Iterable, joined: bool = False) -> str:
+    """把用例（TestCase 或 dict）编码为紧凑 JSON 数组"""
+    return json.dumps([TestCase.from_dict(case, i).to_dict(joined) for i, case in enumerate(cases)],
+                      ensure_ascii=False, separators=_JSON_SEPARATORS)
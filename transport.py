@@ -0,0 +1,258 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+import email.utils
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+from metrics import REGISTRY, record_retry
+from run_events import emit
+
+logger = logging.getLogger(__name__)
+
+# 统一的上游调用策略：指数退避 + 抖动、遵循 Retry-After、进程级重试预算、按上游熔断
+MAX_ATTEMPTS = int(os.environ.get("TRANSPORT_MAX_ATTEMPTS", "3"))
+BASE_DELAY = float(os.environ.get("TRANSPORT_BASE_DELAY", "0.5"))
+MAX_DELAY = float(os.environ.get("TRANSPORT_MAX_DELAY", "20"))
+# Retry-After 超过该值时不再等待，直接失败
+MAX_RETRY_AFTER = float(os.environ.get("TRANSPORT_MAX_RETRY_AFTER", "60"))
+# 重试数不超过请求数的该比例（另有少量初始额度）
+RETRY_BUDGET_RATIO = float(os.environ.get("RETRY_BUDGET_RATIO", "0.1"))
+RETRY_BUDGET_MIN = float(os.environ.get("RETRY_BUDGET_MIN", "10"))
+# 连续失败多少次后熔断，熔断多久后放行一个探测请求
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get("CIRCUIT_RESET_TIMEOUT", "30"))
+
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+CIRCUIT_STATE = REGISTRY.gauge(
+    "lark_circuit_state", "上游熔断状态（0 关闭 / 1 半开 / 2 打开）", ["upstream"])
+RETRY_BUDGET_EXHAUSTED = REGISTRY.counter(
+    "lark_retry_budget_exhausted_total", "因重试预算耗尽而放弃的重试次数", ["upstream"])
+
+
+class TransportError(RuntimeError):
+    """上游调用失败"""
+
+    def __init__(self, upstream: str, message: str, status: Optional[int] = None):
+        super().__init__(f"{upstream}: {message}")
+        self.upstream = upstream
+        self.status = status
+
+
+class RetryableError(TransportError):
+    """可重试的失败（网络错误、超时、429、5xx），retry_after 为上游要求的等待秒数"""
+
+    def __init__(self, upstream: str, message: str, status: Optional[int] = None,
+                 retry_after: Optional[float] = None):
+        super().__init__(upstream, message, status)
+        self.retry_after = retry_after
+
+    @property
+    def reason(self) -> str:
+        return f"http_{self.status}" if self.status else "network"
+
+
+class CircuitOpenError(TransportError):
+    """上游处于熔断状态，快速失败"""
+
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(upstream, f"熔断中，{retry_after:.0f}s 后重试", 503)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头，支持秒数和 HTTP 日期两种格式"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """第 attempt 次重试前的等待时间：full jitter 指数退避，上游给出 Retry-After 时以其为下限"""
+    delay = random.uniform(0, min(MAX_DELAY, BASE_DELAY * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class RetryBudget:
+    """令牌桶：每个请求积攒 ratio 个令牌，每次重试消耗 1 个，避免上游故障时重试风暴"""
+
+    def __init__(self, ratio: float, minimum: float):
+        self.ratio = ratio
+        self.maximum = max(minimum, 1.0)
+        self._tokens = self.maximum
+        self._lock = threading.Lock()
+
+    def on_request(self):
+        with self._lock:
+            self._tokens = min(self.maximum, self._tokens + self.ratio)
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class CircuitBreaker:
+    """连续失败达到阈值后打开；打开期间快速失败，超时后半开放行一个探测请求"""
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, upstream: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.upstream = upstream
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.set(self.CLOSED, upstream=upstream)
+
+    def _set_state(self, state: int):
+        if state != self.state:
+            logger.warning(f"上游 {self.upstream} 熔断状态 {self.state} -> {state}")
+        self.state = state
+        CIRCUIT_STATE.set(state, upstream=self.upstream)
+
+    def before_call(self):
+        """调用前检查，熔断中抛出 CircuitOpenError"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if self.state == self.OPEN and remaining <= 0:
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+        raise CircuitOpenError(self.upstream, max(remaining, 1.0))
+
+    def on_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            self._set_state(self.CLOSED)
+
+    def release(self):
+        """探测请求被取消时归还探测名额"""
+        with self._lock:
+            self._probing = False
+
+    def on_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+
+RETRY_BUDGET = RetryBudget(RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN)
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(upstream: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(upstream)
+        if breaker is None:
+            breaker = _breakers[upstream] = CircuitBreaker(upstream)
+        return breaker
+
+
+async def call_with_retries(upstream: str, attempt: Callable[[], Awaitable], max_attempts: int = MAX_ATTEMPTS):
+    """
+    按统一策略执行 attempt()：attempt 抛出 RetryableError 时退避重试，其他异常直接抛出
+
+    :param upstream: 上游名称，用于熔断和指标，如 ark / feishu
+    """
+    breaker = get_breaker(upstream)
+    RETRY_BUDGET.on_request()
+    for i in range(max_attempts):
+        breaker.before_call()
+        try:
+            result = await attempt()
+        except RetryableError as e:
+            breaker.on_failure()
+            if i + 1 >= max_attempts:
+                raise
+            if e.retry_after is not None and e.retry_after > MAX_RETRY_AFTER:
+                logger.warning(f"{upstream} 要求等待 {e.retry_after:.0f}s，超过上限，放弃重试")
+                raise
+            if not RETRY_BUDGET.try_acquire():
+                RETRY_BUDGET_EXHAUSTED.inc(upstream=upstream)
+                logger.warning(f"{upstream} 重试预算耗尽，放弃重试: {e}")
+                raise
+            delay = backoff_delay(i, e.retry_after)
+            record_retry(upstream, e.reason)
+            emit("retry", upstream=upstream, reason=e.reason, attempt=i + 2, delay=round(delay, 2))
+            logger.info(f"{upstream} 调用失败（{e}），{delay:.1f}s 后第 {i + 1} 次重试")
+            await asyncio.sleep(delay)
+            continue
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except BaseException:
+            # 非上游故障（如参数错误、解析失败）不计入熔断
+            breaker.on_success()
+            raise
+        breaker.on_success()
+        return result
+
+
+def check_response(upstream: str, response: httpx.Response):
+    """按状态码把 httpx 响应转换为对应的异常"""
+    if response.status_code < 400:
+        return
+    message = f"HTTP {response.status_code}: {response.text[:200]}"
+    if response.status_code in RETRY_STATUSES:
+        raise RetryableError(upstream, message, response.status_code,
+                             parse_retry_after(response.headers.get("Retry-After")))
+    raise TransportError(upstream, message, response.status_code)
+
+
+async def request_json(upstream: str, method: str, url: str, *, timeout: float = 180,
+                       client: Optional[httpx.AsyncClient] = None, max_attempts: int = MAX_ATTEMPTS,
+                       **kwargs) -> dict:
+    """
+    发送请求并返回 JSON，失败时抛出 TransportError 或其子类
+
+    :param max_attempts: 最多尝试次数；非幂等请求（如一次性授权码换 token）传 1，超时后不再重发
+    """
+
+    async def attempt():
+        try:
+            if client is not None:
+                response = await client.request(method, url, timeout=timeout, **kwargs)
+            else:
+                async with httpx.AsyncClient(timeout=timeout) as own_client:
+                    response = await own_client.request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            raise RetryableError(upstream, f"{type(e).__name__}: {e}") from e
+        check_response(upstream, response)
+        return response.json()
+
+    return await call_with_retries(upstream, attempt, max_attempts)
+
+
+async def post_json(upstream: str, url: str, payload: dict, headers: Optional[dict] = None,
+                    timeout: float = 180) -> dict:
+    return await request_json(upstream, "POST", url, json=payload, headers=headers, timeout=timeout)
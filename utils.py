@@ -1,6 +1,5 @@
 import re
 import httpx
-from bs4 import BeautifulSoup
 
 
 # 清洗文本内容
@@ -16,6 +15,8 @@ async def fetch_webpage_content(url: str) -> dict:
         resp.raise_for_status()
         html = resp.text
 
+    # bs4 只在抓取网页时使用，按需导入
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(html, "html.parser")
 
     # 提取文本内容